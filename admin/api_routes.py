@@ -1,13 +1,26 @@
+import os
 import uuid
-import json
+import random
+import secrets
+import string
 from flask import Blueprint, jsonify, request
 from admin.routes import admin_required
 from utils.email_helper import send_mass_email_thread
 from utils.encryption import encrypt_data # <-- Import the new encryptor
-from database.redis_db import (
-    get_all_users_from_db, save_all_users_to_db,
-    get_all_data_from_db, save_all_data_to_db,
-    redis_client
+from database.redis_db import get_settings_for_users, delete_user_data_from_db, doc_cache
+from database.command_queue import command_queue
+from database.presence import fleet_counts, stale_boards
+from database.events import publish_change
+from database.mutations import set_board_suspended, set_board_token_hash, MutationError
+from mqtt.status import status_ingestor
+from mqtt.client import mqtt_publisher
+from database.users_db import (
+    get_user_record, get_all_user_ids, get_all_user_records,
+    save_user_record, delete_user_record
+)
+from database.boards_db import (
+    get_all_boards_from_db, create_board_in_db, delete_boards_from_db, delete_all_boards_from_db, new_board_token,
+    count_all_boards
 )
 from flask_login import current_user
 
@@ -22,13 +35,6 @@ def _generate_random_string(length=8):
 def _generate_random_int(max_digits=8):
     return random.randint(0, 10**max_digits - 1)
 
-def get_all_boards_from_db():
-    boards_json = redis_client.get('boards')
-    return json.loads(boards_json) if boards_json else {}
-
-def save_all_boards_to_db(boards_dict):
-    redis_client.set('boards', json.dumps(boards_dict))
-
 @admin_api_bp.route('/generate-board', methods=['POST'])
 @admin_required
 def generate_board():
@@ -70,16 +76,16 @@ def generate_board():
         "room_id": None,
         "is_suspended": False
     }
+    token, board_data['token_hash'] = new_board_token()
     
-    all_boards = get_all_boards_from_db()
-    all_boards[board_id] = board_data
-    save_all_boards_to_db(all_boards)
+    create_board_in_db(board_data)
     
     return jsonify({
         "status": "success",
         "message": f"Board {board_id} created.",
         "qr_data": board_id,
-        "board_id": board_id
+        "board_id": board_id,
+        "board_token": token  # Flashed into the board's firmware for /api/esp/board-checkin; only its hash is stored
     }), 200
 
 
@@ -87,12 +93,12 @@ def generate_board():
 @admin_required
 def get_all_users():
     """Fetches all users for the admin dashboard."""
-    users = get_all_users_from_db()
-    data = get_all_data_from_db()
+    users = get_all_user_records()
+    all_settings = get_settings_for_users(user['id'] for user in users)
     
     user_list = []
     for user in users:
-        user_info = data.get(user['id'], {}).get('user_settings', {})
+        user_info = all_settings.get(user['id'], {})
         user_list.append({
             "id": user['id'],
             "username": user['username'],
@@ -109,24 +115,19 @@ def delete_user():
     if user_id_to_delete == current_user.id:
         return jsonify({"status": "error", "message": "Admin cannot delete themselves."}), 400
     
-    users = get_all_users_from_db()
-    data = get_all_data_from_db()
-    updated_users = [user for user in users if user.get('id') != user_id_to_delete]
-    if user_id_to_delete in data: del data[user_id_to_delete]
-        
-    save_all_users_to_db(updated_users)
-    save_all_data_to_db(data)
+    delete_user_record(user_id_to_delete)
+    delete_user_data_from_db(user_id_to_delete)
     return jsonify({"status": "success", "message": f"User {user_id_to_delete} has been deleted."})
 
 @admin_api_bp.route('/boards', methods=['GET'])
 @admin_required
 def get_all_boards():
     """Fetches all generated boards for the admin dashboard."""
-    all_boards = get_all_boards_from_db()
     board_list = []
-    for board_id, board in all_boards.items():
+    for board in get_all_boards_from_db():
         # Ensure is_suspended field exists
         board['is_suspended'] = board.get('is_suspended', False) # <-- ADDED
+        board['has_token'] = bool(board.pop('token_hash', None))
         board_list.append(board)
     return jsonify(board_list)
 
@@ -136,10 +137,7 @@ def get_all_boards():
 @admin_required
 def delete_board():
     board_id_to_delete = request.json['board_id']
-    all_boards = get_all_boards_from_db()
-    if board_id_to_delete in all_boards:
-        del all_boards[board_id_to_delete]
-        save_all_boards_to_db(all_boards)
+    if delete_boards_from_db([board_id_to_delete]):
         return jsonify({"status": "success", "message": f"Board {board_id_to_delete} has been deleted."})
     return jsonify({"status": "error", "message": "Board not found."}), 404
 
@@ -153,21 +151,14 @@ def delete_boards():
     if not board_ids_to_delete:
         return jsonify({"status": "error", "message": "No board IDs provided."}), 400
     
-    all_boards = get_all_boards_from_db()
-    deleted_count = 0
-    for board_id in board_ids_to_delete:
-        if board_id in all_boards:
-            del all_boards[board_id]
-            deleted_count += 1
-            
-    save_all_boards_to_db(all_boards)
+    deleted_count = delete_boards_from_db(board_ids_to_delete)
     return jsonify({"status": "success", "message": f"{deleted_count} board(s) have been deleted."})
 
 @admin_api_bp.route('/delete-all-boards', methods=['POST'])
 @admin_required
 def delete_all_boards():
     """Deletes all boards from the database."""
-    save_all_boards_to_db({}) # Save an empty dictionary
+    delete_all_boards_from_db()
     return jsonify({"status": "success", "message": "All boards have been deleted."})
 
 
@@ -182,16 +173,10 @@ def suspend_user():
     if user_id == current_user.id:
         return jsonify({"status": "error", "message": "Admin cannot change their own status."}), 400
 
-    users = get_all_users_from_db()
-    user_found = False
-    for user in users:
-        if user.get('id') == user_id:
-            user['is_suspended'] = suspend_status
-            user_found = True
-            break
-    
-    if user_found:
-        save_all_users_to_db(users)
+    user = get_user_record(user_id)
+    if user:
+        user['is_suspended'] = suspend_status
+        save_user_record(user)
         action = "suspended" if suspend_status else "unsuspended"
         return jsonify({"status": "success", "message": f"User {user_id} has been {action}."})
     return jsonify({"status": "error", "message": "User not found."}), 404
@@ -204,13 +189,66 @@ def suspend_board():
     board_id = data['board_id']
     suspend_status = data['status']
 
-    boards = get_all_boards_from_db()
-    if board_id in boards:
-        boards[board_id]['is_suspended'] = suspend_status
-        save_all_boards_to_db(boards)
-        action = "suspended" if suspend_status else "unsuspended"
-        return jsonify({"status": "success", "message": f"Board {board_id} has been {action}."})
-    return jsonify({"status": "error", "message": "Board not found."}), 404
+    try:
+        board = set_board_suspended(board_id, suspend_status)
+    except MutationError as e:
+        return jsonify({"status": "error", "message": e.message}), e.status
+    if board.get('owner_id'):
+        publish_change(board['owner_id'], ['boards'], board_ids=[board_id])
+    action = "suspended" if suspend_status else "unsuspended"
+    return jsonify({"status": "success", "message": f"Board {board_id} has been {action}."})
+
+@admin_api_bp.route('/rotate-board-token', methods=['POST'])
+@admin_required
+def rotate_board_token():
+    """Issues a new token for one board, revoking its old one. The new token is only shown in this response."""
+    board_id = request.json['board_id']
+    token, token_hash = new_board_token()
+    try:
+        set_board_token_hash(board_id, token_hash)
+    except MutationError as e:
+        return jsonify({"status": "error", "message": e.message}), e.status
+    return jsonify({"status": "success", "message": f"Board {board_id} has a new token.", "board_token": token})
+
+@admin_api_bp.route('/fleet-presence', methods=['GET'])
+@admin_required
+def fleet_presence():
+    """
+    Online/offline board and relay counts, plus a page of offline boards (most
+    recently seen first). Page with ?limit=&before=<next_before>.
+    """
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 500)
+    before = request.args.get('before', type=float)
+    counts = fleet_counts(count_all_boards())
+    boards, next_before = stale_boards(limit, before)
+    return jsonify(dict(counts, stale_boards=boards, next_before=next_before))
+
+@admin_api_bp.route('/cache-stats', methods=['GET'])
+@admin_required
+def cache_stats():
+    """Reports the document cache counters of the worker that served this request."""
+    return jsonify(dict(doc_cache.info(), worker_pid=os.getpid()))
+
+@admin_api_bp.route('/command-metrics', methods=['GET'])
+@admin_required
+def command_metrics():
+    """Fleet-wide relay command latency histograms, for tuning device poll intervals."""
+    return jsonify({
+        "queue_to_delivery": command_queue.queue_to_delivery.snapshot(),
+        "delivery_to_ack": command_queue.delivery_to_ack.snapshot(),
+    })
+
+@admin_api_bp.route('/status-ingest-stats', methods=['GET'])
+@admin_required
+def status_ingest_stats():
+    """Reports the device status buffer counters of the worker that served this request."""
+    return jsonify(dict(status_ingestor.info(), worker_pid=os.getpid()))
+
+@admin_api_bp.route('/mqtt-stats', methods=['GET'])
+@admin_required
+def mqtt_stats():
+    """Reports the MQTT publisher's connection, queue depth and publish rate for the worker that served this request."""
+    return jsonify(dict(mqtt_publisher.info(), worker_pid=os.getpid()))
 
 @admin_api_bp.route('/send-mass-email', methods=['POST'])
 @admin_required
@@ -220,10 +258,11 @@ def send_mass_email():
     if not subject or not body:
         return jsonify({"status": "error", "message": "Subject and body are required."}), 400
 
+    all_settings = get_settings_for_users(get_all_user_ids())
     recipients = {
-        user_data.get('user_settings', {}).get('email')
-        for user_data in get_all_data_from_db().values()
-        if user_data.get('user_settings', {}).get('email')
+        settings.get('email')
+        for settings in all_settings.values()
+        if settings.get('email')
     }
     
     if not recipients:
@@ -1,8 +1,7 @@
 from werkzeug.security import generate_password_hash
-from database.redis_db import (
-    get_all_users_from_db, save_all_users_to_db, 
-    get_all_data_from_db, save_all_data_to_db
-)
+from database.redis_db import get_user_settings_from_db, save_user_settings_to_db, save_user_data_to_db
+from database.users_db import save_user_record, next_user_id
+from database.events import publish_change
 from auth.models import get_user_by_email, create_default_user_data
 
 def init_admin(app):
@@ -21,40 +20,37 @@ def init_admin(app):
             print("INFO: Admin credentials not set in environment. Skipping admin initialization.")
             return
 
-        all_users = get_all_users_from_db()
-        all_data = get_all_data_from_db()
         admin_user_record = get_user_by_email(admin_email)
         hashed_password = generate_password_hash(admin_password)
 
         if not admin_user_record:
             print(f"INFO: Admin user '{admin_email}' not found. Creating new admin account.")
-            new_user_id = str(int(all_users[-1]['id']) + 1) if all_users else "1"
+            new_user_id = next_user_id()
             new_admin_user = {
                 'id': new_user_id, 'username': admin_username, 'password_hash': hashed_password,
                 'google_id': admin_google_id, 
                 'github_id': admin_github_id,
                 'is_admin': True
             }
-            all_users.append(new_admin_user)
-            all_data[new_user_id] = create_default_user_data(name=admin_username, email=admin_email)
+            save_user_record(new_admin_user)
+            save_user_data_to_db(new_user_id, create_default_user_data(name=admin_username, email=admin_email))
         else:
             print(f"INFO: Found user '{admin_email}'. Verifying admin status and credentials.")
             admin_id = admin_user_record['id']
-            for user in all_users:
-                if user['id'] == admin_id:
-                    user.update({
-                        'username': admin_username, 'password_hash': hashed_password,
-                        'google_id': admin_google_id,
-                        'github_id': admin_github_id,
-                        'is_admin': True
-                    })
-                    break
-            if admin_id in all_data:
-                all_data[admin_id]['user_settings']['name'] = admin_username
-                all_data[admin_id]['user_settings']['email'] = admin_email
+            admin_user_record.update({
+                'username': admin_username, 'password_hash': hashed_password,
+                'google_id': admin_google_id,
+                'github_id': admin_github_id,
+                'is_admin': True
+            })
+            save_user_record(admin_user_record)
+            admin_settings = get_user_settings_from_db(admin_id)
+            if admin_settings:
+                admin_settings['name'] = admin_username
+                admin_settings['email'] = admin_email
+                save_user_settings_to_db(admin_id, admin_settings)
             else: 
-                all_data[admin_id] = create_default_user_data(name=admin_username, email=admin_email)
+                save_user_data_to_db(admin_id, create_default_user_data(name=admin_username, email=admin_email))
+            publish_change(admin_id, ['settings'])
 
-        save_all_users_to_db(all_users)
-        save_all_data_to_db(all_data)
         print("SUCCESS: Admin account initialization complete.")
@@ -1,9 +1,9 @@
 from functools import wraps
 from flask import Blueprint, render_template, request, flash, redirect, url_for, abort
-from flask_login import current_user
+from flask_login import current_user, login_user, logout_user
 from werkzeug.security import check_password_hash
-from auth.models import User
-from database.redis_db import get_all_users_from_db, get_all_data_from_db
+from auth.models import User, get_user_by_email
+from database.users_db import get_user_record, get_user_by_username
 
 admin_bp = Blueprint('admin', __name__, template_folder='../templates/admin', url_prefix='/secret-admin-panel')
 
@@ -15,8 +15,7 @@ def admin_required(f):
             return redirect(url_for('admin.login'))
         
         # Fetch the user's full record to check the admin flag
-        users = get_all_users_from_db()
-        admin_user_data = next((u for u in users if u.get('id') == current_user.id), None)
+        admin_user_data = get_user_record(current_user.id)
         
         if not admin_user_data or not admin_user_data.get('is_admin'):
             abort(403) # Forbidden
@@ -27,8 +26,7 @@ def admin_required(f):
 def login():
     if current_user.is_authenticated:
         # Bug Fix: Correctly check if the currently logged-in user is an admin
-        users = get_all_users_from_db()
-        user_record = next((u for u in users if u.get('id') == current_user.id), None)
+        user_record = get_user_record(current_user.id)
         if user_record and user_record.get('is_admin'):
             return redirect(url_for('admin.dashboard'))
 
@@ -36,18 +34,11 @@ def login():
         login_identifier = request.form['username'] # This can be a username OR an email
         password = request.form['password']
         
-        all_users = get_all_users_from_db()
-        all_data = get_all_data_from_db()
-        user_data = None
-
         # --- Find user by username OR email ---
-        user_data = next((u for u in all_users if u.get('username') == login_identifier), None)
+        user_data = get_user_by_username(login_identifier)
 
         if not user_data:
-            for user_id, data_record in all_data.items():
-                if data_record.get("user_settings", {}).get("email") == login_identifier:
-                    user_data = next((u for u in all_users if u.get('id') == user_id), None)
-                    break
+            user_data = get_user_by_email(login_identifier)
         
         # --- NEW: Improved Validation Logic ---
         if not user_data:
@@ -4,14 +4,30 @@ from datetime import datetime
 from flask import Blueprint, request, jsonify, current_app
 from flask_login import login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
-from database.redis_db import get_all_data_from_db, save_all_data_to_db, get_all_users_from_db, save_all_users_to_db
-from utils.helpers import get_user_data, save_user_data
-from mqtt.client import mqtt_client
+from database.redis_db import get_user_settings_from_db, save_user_settings_to_db, save_user_data_to_db
+from database.users_db import get_user_record, save_user_record
+from database.mutations import mutate_user_rooms, set_unlocked_appliance_states, MutationError
+from database.boards_db import get_owned_board_ids
+from database.timers import cancel_timers
+from database.events import publish_change
+from mqtt.client import mqtt_publisher
+from utils.helpers import versioned_json
+from utils.relays import send_relay_states, publish_appliance_changes
 from config import Config
 from utils.email_helper import send_detection_email_thread
 
 ai_api_bp = Blueprint('ai_api', __name__)
 
+def _dispatch_ai_changes(user_id, changed):
+    """
+    Sends the appliances an AI signal switched to their relays (on boards the
+    user owns) in one pipelined batch, and tells the user's dashboards.
+    """
+    owned = get_owned_board_ids(user_id)
+    send_relay_states([a for _, a in changed if a.get('board_id') in owned])
+    cancel_timers(user_id, [a['id'] for _, a in changed if not a['state']])
+    publish_appliance_changes(user_id, changed)
+
 @ai_api_bp.route('/global-ai-signal', methods=['POST'])
 @login_required # It's safer to require a login for this
 def global_ai_signal():
@@ -22,31 +38,17 @@ def global_ai_signal():
     human_detected = data.get('state', False)
     
     try:
-        # MODIFICATION: Use Redis helpers
-        all_data = get_all_data_from_db()
-        user_data = all_data.get(current_user.id)
-        if not user_data:
-            return jsonify({"status": "error", "message": "User data not found."}), 404
-
-        # Iterate through the rooms of the current user
-        for room in user_data.get('rooms', []):
-            for appliance in room.get('appliances', []):
-                if not appliance.get('locked', False):
-                    appliance['state'] = human_detected
-        
-        save_all_data_to_db(all_data)
-        
-        # ... (your MQTT logic) ...
-        if mqtt_client:
-            mqtt_client.publish(Config.MQTT_TOPIC_COMMAND, f"global:all:ai:{int(human_detected)}")
-
-        # Line around global_ai_signal function - these variables are used but not defined:
-        action_str = "ON" if human_detected else "OFF"  # Add this line
-        updated_count = sum(1 for room in user_data.get('rooms', []) 
-                           for appliance in room.get('appliances', []) 
-                           if not appliance.get('locked', False))  # Add this line
-        
-        message = f"Global signal processed. Turned {action_str} {updated_count} unlocked appliances."
+        try:
+            changed = set_unlocked_appliance_states(current_user.id, human_detected)
+        except MutationError as e:
+            return jsonify({"status": "error", "message": e.message}), e.status
+
+        # Per-relay commands for the appliances that changed, then the legacy broadcast
+        _dispatch_ai_changes(current_user.id, changed)
+        mqtt_publisher.publish(Config.MQTT_TOPIC_COMMAND, f"global:all:ai:{int(human_detected)}")
+
+        action_str = "ON" if human_detected else "OFF"
+        message = f"Global signal processed. Turned {action_str} {len(changed)} unlocked appliances."
         return jsonify({"status": "success", "message": message}), 200
         
     except Exception as e:
@@ -59,23 +61,22 @@ def get_user_settings():
     """
     Fetches all settings for the current user from the Redis database.
     """
-    try:
-        # 1. Get the user's application data (settings, rooms, etc.) from the 'data' key in Redis
-        all_data = get_all_data_from_db()
-        user_data = all_data.get(current_user.id, {})
-        settings = user_data.get('user_settings', {})
+    def _settings():
+        # 1. Get the user's settings from their own settings key in Redis
+        settings = get_user_settings_from_db(current_user.id)
 
-        # 2. Get the user's authentication record (for google_id, etc.) from the 'users' key in Redis
-        all_users = get_all_users_from_db()
-        user_record = next((u for u in all_users if u.get('id') == current_user.id), None)
+        # 2. Get the user's authentication record (for google_id, etc.) from their record key in Redis
+        user_record = get_user_record(current_user.id)
 
         # 3. Merge the information into one object for the frontend
         if user_record:
             settings['google_id'] = user_record.get('google_id')
             settings['github_id'] = user_record.get('github_id')
             settings['has_password'] = user_record.get('password_hash') is not None
-        
-        return jsonify(settings), 200
+        return settings
+
+    try:
+        return versioned_json(_settings)
     except Exception as e:
         print(f"Error in /api/get-user-settings: {e}")
         return jsonify({"status": "error", "message": "Could not load user settings."}), 500
@@ -85,9 +86,10 @@ def get_user_settings():
 def set_user_settings():
     try:
         new_settings = request.json
-        user_data = get_user_data()
-        user_data['user_settings'].update(new_settings)
-        save_user_data(user_data)
+        settings = get_user_settings_from_db(current_user.id)
+        settings.update(new_settings)
+        save_user_settings_to_db(current_user.id, settings)
+        publish_change(current_user.id, ['settings'])
         return jsonify({"status": "success", "message": "Settings updated."}), 200
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
@@ -100,8 +102,7 @@ def change_password():
         new_password = data_from_request['new_password']
         
         # MODIFICATION: Use the new Redis helper functions
-        all_users = get_all_users_from_db()
-        user_found = next((user for user in all_users if user['id'] == current_user.id), None)
+        user_found = get_user_record(current_user.id)
         
         if not user_found:
             return jsonify({"status": "error", "message": "User not found."}), 404
@@ -109,7 +110,8 @@ def change_password():
         # Logic for setting a password for the first time (for OAuth users)
         if not user_found.get('password_hash'):
             user_found['password_hash'] = generate_password_hash(new_password)
-            save_all_users_to_db(all_users)
+            save_user_record(user_found)
+            publish_change(current_user.id, ['settings'])
             return jsonify({"status": "success", "message": "Password set successfully."}), 200
 
         # Logic for changing an existing password
@@ -118,7 +120,8 @@ def change_password():
             return jsonify({"status": "error", "message": "Invalid old password."}), 400
             
         user_found['password_hash'] = generate_password_hash(new_password)
-        save_all_users_to_db(all_users)
+        save_user_record(user_found)
+        publish_change(current_user.id, ['settings'])
         return jsonify({"status": "success", "message": "Password updated successfully."}), 200
             
     except Exception as e:
@@ -130,13 +133,14 @@ def set_global_ai_control():
     try:
         data_from_request = request.json
         state = data_from_request['state']
-        user_data = get_user_data()
 
-        for room in user_data['rooms']:
-            room['ai_control'] = state
-        
-        save_user_data(user_data)
-        
+        def _set_ai_control(rooms):
+            for room in rooms:
+                room['ai_control'] = state
+
+        mutate_user_rooms(current_user.id, _set_ai_control)
+        publish_change(current_user.id, ['rooms'])
+
         action = "enabled" if state else "disabled"
         message = f"AI control for all rooms has been {action}."
         
@@ -152,35 +156,21 @@ def ai_detection_signal():
         room_id = data_from_request.get('room_id') # Can be None for global
         state = data_from_request['state']
         
-        user_data = get_user_data()
+        # Per-room control when room_id is given, otherwise global
+        try:
+            changed = set_unlocked_appliance_states(current_user.id, state, room_id)
+        except MutationError as e:
+            return jsonify({"status": "error", "message": e.message}), e.status
 
-        if room_id:
-            # Per-room control
-            room = next((r for r in user_data['rooms'] if r['id'] == room_id), None)
-            if not room:
-                return jsonify({"status": "error", "message": "Room not found."}), 404
-            
-            for appliance in room['appliances']:
-                if not appliance['locked']:
-                    appliance['state'] = state
-        else:
-            # Global control
-            for room in user_data['rooms']:
-                for appliance in room['appliances']:
-                    if not appliance['locked']:
-                        appliance['state'] = state
-
-        user_data['last_command'] = {
+        _dispatch_ai_changes(current_user.id, changed)
+        save_user_data_to_db(current_user.id, {'last_command': {
             "room_id": room_id,
             "state": state,
             "timestamp": int(time.time())
-        }
-        
-        save_user_data(user_data)
+        }})
 
-        if mqtt_client:
-            topic_payload = f"{current_user.id}:{room_id or 'all'}:ai:{int(state)}"
-            mqtt_client.publish(Config.MQTT_TOPIC_COMMAND, topic_payload)
+        topic_payload = f"{current_user.id}:{room_id or 'all'}:ai:{int(state)}"
+        mqtt_publisher.publish(Config.MQTT_TOPIC_COMMAND, topic_payload)
 
         action = "activated" if state else "deactivated"
         message = f"AI control has been {action}."
@@ -198,8 +188,7 @@ def send_detection_email():
         is_global = data_from_request.get('is_global', False)
         image_data = data_from_request['image_data']
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        user_data = get_user_data()
-        recipient_email = user_data['user_settings']['email']
+        recipient_email = get_user_settings_from_db(current_user.id).get('email')
         
         if not recipient_email:
             print("No recipient email found in user settings. Email not sent.")
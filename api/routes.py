@@ -1,10 +1,24 @@
 import time
-import uuid
-from flask import Blueprint, request, jsonify
+import queue
+from flask import Blueprint, Response, request, jsonify
 from flask_login import login_required, current_user
-from database.redis_db import get_all_data_from_db, save_all_data_to_db, get_all_users_from_db, save_all_users_to_db
-from admin.api_routes import get_all_boards_from_db, save_all_boards_to_db
-from utils.helpers import get_user_data, save_user_data
+from database.boards_db import (
+    get_board_from_db, get_boards_for_owner, get_boards_for_room, verify_board_token, without_secrets
+)
+from database import mutations, ordering, scenes
+from database.sync import build_delta
+from database.redis_db import fresh_reads
+from database.batch import run_batch, MAX_BATCH_OPERATIONS
+from database.mutations import MutationError
+from database.command_queue import command_queue, long_polling_available
+from database.timers import schedule_timer, cancel_timer, cancel_timers
+from database.presence import record_seen, annotate_presence
+from database.telemetry import get_relay_statuses
+from database.events import publish_change, event_hub, streaming_available
+from mqtt.client import clear_relay_state, clear_board_state
+from utils.helpers import get_user_rooms, versioned_json
+from utils.relays import send_relay_states, publish_appliance_changes
+from utils.timer_scheduler import ensure_timer_scheduler
 from utils.encryption import decrypt_data
 from utils.email_helper import send_detection_email_thread
 from analytics.data_processing import load_analytics_data, calculate_statistics
@@ -12,20 +26,82 @@ from config import Config
 
 api_bp = Blueprint('api', __name__)
 
-# --- ESP Check-in Queue for Device Communication ---
-check_in_queue = {}
+# --- ESP Check-in for Device Communication ---
+# Commands are queued per relay in Redis (see database/command_queue.py).
 
 @api_bp.route('/esp/checkin/<string:relay_id>')
 def esp_checkin(relay_id):
     """
     Check-in endpoint for ESP devices. Devices poll this to get commands.
     Security is implicitly handled by the unguessable `relay_id` UUID.
+    Each command carries a `seq` the device must ack via /esp/ack once it is
+    applied; until then the command is re-sent every COMMAND_ACK_TIMEOUT seconds.
+    Devices may pass `?wait=<seconds>` to long-poll: the request is held until
+    a command arrives or the wait (capped at CHECKIN_LONG_POLL_MAX) runs out.
+    Workers that cannot hold requests cheaply answer immediately instead.
     """
-    command = check_in_queue.pop(relay_id, None)
+    record_seen(relay_ids=[relay_id])
+    wait = request.args.get('wait', 0, type=float)
+    if wait > 0 and long_polling_available():
+        command = command_queue.wait(relay_id, min(wait, Config.CHECKIN_LONG_POLL_MAX))
+    else:
+        command = command_queue.pop(relay_id)
     if command:
         return jsonify(command), 200
     return jsonify({}), 204  # No Content
 
+@api_bp.route('/esp/board-checkin/<string:board_id>')
+def esp_board_checkin(board_id):
+    """
+    Board-level check-in: returns the pending command of every relay on the
+    board in one response, as {"commands": {relay_id: command}}. The board
+    authenticates with the X-Board-Token header it was provisioned with.
+    Supports the same `?wait=<seconds>` long polling as the per-relay check-in.
+    """
+    board = get_board_from_db(board_id)
+    if not verify_board_token(board, request.headers.get('X-Board-Token')):
+        return jsonify({"error": "Invalid board credentials."}), 401
+    if board.get('is_suspended'):
+        return jsonify({"error": "This board has been suspended."}), 403
+
+    relay_ids = [relay['id'] for relay in board.get('relays', [])]
+    record_seen([board_id], relay_ids)
+    wait = request.args.get('wait', 0, type=float)
+    if wait > 0 and long_polling_available():
+        commands = command_queue.wait_many(relay_ids, min(wait, Config.CHECKIN_LONG_POLL_MAX))
+    else:
+        commands = command_queue.pop_many(relay_ids)
+    if commands:
+        return jsonify({"commands": commands}), 200
+    return jsonify({}), 204  # No Content
+
+@api_bp.route('/esp/ack/<string:relay_id>', methods=['POST'])
+def esp_ack(relay_id):
+    """Called by a relay after applying a command, with {"seq": <the command's seq>}."""
+    seq = (request.get_json(silent=True) or {}).get('seq')
+    if not isinstance(seq, int) or isinstance(seq, bool):
+        return jsonify({"error": "A numeric 'seq' is required."}), 400
+    record_seen(relay_ids=[relay_id])
+    if not command_queue.ack(relay_id, seq):
+        return jsonify({"acked": False, "message": "No command with this seq is awaiting an ack."}), 409
+    return jsonify({"acked": True}), 200
+
+@api_bp.route('/esp/board-ack/<string:board_id>', methods=['POST'])
+def esp_board_ack(board_id):
+    """Board-level ack with {"acks": {relay_id: seq}}, authenticated like the board check-in."""
+    board = get_board_from_db(board_id)
+    if not verify_board_token(board, request.headers.get('X-Board-Token')):
+        return jsonify({"error": "Invalid board credentials."}), 401
+
+    acks = (request.get_json(silent=True) or {}).get('acks')
+    board_relays = {relay['id'] for relay in board.get('relays', [])}
+    valid = isinstance(acks, dict) and all(
+        r in board_relays and isinstance(seq, int) and not isinstance(seq, bool) for r, seq in acks.items())
+    if not valid:
+        return jsonify({"error": "'acks' must map this board's relay IDs to numeric seqs."}), 400
+    record_seen([board_id], list(acks))
+    return jsonify({"acked": command_queue.ack_many(acks)}), 200
+
 # --- Board Management ---
 
 @api_bp.route('/register-board', methods=['POST'])
@@ -37,63 +113,64 @@ def register_board():
     if not room_id or not board_id:
         return jsonify({"status": "error", "message": "Room ID and Board ID are required."}), 400
 
-    all_boards = get_all_boards_from_db()
-    board = all_boards.get(board_id)
-
-    if not board:
-        return jsonify({"status": "error", "message": "Board ID is not valid or has not been generated."}), 404
-    if board.get('owner_id'):
-        return jsonify({"status": "error", "message": "This board is already registered."}), 409
+    try:
+        mutations.register_board(current_user.id, room_id, board_id)
+    except MutationError as e:
+        return jsonify({"status": "error", "message": e.message}), e.status
 
-    board['owner_id'] = current_user.id
-    board['room_id'] = room_id
-    save_all_boards_to_db(all_boards)
+    publish_change(current_user.id, ['boards'], board_ids=[board_id])
     return jsonify({"status": "success", "message": f"Board {board_id} successfully registered."})
     
 @api_bp.route('/unregister-board', methods=['POST'])
 @login_required
 def unregister_board():
     board_id = request.json.get('board_id')
-    all_boards = get_all_boards_from_db()
-    all_data = get_all_data_from_db()
-    user_data = all_data.get(current_user.id, {})
+    board = get_board_from_db(board_id)
     
-    board = all_boards.get(board_id)
     if not board or board.get('owner_id') != current_user.id:
         return jsonify({"status": "error", "message": "Board not found or you are not the owner."}), 404
 
     # Remove all appliances linked to this board
-    for room in user_data.get('rooms', []):
-        room['appliances'] = [app for app in room.get('appliances', []) if app.get('board_id') != board_id]
+    def _unlink_board(rooms):
+        for room in rooms:
+            room['appliances'] = [app for app in room.get('appliances', []) if app.get('board_id') != board_id]
+
+    try:
+        mutations.mutate_user_rooms(current_user.id, _unlink_board)
+    except MutationError as e:
+        return jsonify({"status": "error", "message": e.message}), e.status
             
     # Reset the board's status
-    board['owner_id'] = None
-    board['room_id'] = None
-    if 'relays' in board:
-        for relay in board['relays']:
-            relay['is_occupied'] = False
-
-    save_all_boards_to_db(all_boards)
-    save_all_data_to_db(all_data)
+    for released in mutations.release_boards([board_id], current_user.id):
+        clear_board_state(released)
+    publish_change(current_user.id, ['rooms', 'boards'], board_ids=[board_id])
     return jsonify({"status": "success", "message": f"Board {board_id} and its appliances have been unregistered."})
 
 
 @api_bp.route('/my-boards', methods=['GET'])
 @login_required
 def get_my_boards():
-    all_boards = get_all_boards_from_db()
-    my_boards = [b for b in all_boards.values() if b.get('owner_id') == current_user.id]
-    return jsonify(my_boards)
+    # Presence changes without a version bump, so the ETag also rolls over every PRESENCE_WRITE_INTERVAL.
+    presence_epoch = int(time.time() // Config.PRESENCE_WRITE_INTERVAL)
+    return versioned_json(lambda: annotate_presence(without_secrets(get_boards_for_owner(current_user.id))), f"-p{presence_epoch}")
+
+@api_bp.route('/board-status/<board_id>', methods=['GET'])
+@login_required
+def get_board_status(board_id):
+    """The latest state and power each relay of an owned board reported over MQTT, as {relay_id: status}"""
+    board = get_board_from_db(board_id)
+    if not board or board.get('owner_id') != current_user.id:
+        return jsonify({"status": "error", "message": "Board not found."}), 404
+    return jsonify(get_relay_statuses([relay['id'] for relay in board.get('relays', [])]))
 
 @api_bp.route('/available-relays/<room_id>', methods=['GET'])
 @login_required
 def get_available_relays(room_id):
     """Get available relays in a room for adding new appliances"""
-    all_boards = get_all_boards_from_db()
-    user_data = get_user_data()
+    rooms = get_user_rooms() or []
     
     # Get the room to check which relays are occupied
-    room = next((r for r in user_data.get('rooms', []) if r['id'] == room_id), None)
+    room = next((r for r in rooms if r['id'] == room_id), None)
     if not room:
         return jsonify([])
     
@@ -101,38 +178,85 @@ def get_available_relays(room_id):
     occupied_relays = {appliance.get('relay_id') for appliance in room.get('appliances', []) if appliance.get('relay_id')}
     
     available_relays = []
-    for board in all_boards.values():
-        if board.get('owner_id') == current_user.id and board.get('room_id') == room_id:
-            # Handle both relay structures (relays list or relay_ids list)
-            if 'relays' in board:
-                # New structure with relay objects
-                free_relays = [r for r in board.get('relays', []) if not r.get('is_occupied')]
-            else:
-                # Legacy structure with relay_ids list
-                relay_ids = board.get('relay_ids', [])
-                free_relays = [
-                    {"id": relay_id, "name": f"Relay {i+1}"}
-                    for i, relay_id in enumerate(relay_ids)
-                    if relay_id not in occupied_relays
-                ]
-            
-            if free_relays:
-                available_relays.append({
-                    "board_id": board['board_id'],
-                    "relays": free_relays
-                })
+    for board in get_boards_for_room(current_user.id, room_id):
+        # Handle both relay structures (relays list or relay_ids list)
+        if 'relays' in board:
+            # New structure with relay objects
+            free_relays = [r for r in board.get('relays', []) if not r.get('is_occupied')]
+        else:
+            # Legacy structure with relay_ids list
+            relay_ids = board.get('relay_ids', [])
+            free_relays = [
+                {"id": relay_id, "name": f"Relay {i+1}"}
+                for i, relay_id in enumerate(relay_ids)
+                if relay_id not in occupied_relays
+            ]
+        
+        if free_relays:
+            available_relays.append({
+                "board_id": board['board_id'],
+                "relays": free_relays
+            })
     
     return jsonify(available_relays)
 
+# --- Live Updates ---
+
+@api_bp.route('/events')
+@login_required
+def events():
+    """
+    Server-Sent Events stream of changes to the user's dashboard (see
+    database/events.py), sent as `change` events. A stream ends after
+    EVENT_STREAM_MAX_DURATION seconds and the browser reconnects. Workers that
+    cannot hold streams open answer 204, which tells EventSource to stop.
+    """
+    if not streaming_available():
+        return '', 204
+    user_id = current_user.id
+    changes = event_hub.subscribe(user_id)
+
+    def _stream():
+        deadline = time.monotonic() + Config.EVENT_STREAM_MAX_DURATION
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                try:
+                    change = changes.get(timeout=min(Config.EVENT_STREAM_HEARTBEAT, remaining))
+                except queue.Empty:
+                    yield ": keep-alive\n\n"  # Keeps proxies from closing an idle stream
+                    continue
+                yield f"event: change\ndata: {change}\n\n"
+        finally:
+            event_hub.unsubscribe(user_id, changes)
+
+    return Response(_stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 # --- Room Management ---
 
 @api_bp.route('/get-rooms-and-appliances', methods=['GET'])
 @login_required
 def get_rooms_and_appliances():
     """Get all rooms and appliances for the current user"""
-    all_data = get_all_data_from_db()
-    user_data = all_data.get(current_user.id, {})
-    return jsonify(user_data.get('rooms', []))
+    return versioned_json(lambda: get_user_rooms() or [])
+
+@api_bp.route('/changes', methods=['GET'])
+@login_required
+def get_changes():
+    """
+    Delta sync: the rooms, appliances and boards that changed since the
+    client's `?since=<version>` (see database/sync.py). Falls back to a full
+    snapshot when the change log has been trimmed past that version.
+    """
+    since = request.args.get('since', type=int)
+    if since is None:
+        return jsonify({"status": "error", "message": "A numeric 'since' version is required."}), 400
+    with fresh_reads():
+        return jsonify(build_delta(current_user.id, since))
 
 @api_bp.route('/add-room', methods=['POST'])
 @login_required
@@ -141,7 +265,6 @@ def add_room():
     try:
         data = request.json
         room_name = data['name']
-        user_data = get_user_data()
         
         # Generate unique room ID
         new_room_id = str(int(time.time() * 1000))
@@ -152,11 +275,8 @@ def add_room():
             "appliances": []
         }
         
-        if 'rooms' not in user_data:
-            user_data['rooms'] = []
-        user_data['rooms'].append(new_room)
-        
-        save_user_data(user_data)
+        mutations.mutate_user_rooms(current_user.id, lambda rooms: rooms.append(new_room))
+        publish_change(current_user.id, ['rooms'], room_ids=[new_room_id])
         return jsonify({"status": "success", "room_id": new_room_id}), 200
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
@@ -165,26 +285,22 @@ def add_room():
 @login_required
 def delete_room():
     room_id = request.json.get('room_id')
-    all_data = get_all_data_from_db()
-    all_boards = get_all_boards_from_db()
-    user_data = all_data.get(current_user.id, {})
 
-    if not any(r['id'] == room_id for r in user_data.get('rooms', [])):
-        return jsonify({"status": "error", "message": "Room not found."}), 404
+    def _remove_room(rooms):
+        if not any(r['id'] == room_id for r in rooms):
+            raise MutationError("Room not found.", 404)
+        rooms[:] = [r for r in rooms if r['id'] != room_id]
+
+    try:
+        mutations.mutate_user_rooms(current_user.id, _remove_room)
+    except MutationError as e:
+        return jsonify({"status": "error", "message": e.message}), e.status
 
     # Unregister all boards associated with this room
-    for board in all_boards.values():
-        if board.get('owner_id') == current_user.id and board.get('room_id') == room_id:
-            board['owner_id'] = None
-            board['room_id'] = None
-            if 'relays' in board:
-                for relay in board['relays']:
-                    relay['is_occupied'] = False
-
-    user_data['rooms'] = [r for r in user_data.get('rooms', []) if r['id'] != room_id]
-    
-    save_all_data_to_db(all_data)
-    save_all_boards_to_db(all_boards)
+    boards = mutations.release_boards([b['board_id'] for b in get_boards_for_room(current_user.id, room_id)], current_user.id)
+    for board in boards:
+        clear_board_state(board)
+    publish_change(current_user.id, ['rooms', 'boards'], room_ids=[room_id], board_ids=[b['board_id'] for b in boards])
     return jsonify({"status": "success", "message": "Room and associated boards have been cleared."})
 
 @api_bp.route('/update-room-settings', methods=['POST'])
@@ -195,22 +311,20 @@ def update_room_settings():
         req_data = request.get_json()
         room_id = req_data['room_id']
         
-        all_data = get_all_data_from_db()
-        user_data = all_data.get(current_user.id)
-        if not user_data:
-            return jsonify({"status": "error", "message": "User data not found."}), 404
-
-        room = next((r for r in user_data.get('rooms', []) if r['id'] == room_id), None)
-        if not room:
-            return jsonify({"status": "error", "message": "Room not found."}), 404
-        
-        if 'name' in req_data:
-            room['name'] = req_data['name']
-        if 'ai_control' in req_data:
-            room['ai_control'] = req_data['ai_control']
-            
-        save_all_data_to_db(all_data)
+        def _update(rooms):
+            room = next((r for r in rooms if r['id'] == room_id), None)
+            if not room:
+                raise MutationError("Room not found.", 404)
+            if 'name' in req_data:
+                room['name'] = req_data['name']
+            if 'ai_control' in req_data:
+                room['ai_control'] = req_data['ai_control']
+
+        mutations.mutate_user_rooms(current_user.id, _update)
+        publish_change(current_user.id, ['rooms'], room_ids=[room_id])
         return jsonify({"status": "success", "message": "Room settings updated."}), 200
+    except MutationError as e:
+        return jsonify({"status": "error", "message": e.message}), e.status
     except (KeyError, TypeError):
         return jsonify({"status": "error", "message": "Invalid request data."}), 400
     except Exception as e:
@@ -222,17 +336,11 @@ def save_room_order():
     """Save new room order after drag & drop"""
     try:
         new_order_ids = request.json['order']
-        
-        all_data = get_all_data_from_db()
-        user_data = all_data.get(current_user.id)
-        if not user_data:
-            return jsonify({"status": "error", "message": "User data not found."}), 404
-        
-        room_map = {room['id']: room for room in user_data.get('rooms', [])}
-        user_data['rooms'] = [room_map[id] for id in new_order_ids if id in room_map]
-        
-        save_all_data_to_db(all_data)
+        ordering.save_room_order(current_user.id, new_order_ids)
+        publish_change(current_user.id, ['rooms'], room_ids=[])
         return jsonify({"status": "success"}), 200
+    except MutationError as e:
+        return jsonify({"status": "error", "message": e.message}), e.status
     except KeyError:
         return jsonify({"status": "error", "message": "Invalid order data."}), 400
     except Exception as e:
@@ -249,24 +357,11 @@ def add_appliance():
     if not all([room_id, name, board_id, relay_id]):
         return jsonify({"status": "error", "message": "Missing required fields."}), 400
 
-    all_data, all_boards = get_all_data_from_db(), get_all_boards_from_db()
-    user_data = all_data.get(current_user.id, {})
-    room = next((r for r in user_data.get('rooms', []) if r['id'] == room_id), None)
-    board = all_boards.get(board_id)
-
-    if not room or not board or board.get('owner_id') != current_user.id:
-        return jsonify({"status": "error", "message": "Room or board not found, or you are not the owner."}), 404
-
-    relay = next((r for r in board.get('relays', []) if r['id'] == relay_id), None)
-    if not relay or relay.get('is_occupied'):
-        return jsonify({"status": "error", "message": "Relay is not available or is already occupied."}), 409
-        
-    relay['is_occupied'] = True
-    new_appliance = {"id": uuid.uuid4().hex, "name": name, "state": False, "locked": False, "timer": None, "board_id": board_id, "relay_id": relay_id}
-    room.setdefault('appliances', []).append(new_appliance)
-
-    save_all_data_to_db(all_data)
-    save_all_boards_to_db(all_boards)
+    try:
+        mutations.add_appliance(current_user.id, room_id, name, board_id, relay_id)
+    except MutationError as e:
+        return jsonify({"status": "error", "message": e.message}), e.status
+    publish_change(current_user.id, ['rooms', 'boards'], room_ids=[room_id], board_ids=[board_id])
     return jsonify({"status": "success", "message": f"Appliance '{name}' added successfully."})
 
 
@@ -274,23 +369,14 @@ def add_appliance():
 @login_required
 def delete_appliance():
     room_id, appliance_id = request.json.get('room_id'), request.json.get('appliance_id')
-    all_data, all_boards = get_all_data_from_db(), get_all_boards_from_db()
-    user_data = all_data.get(current_user.id, {})
-    room = next((r for r in user_data.get('rooms', []) if r['id'] == room_id), None)
-
-    if not room: return jsonify({"status": "error", "message": "Room not found."}), 404
-    appliance = next((app for app in room.get('appliances', []) if app['id'] == appliance_id), None)
-    if not appliance: return jsonify({"status": "error", "message": "Appliance not found."}), 404
-
-    board_id, relay_id = appliance.get('board_id'), appliance.get('relay_id')
-    if board_id in all_boards:
-        relay = next((r for r in all_boards[board_id].get('relays', []) if r['id'] == relay_id), None)
-        if relay: relay['is_occupied'] = False
-
-    room['appliances'] = [app for app in room['appliances'] if app['id'] != appliance_id]
-    
-    save_all_data_to_db(all_data)
-    save_all_boards_to_db(all_boards)
+    try:
+        appliance = mutations.remove_appliance(current_user.id, room_id, appliance_id)
+    except MutationError as e:
+        return jsonify({"status": "error", "message": e.message}), e.status
+    clear_relay_state(appliance.get('board_id'), appliance.get('relay_id'))
+    if appliance.get('timer'):
+        cancel_timer(current_user.id, appliance_id)
+    publish_change(current_user.id, ['rooms', 'boards'], room_ids=[room_id], board_ids=[appliance.get('board_id')])
     return jsonify({"status": "success", "message": "Appliance deleted."})
 
 
@@ -300,33 +386,18 @@ def set_appliance_state():
     """Set appliance on/off state"""
     data = request.get_json()
     room_id, appliance_id, state = data['room_id'], data['appliance_id'], data['state']
-    
-    user_data = get_user_data()
-    room = next((r for r in user_data.get('rooms', []) if r['id'] == room_id), None)
-    if not room: 
-        return jsonify({"status": "error", "message": "Room not found."}), 404
-    
-    appliance = next((a for a in room.get('appliances', []) if a['id'] == appliance_id), None)
-    if not appliance: 
-        return jsonify({"status": "error", "message": "Appliance not found."}), 404
-
-    # Security check: Verify user owns the board
-    board_id = appliance.get('board_id')
-    all_boards = get_all_boards_from_db()
-    board = all_boards.get(board_id)
-    if not board or board.get('owner_id') != current_user.id:
-        return jsonify({"status": "error", "message": "Authorization error: You do not own this board."}), 403
 
-    appliance['state'] = state
-    if not state: 
-        appliance['timer'] = None  # Clear timer when turning off
-    save_user_data(user_data)
+    try:
+        appliance = mutations.set_appliance_state(current_user.id, room_id, appliance_id, state)
+    except MutationError as e:
+        return jsonify({"status": "error", "message": e.message}), e.status
+
+    # Queue command for ESP device, and push it to the board over MQTT
+    send_relay_states([appliance])
+    if not state:
+        cancel_timer(current_user.id, appliance_id)
+    publish_change(current_user.id, ['rooms'], room_id, appliance)
 
-    # Queue command for ESP device
-    relay_id = appliance.get('relay_id')
-    if relay_id:
-        check_in_queue[relay_id] = {"state": int(state)}
-        
     action = "turned ON" if state else "turned OFF"
     return jsonify({"status": "success", "message": f"'{appliance['name']}' has been {action}."}), 200
 
@@ -338,40 +409,16 @@ def update_appliance_settings():
     if not all(key in data for key in keys):
         return jsonify({"status": "error", "message": "Missing required fields."}), 400
 
-    all_data, all_boards = get_all_data_from_db(), get_all_boards_from_db()
-    user_data = all_data.get(current_user.id)
-    
-    original_room = next((r for r in user_data['rooms'] if r['id'] == data['room_id']), None)
-    if not original_room: return jsonify({"status": "error", "message": "Original room not found."}), 404
-        
-    appliance = next((a for a in original_room['appliances'] if a['id'] == data['appliance_id']), None)
-    if not appliance: return jsonify({"status": "error", "message": "Appliance not found."}), 404
-
-    old_board_id, old_relay_id = appliance.get('board_id'), appliance.get('relay_id')
-    new_board_id, new_relay_id = data['board_id'], data['relay_id']
-
-    if old_board_id != new_board_id or old_relay_id != new_relay_id:
-        if old_board_id in all_boards:
-            old_relay = next((r for r in all_boards[old_board_id].get('relays', []) if r['id'] == old_relay_id), None)
-            if old_relay: old_relay['is_occupied'] = False
-        
-        if new_board_id in all_boards:
-            new_relay = next((r for r in all_boards[new_board_id].get('relays', []) if r['id'] == new_relay_id), None)
-            if not new_relay or new_relay.get('is_occupied'):
-                return jsonify({"status": "error", "message": "The new relay is unavailable or already occupied."}), 409
-            new_relay['is_occupied'] = True
-
-    appliance.update({'name': data['name'], 'board_id': new_board_id, 'relay_id': new_relay_id})
-
-    if data['new_room_id'] != data['room_id']:
-        target_room = next((r for r in user_data['rooms'] if r['id'] == data['new_room_id']), None)
-        if not target_room: return jsonify({"status": "error", "message": "Target room not found."}), 404
-        
-        target_room.setdefault('appliances', []).append(appliance)
-        original_room['appliances'] = [a for a in original_room['appliances'] if a['id'] != data['appliance_id']]
-
-    save_all_data_to_db(all_data)
-    save_all_boards_to_db(all_boards)
+    try:
+        mutations.move_appliance(
+            current_user.id, data['room_id'], data['appliance_id'], data['new_room_id'],
+            data['name'], data['board_id'], data['relay_id']
+        )
+    except MutationError as e:
+        return jsonify({"status": "error", "message": e.message}), e.status
+    # The appliance may have left another board, so boards are not narrowed down.
+    publish_change(current_user.id, ['rooms', 'boards'], room_ids=[data['room_id'], data['new_room_id']])
+    return jsonify({"status": "success", "message": "Appliance settings updated."})
 
 
 @api_bp.route('/save-appliance-order', methods=['POST'])
@@ -382,21 +429,12 @@ def save_appliance_order():
         data = request.json
         room_id = data['room_id']
         new_order_ids = data['order']
-        
-        all_data = get_all_data_from_db()
-        user_data = all_data.get(current_user.id)
-        if not user_data:
-            return jsonify({"status": "error", "message": "User data not found."}), 404
-
-        room = next((r for r in user_data.get('rooms', []) if r['id'] == room_id), None)
-        if not room:
-            return jsonify({"status": "error", "message": "Room not found."}), 404
-        
-        appliance_map = {appliance['id']: appliance for appliance in room.get('appliances', [])}
-        room['appliances'] = [appliance_map[id] for id in new_order_ids if id in appliance_map]
-        
-        save_all_data_to_db(all_data)
+
+        ordering.save_appliance_order(current_user.id, room_id, new_order_ids)
+        publish_change(current_user.id, ['rooms'], room_ids=[room_id])
         return jsonify({"status": "success"}), 200
+    except MutationError as e:
+        return jsonify({"status": "error", "message": e.message}), e.status
     except KeyError:
         return jsonify({"status": "error", "message": "Invalid order data."}), 400
     except Exception as e:
@@ -414,19 +452,11 @@ def set_appliance_name():
         appliance_id = data['appliance_id']
         name = data['name']
 
-        all_data = get_all_data_from_db()
-        user_data = all_data.get(current_user.id)
-        room = next((r for r in user_data.get('rooms', []) if r['id'] == room_id), None)
-        if not room:
-            return jsonify({"status": "error", "message": "Room not found."}), 404
-
-        appliance = next((a for a in room.get('appliances', []) if a['id'] == appliance_id), None)
-        if not appliance:
-            return jsonify({"status": "error", "message": "Appliance not found."}), 404
-        
-        appliance['name'] = name
-        save_all_data_to_db(all_data)
+        appliance = mutations.update_appliance(current_user.id, room_id, appliance_id, {'name': name})
+        publish_change(current_user.id, ['rooms'], room_id, appliance)
         return jsonify({"status": "success", "message": "Name updated."}), 200
+    except MutationError as e:
+        return jsonify({"status": "error", "message": e.message}), e.status
     except KeyError:
         return jsonify({"status": "error", "message": "Invalid request data."}), 400
     except Exception as e:
@@ -442,20 +472,11 @@ def set_lock():
         room_id = data['room_id']
         locked = data['locked']
         
-        all_data = get_all_data_from_db()
-        user_data = all_data.get(current_user.id)
-        room = next((r for r in user_data.get('rooms', []) if r['id'] == room_id), None)
-        if not room:
-            return jsonify({"status": "error", "message": "Room not found."}), 404
-
-        appliance = next((a for a in room.get('appliances', []) if a['id'] == appliance_id), None)
-        if not appliance:
-            return jsonify({"status": "error", "message": "Appliance not found."}), 404
-
-        appliance['locked'] = bool(locked)
-        save_all_data_to_db(all_data)
-        
+        appliance = mutations.update_appliance(current_user.id, room_id, appliance_id, {'locked': bool(locked)})
+        publish_change(current_user.id, ['rooms'], room_id, appliance)
         return jsonify({"status": "success", "message": "Lock state updated."}), 200
+    except MutationError as e:
+        return jsonify({"status": "error", "message": e.message}), e.status
     except KeyError:
         return jsonify({"status": "error", "message": "Invalid request data."}), 400
     except Exception as e:
@@ -470,29 +491,134 @@ def set_timer():
         room_id = data['room_id']
         appliance_id = data['appliance_id']
         timer_timestamp = data.get('timer')  # Can be null to clear timer
-        
-        all_data = get_all_data_from_db()
-        user_data = all_data.get(current_user.id)
-        room = next((r for r in user_data.get('rooms', []) if r['id'] == room_id), None)
-        if not room:
-            return jsonify({"status": "error", "message": "Room not found."}), 404
-
-        appliance = next((a for a in room.get('appliances', []) if a['id'] == appliance_id), None)
-        if not appliance:
-            return jsonify({"status": "error", "message": "Appliance not found."}), 404
+        if timer_timestamp is not None:
+            if isinstance(timer_timestamp, bool) or not isinstance(timer_timestamp, (int, float)):
+                return jsonify({"status": "error", "message": "The timer must be a unix timestamp."}), 400
+            timer_timestamp = float(timer_timestamp)
 
-        appliance['timer'] = timer_timestamp
+        updates = {'timer': timer_timestamp}
         if timer_timestamp:
-            appliance['state'] = True  # Turn on appliance when timer is set
-        
-        save_all_data_to_db(all_data)
+            updates['state'] = True  # Turn on appliance when timer is set
+        appliance = mutations.update_appliance(current_user.id, room_id, appliance_id, updates)
+        # The timer fires server-side (see utils/timer_scheduler.py), even with no dashboard open
+        if timer_timestamp:
+            schedule_timer(current_user.id, appliance_id, timer_timestamp)
+            ensure_timer_scheduler()
+            send_relay_states([appliance])
+        else:
+            cancel_timer(current_user.id, appliance_id)
+        publish_change(current_user.id, ['rooms'], room_id, appliance)
+
         message = "Timer set" if timer_timestamp else "Timer cleared"
         return jsonify({"status": "success", "message": message + "."}), 200
+    except MutationError as e:
+        return jsonify({"status": "error", "message": e.message}), e.status
     except KeyError:
         return jsonify({"status": "error", "message": "Invalid request data."}), 400
     except Exception as e:
         return jsonify({"status": "error", "message": "An internal error occurred."}), 500
 
+# --- Batched Operations ---
+
+@api_bp.route('/batch', methods=['POST'])
+@login_required
+def batch():
+    """
+    Run several dashboard operations in one request: {"operations": [{"op":
+    "set-lock", "args": {...}}, ...], "atomic": false}. Each op names the
+    endpoint it stands for and takes that endpoint's body as args (see
+    database/batch.py for the ones that can be batched). All of them are
+    applied to the rooms document in order and committed once. With "atomic",
+    one failure cancels the whole batch.
+    """
+    data = request.get_json() or {}
+    operations = data.get('operations')
+    if not isinstance(operations, list) or not operations or not all(isinstance(o, dict) for o in operations):
+        return jsonify({"status": "error", "message": "A list of operations is required."}), 400
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        return jsonify({"status": "error", "message": f"At most {MAX_BATCH_OPERATIONS} operations per batch."}), 400
+
+    try:
+        results, changes = run_batch(current_user.id, operations, atomic=bool(data.get('atomic')))
+    except MutationError as e:
+        return jsonify({"status": "error", "message": e.message, "results": getattr(e, 'results', None)}), e.status
+
+    send_relay_states([changes.appliances[a][1] for a in changes.relay_ids])
+    cancel_timers(current_user.id, [a for a, fire_at in changes.timers.items() if not fire_at])
+    for appliance_id, fire_at in changes.timers.items():
+        if fire_at:
+            schedule_timer(current_user.id, appliance_id, fire_at)
+            ensure_timer_scheduler()
+    touched = list(changes.appliances.values())
+    if len(touched) == 1 and changes.room_ids == {touched[0][0]}:
+        publish_change(current_user.id, ['rooms'], *touched[0])
+    elif any(r['status'] == "success" for r in results):
+        publish_change(current_user.id, ['rooms'], room_ids=sorted(changes.room_ids))
+
+    failed = sum(r['status'] != "success" for r in results)
+    return jsonify({"status": "success" if not failed else "partial", "results": results}), 200
+
+# --- Scenes ---
+# A scene is applied as one transaction on the rooms list, with board
+# ownership checked once, and its relay commands queued in one pipeline.
+
+def _parse_scene_targets(data):
+    """Validates a scene's targets against the user's appliances. Returns [{"appliance_id", "state"}]."""
+    targets = data.get('targets')
+    if not isinstance(targets, list) or not targets:
+        raise MutationError("A scene needs at least one appliance.", 400)
+    appliance_ids = {a['id'] for room in get_user_rooms() or [] for a in room.get('appliances', [])}
+    parsed = {}
+    for target in targets:
+        if not isinstance(target, dict) or target.get('appliance_id') not in appliance_ids:
+            raise MutationError("Appliance not found.", 404)
+        parsed[target['appliance_id']] = bool(target.get('state'))
+    return [{"appliance_id": a, "state": state} for a, state in parsed.items()]
+
+@api_bp.route('/scenes', methods=['GET'])
+@login_required
+def get_scenes():
+    return jsonify(scenes.get_scenes(current_user.id))
+
+@api_bp.route('/save-scene', methods=['POST'])
+@login_required
+def save_scene():
+    """Create a scene, or update one when `scene_id` is given"""
+    data = request.get_json() or {}
+    name = (data.get('name') or '').strip()
+    if not name:
+        return jsonify({"status": "error", "message": "A scene name is required."}), 400
+    try:
+        scene = scenes.save_scene(current_user.id, name, _parse_scene_targets(data), data.get('scene_id'))
+    except MutationError as e:
+        return jsonify({"status": "error", "message": e.message}), e.status
+    return jsonify({"status": "success", "scene": scene}), 200
+
+@api_bp.route('/delete-scene', methods=['POST'])
+@login_required
+def delete_scene():
+    try:
+        scenes.delete_scene(current_user.id, (request.get_json() or {}).get('scene_id'))
+    except MutationError as e:
+        return jsonify({"status": "error", "message": e.message}), e.status
+    return jsonify({"status": "success", "message": "Scene deleted."}), 200
+
+@api_bp.route('/apply-scene', methods=['POST'])
+@login_required
+def apply_scene():
+    """Switch every appliance in a scene to its saved state"""
+    try:
+        scene = scenes.get_scene(current_user.id, (request.get_json() or {}).get('scene_id'))
+        states = {t['appliance_id']: t['state'] for t in scene['targets']}
+        changed = mutations.set_appliance_states(current_user.id, states)
+    except MutationError as e:
+        return jsonify({"status": "error", "message": e.message}), e.status
+
+    send_relay_states([appliance for _, appliance in changed])
+    cancel_timers(current_user.id, [a['id'] for _, a in changed if not a['state']])
+    publish_appliance_changes(current_user.id, changed)
+    return jsonify({"status": "success", "message": f"Scene '{scene['name']}' applied.", "changed": len(changed)}), 200
+
 # --- QR Code Processing ---
 
 @api_bp.route('/extract-qr-data', methods=['POST'])
@@ -506,9 +632,7 @@ def extract_qr_data():
         decrypted_board_info = decrypt_data(encrypted_text)
         
         if decrypted_board_info and 'board_id' in decrypted_board_info:
-            all_boards = get_all_boards_from_db()
-            board_id = decrypted_board_info['board_id']
-            board_status = all_boards.get(board_id)
+            board_status = get_board_from_db(decrypted_board_info['board_id'])
 
             if not board_status:
                 return jsonify({"error": "Board does not exist in the database."}), 404
@@ -6,9 +6,13 @@ from authlib.integrations.flask_client import OAuth
 
 # 1. Import local modules
 from config import Config
-from database.redis_db import migrate_json_to_redis
+from database.redis_db import check_redis_connection, migrate_json_to_redis, init_request_cache
+from database.boards_db import migrate_boards_to_board_keys, seed_known_devices
+from database.users_db import migrate_users_to_user_keys, seed_user_id_counter, get_all_user_ids
+from database.timers import seed_timer_index
 from auth.models import User, load_user
 from mqtt.client import run_mqtt_thread
+from utils.timer_scheduler import ensure_timer_scheduler
 from admin.init_admin import init_admin
 from oauth.providers import configure_oauth_providers
 from security import setup_security_headers, setup_logging, generate_csrf_token
@@ -33,6 +37,9 @@ def create_app():
     mail = Mail(app)
     oauth = OAuth(app)
 
+    # --- Per-Request Redis Unit of Work ---
+    init_request_cache(app)
+
     # --- Add CSRF Token to Template Context ---
     @app.context_processor
     def inject_csrf_token():
@@ -76,7 +83,13 @@ def create_app():
     # --- One-time Startup Logic ---
     # This block will run every time the app starts
     with app.app_context():
+        check_redis_connection()
         migrate_json_to_redis()
+        migrate_boards_to_board_keys()
+        seed_known_devices()
+        migrate_users_to_user_keys()
+        seed_user_id_counter()
+        seed_timer_index(get_all_user_ids())
         init_admin(app)
 
     return app
@@ -87,6 +100,7 @@ app = create_app()
 # --- Run Application (This part is ONLY for local development) ---
 if __name__ == '__main__':
     run_mqtt_thread()
+    ensure_timer_scheduler()
     port = int(os.environ.get('PORT', 5000))
     # Use the created app instance to run
     app.run(host='0.0.0.0', port=port, debug=app.config.get('DEBUG', False))
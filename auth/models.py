@@ -1,5 +1,5 @@
 from flask_login import UserMixin
-from database.redis_db import get_all_users_from_db, get_all_data_from_db
+from database.users_db import get_user_record, get_user_by_email
 
 class User(UserMixin):
     # This class remains the same
@@ -10,23 +10,11 @@ class User(UserMixin):
 
 def load_user(user_id):
     """Loads a user for Flask-Login by their ID."""
-    all_users = get_all_users_from_db()
-    user_data = next((u for u in all_users if u.get('id') == user_id), None)
+    user_data = get_user_record(user_id)
     if user_data:
         return User(user_data['id'], user_data['username'], user_data.get('password_hash'))
     return None
 
-def get_user_by_email(email):
-    """Finds a user's auth record ('users' key) by their email address (from 'data' key)."""
-    if not email:
-        return None
-    all_data = get_all_data_from_db()
-    all_users = get_all_users_from_db()
-    for user_id, user_data in all_data.items():
-        if user_data.get("user_settings", {}).get("email") == email:
-            return next((u for u in all_users if u.get('id') == user_id), None)
-    return None
-
 def create_default_user_data(name, email, picture=None):
     """Creates the default data structure for a new user."""
     return {
@@ -2,7 +2,7 @@ from flask import Blueprint, render_template, redirect, url_for, request, sessio
 from flask_login import login_user, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from auth.models import User
-from database.redis_db import get_all_users_from_db
+from database.users_db import get_user_by_username, username_exists
 from oauth.helpers import find_or_create_oauth_user
 import re  # ADD THIS MISSING IMPORT
 
@@ -122,8 +122,7 @@ def signin():
                 flash('Too many login attempts. Please try again later.', 'error')
                 return redirect(url_for('auth.signin'))
             
-            all_users = get_all_users_from_db()
-            user_data = next((u for u in all_users if u['username'] == username), None)
+            user_data = get_user_by_username(username)
             
             if user_data and user_data.get('password_hash') and check_password_hash(user_data['password_hash'], password):
                 # Successful login
@@ -192,8 +191,7 @@ def signup():
                 return redirect(url_for('auth.signup'))
             
             # Check if username already exists
-            all_users = get_all_users_from_db()
-            if any(u['username'].lower() == username.lower() for u in all_users):
+            if username_exists(username):
                 flash('Username already exists. Please choose a different one.', 'error')
                 return redirect(url_for('auth.signup'))
             
@@ -0,0 +1,86 @@
+"""
+Contention benchmark for the atomic appliance mutations in database/mutations.py.
+
+Runs N concurrent writers against the rooms of a single user. Each writer owns
+one appliance and bumps a counter on it, first with the old read-modify-write
+pattern (GET rooms, edit, SET rooms) and then through mutate_user_rooms().
+For each mode it reports throughput and how many updates were lost.
+
+Usage:
+    REDIS_URL=redis://localhost:6379/15 python benchmarks/appliance_contention.py [writers] [ops_per_writer]
+"""
+import os
+import sys
+import time
+import uuid
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Config refuses to load without these; the benchmark only needs REDIS_URL.
+for name in ('SECRET_KEY', 'ENCRYPTION_USER_KEY', 'ENCRYPTION_SALT', 'GOOGLE_CLIENT_ID',
+             'GOOGLE_CLIENT_SECRET', 'GITHUB_CLIENT_ID', 'GITHUB_CLIENT_SECRET'):
+    os.environ.setdefault(name, 'benchmark')
+os.environ.setdefault('REDIS_URL', 'redis://localhost:6379/15')
+
+from database.redis_db import doc_client, user_key, encode_doc, decode_doc
+from database import mutations
+
+
+def seed_user(user_id, writers):
+    rooms = [{
+        "id": "1", "name": "Bench", "ai_control": False,
+        "appliances": [{"id": f"a{w}", "name": f"Appliance {w}", "state": False, "locked": False,
+                        "timer": None, "board_id": None, "relay_id": None, "counter": 0}
+                       for w in range(writers)]
+    }]
+    doc_client.set(user_key(user_id, 'rooms'), encode_doc(rooms))
+
+
+def bump_naive(user_id, appliance_id):
+    key = user_key(user_id, 'rooms')
+    rooms = decode_doc(doc_client.get(key))
+    appliance = next(a for a in rooms[0]['appliances'] if a['id'] == appliance_id)
+    appliance['counter'] += 1
+    doc_client.set(key, encode_doc(rooms))
+
+
+def bump_atomic(user_id, appliance_id):
+    def _bump(rooms):
+        appliance = next(a for a in rooms[0]['appliances'] if a['id'] == appliance_id)
+        appliance['counter'] += 1
+    mutations.mutate_user_rooms(user_id, _bump)
+
+
+def run(mode, bump, writers, ops):
+    user_id = f"bench-{uuid.uuid4().hex[:8]}"
+    seed_user(user_id, writers)
+    mutations.transaction_stats.update(commits=0, conflicts=0)
+
+    def worker(w):
+        for _ in range(ops):
+            bump(user_id, f"a{w}")
+
+    threads = [threading.Thread(target=worker, args=(w,)) for w in range(writers)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    rooms = decode_doc(doc_client.get(user_key(user_id, 'rooms')))
+    applied = sum(a['counter'] for a in rooms[0]['appliances'])
+    doc_client.delete(user_key(user_id, 'rooms'))
+
+    total = writers * ops
+    print(f"{mode:>7}: {total / elapsed:9.1f} ops/s  applied {applied}/{total}  "
+          f"lost {total - applied}  conflicts retried {mutations.transaction_stats['conflicts']}")
+
+
+if __name__ == '__main__':
+    writers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    ops = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    print(f"{writers} concurrent writers x {ops} updates on one user's rooms")
+    run('naive', bump_naive, writers, ops)
+    run('atomic', bump_atomic, writers, ops)
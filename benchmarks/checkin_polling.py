@@ -0,0 +1,91 @@
+"""
+Short polling vs long polling benchmark for /api/esp/checkin.
+
+Simulates N relays checking in against a running server while commands are
+queued for random relays straight into Redis. Each command carries the time it
+was queued, so the benchmark reports the check-in request rate the server had
+to handle and the delay between queueing a command and a relay receiving it.
+
+Run the app under gunicorn (gevent workers, see gunicorn.conf.py) first, then:
+    REDIS_URL=redis://localhost:6379/0 python benchmarks/checkin_polling.py http://localhost:5000 [relays] [seconds] [poll_interval]
+"""
+import os
+import sys
+import time
+import uuid
+import random
+import threading
+import statistics
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Config refuses to load without these; the benchmark only needs REDIS_URL.
+for name in ('SECRET_KEY', 'ENCRYPTION_USER_KEY', 'ENCRYPTION_SALT', 'GOOGLE_CLIENT_ID',
+             'GOOGLE_CLIENT_SECRET', 'GITHUB_CLIENT_ID', 'GITHUB_CLIENT_SECRET'):
+    os.environ.setdefault(name, 'benchmark')
+os.environ.setdefault('REDIS_URL', 'redis://localhost:6379/15')
+
+from database.command_queue import command_queue
+
+COMMANDS_PER_SECOND = 20
+LONG_POLL_WAIT = 20
+HEADERS = {'User-Agent': 'checkin-benchmark'}
+
+
+def run(mode, base_url, relays, duration, poll_interval):
+    relay_ids = [f"bench-{uuid.uuid4().hex}" for _ in range(relays)]
+    stop = threading.Event()
+    requests_made, latencies = [0], []
+    lock = threading.Lock()
+
+    def device(relay_id):
+        session = requests.Session()
+        params = {'wait': LONG_POLL_WAIT} if mode == 'long' else {}
+        while not stop.is_set():
+            try:
+                response = session.get(f"{base_url}/api/esp/checkin/{relay_id}", params=params,
+                                       headers=HEADERS, timeout=LONG_POLL_WAIT + 10)
+            except requests.RequestException:
+                continue
+            received = time.time()
+            with lock:
+                requests_made[0] += 1
+                if response.status_code == 200:
+                    latencies.append(received - response.json()['queued_at'])
+            if mode == 'short':
+                stop.wait(poll_interval)
+
+    def commander():
+        while not stop.is_set():
+            command_queue.enqueue(random.choice(relay_ids), {"state": 1, "queued_at": time.time()})
+            stop.wait(1 / COMMANDS_PER_SECOND)
+
+    threads = [threading.Thread(target=device, args=(r,), daemon=True) for r in relay_ids]
+    threads.append(threading.Thread(target=commander, daemon=True))
+    started = time.time()
+    for t in threads:
+        t.start()
+    time.sleep(duration)
+    stop.set()
+    elapsed = time.time() - started
+
+    if latencies:
+        latencies.sort()
+        p95 = latencies[int(len(latencies) * 0.95) - 1] if len(latencies) >= 20 else latencies[-1]
+        latency = f"latency median {statistics.median(latencies) * 1000:7.1f} ms  p95 {p95 * 1000:7.1f} ms"
+    else:
+        latency = "no commands delivered"
+    print(f"{mode:>5}: {requests_made[0] / elapsed:8.1f} req/s  {len(latencies)} commands delivered  {latency}")
+
+
+if __name__ == '__main__':
+    base_url = sys.argv[1] if len(sys.argv) > 1 else 'http://localhost:5000'
+    relays = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    duration = float(sys.argv[3]) if len(sys.argv) > 3 else 30
+    poll_interval = float(sys.argv[4]) if len(sys.argv) > 4 else 1.0
+    print(f"{relays} relays for {duration:.0f}s, short poll every {poll_interval}s, "
+          f"long poll wait {LONG_POLL_WAIT}s, {COMMANDS_PER_SECOND} commands/s")
+    run('short', base_url, relays, duration, poll_interval)
+    run('long', base_url, relays, duration, poll_interval)
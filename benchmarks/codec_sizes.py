@@ -0,0 +1,74 @@
+"""
+Size and CPU comparison of the stored document codecs in database/codec.py.
+
+Samples up to N stored documents (rooms, settings, user records and boards)
+from Redis and re-encodes them with every available codec/compression pair,
+reporting total bytes and the encode/decode time per document. With no
+documents in Redis it falls back to a synthetic account.
+
+Usage:
+    REDIS_URL=redis://localhost:6379/0 python benchmarks/codec_sizes.py [max_docs]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Config refuses to load without these; the benchmark only needs REDIS_URL.
+for name in ('SECRET_KEY', 'ENCRYPTION_USER_KEY', 'ENCRYPTION_SALT', 'GOOGLE_CLIENT_ID',
+             'GOOGLE_CLIENT_SECRET', 'GITHUB_CLIENT_ID', 'GITHUB_CLIENT_SECRET'):
+    os.environ.setdefault(name, 'benchmark')
+os.environ.setdefault('REDIS_URL', 'redis://localhost:6379/15')
+
+from config import Config
+from database import codec
+from database.redis_db import doc_client, decode_doc
+
+DOC_PATTERNS = ('user:*:rooms', 'user:*:settings', 'user:*:record', 'board:*')
+
+
+def sample_docs(max_docs):
+    docs = []
+    for pattern in DOC_PATTERNS:
+        for key in doc_client.scan_iter(match=pattern, count=500):
+            if doc_client.type(key) != b'string':
+                continue
+            raw = doc_client.get(key)
+            if raw:
+                docs.append(decode_doc(raw))
+            if len(docs) >= max_docs:
+                return docs
+    return docs
+
+
+def synthetic_docs():
+    rooms = [{"id": str(r), "name": f"Room {r}", "ai_control": False, "appliances": [
+        {"id": f"{r}-{a}", "name": f"Appliance {a}", "state": a % 2 == 0, "locked": False,
+         "timer": None, "board_id": "B0000000001", "relay_id": f"relay{a}"} for a in range(8)]}
+        for r in range(12)]
+    return [rooms] * 200
+
+
+def measure(docs, codec_name, compression):
+    started = time.perf_counter()
+    encoded = [codec.encode(d, codec=codec_name, compression=compression) for d in docs]
+    encode_time = time.perf_counter() - started
+    started = time.perf_counter()
+    for raw in encoded:
+        codec.decode(raw)
+    decode_time = time.perf_counter() - started
+    return sum(len(raw) for raw in encoded), encode_time, decode_time
+
+
+if __name__ == '__main__':
+    max_docs = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    docs = sample_docs(max_docs) or synthetic_docs()
+    print(f"{len(docs)} documents (threshold {Config.DOC_COMPRESS_MIN_BYTES} bytes for compression)")
+    baseline = None
+    for codec_name in codec.CODECS:
+        for compression in codec.COMPRESSIONS:
+            size, enc, dec = measure(docs, codec_name, compression)
+            baseline = baseline or size
+            print(f"{codec_name:>8} + {compression:<5} {size:>12,} bytes ({size / baseline:6.1%})  "
+                  f"encode {enc / len(docs) * 1e6:8.1f} us/doc  decode {dec / len(docs) * 1e6:8.1f} us/doc")
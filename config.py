@@ -90,6 +90,20 @@ class Config:
     MQTT_USERNAME = os.getenv('MQTT_USERNAME')  # Optional
     MQTT_PASSWORD = os.getenv('MQTT_PASSWORD')  # Optional
     MQTT_USE_TLS = os.getenv('MQTT_USE_TLS', 'false').lower() in ['true', 'on', '1']
+    # Per-relay command and status topics name the board and relay IDs that devices authenticate with over
+    # HTTP, so they are only used when enabled here and the broker requires credentials (see mqtt/client.py).
+    MQTT_DEVICE_TOPICS = os.getenv('MQTT_DEVICE_TOPICS', 'false').lower() in ['true', 'on', '1']
+    MQTT_COMMAND_QOS = int(os.getenv('MQTT_COMMAND_QOS', 1))  # Relay commands are retained at this QoS
+    MQTT_OUTBOUND_QUEUE_SIZE = int(os.getenv('MQTT_OUTBOUND_QUEUE_SIZE', 10000))  # Per worker, held while the broker is unreachable
+    MQTT_RECONNECT_MIN_DELAY = int(os.getenv('MQTT_RECONNECT_MIN_DELAY', 1))
+    MQTT_RECONNECT_MAX_DELAY = int(os.getenv('MQTT_RECONNECT_MAX_DELAY', 60))
+    # Shared subscription group, so each report is ingested by one worker only. Set it to '' for brokers
+    # without $share support; one worker at a time then subscribes (see MqttPublisher).
+    MQTT_STATUS_SHARE_GROUP = os.getenv('MQTT_STATUS_SHARE_GROUP', 'relay-status')
+    MQTT_STATUS_BUFFER_SIZE = int(os.getenv('MQTT_STATUS_BUFFER_SIZE', 10000))
+    MQTT_STATUS_BATCH_SIZE = int(os.getenv('MQTT_STATUS_BATCH_SIZE', 500))
+    MQTT_STATUS_FLUSH_INTERVAL = float(os.getenv('MQTT_STATUS_FLUSH_INTERVAL', 1.0))
+    POWER_SAMPLES_MAX = int(os.getenv('POWER_SAMPLES_MAX', 1440))  # Power readings kept per relay
     
     # Application Constants
     ELECTRICITY_RATE = float(os.getenv('ELECTRICITY_RATE', 6.50))
@@ -105,6 +119,31 @@ class Config:
     REDIS_URL = os.getenv('REDIS_URL')
     if not REDIS_URL:
         raise RuntimeError("FATAL: REDIS_URL environment variable not set.")
+    REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', 50))  # Per process
+    REDIS_POOL_TIMEOUT = float(os.getenv('REDIS_POOL_TIMEOUT', 5))  # Wait for a free pooled connection
+    REDIS_SOCKET_TIMEOUT = float(os.getenv('REDIS_SOCKET_TIMEOUT', 5))
+    REDIS_CONNECT_TIMEOUT = float(os.getenv('REDIS_CONNECT_TIMEOUT', 3))
+    REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv('REDIS_HEALTH_CHECK_INTERVAL', 30))
+    REDIS_RETRIES = int(os.getenv('REDIS_RETRIES', 3))
+    DOC_CACHE_MAX_BYTES = int(os.getenv('DOC_CACHE_MAX_BYTES', 32 * 1024 * 1024))  # Per worker; 0 disables the local cache
+
+    COMMAND_TTL = int(os.getenv('COMMAND_TTL', 300))  # Seconds an unfetched relay command is kept
+    COMMAND_ACK_TIMEOUT = float(os.getenv('COMMAND_ACK_TIMEOUT', 10))  # Seconds before an unacked relay command is re-sent
+    CHECKIN_LONG_POLL_MAX = float(os.getenv('CHECKIN_LONG_POLL_MAX', 25))  # Longest ?wait= a check-in may hold; 0 disables long polling
+    PRESENCE_WRITE_INTERVAL = float(os.getenv('PRESENCE_WRITE_INTERVAL', 30))  # Per device and process
+    PRESENCE_ONLINE_WINDOW = float(os.getenv('PRESENCE_ONLINE_WINDOW', 120))  # Seen this recently = online
+    EVENT_STREAM_MAX_DURATION = int(os.getenv('EVENT_STREAM_MAX_DURATION', 300))  # 0 disables /api/events
+    EVENT_STREAM_HEARTBEAT = float(os.getenv('EVENT_STREAM_HEARTBEAT', 15))
+    CHANGE_LOG_MAX = int(os.getenv('CHANGE_LOG_MAX', 200))  # Changes kept per user for /api/changes
+    TIMER_POLL_INTERVAL = float(os.getenv('TIMER_POLL_INTERVAL', 1.0))  # Seconds between checks for due appliance timers
+    TIMER_BATCH_SIZE = int(os.getenv('TIMER_BATCH_SIZE', 500))  # Timers fired per check at most
+    TIMER_LEADER_TTL = float(os.getenv('TIMER_LEADER_TTL', 10))  # Seconds before another process takes over firing timers
+    ORDER_WRITE_WINDOW = float(os.getenv('ORDER_WRITE_WINDOW', 2.0))  # Seconds drag & drop orders are buffered before being written
+
+    # Stored Document Encoding (see database/codec.py)
+    DOC_CODEC = os.getenv('DOC_CODEC', 'orjson')  # json, orjson or msgpack
+    DOC_COMPRESSION = os.getenv('DOC_COMPRESSION', 'none')  # none, zlib or zstd
+    DOC_COMPRESS_MIN_BYTES = int(os.getenv('DOC_COMPRESS_MIN_BYTES', 4096))
         
     # Logging Configuration
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
@@ -0,0 +1,156 @@
+import time
+from database.redis_db import user_key
+from database.boards_db import get_owned_board_ids
+from database.mutations import run_transaction, MutationError, _find_room, _find_appliance
+from database.ordering import pending_order_key, apply_pending_order, _reordered
+
+# --- Batched Room Operations ---
+# Runs an ordered list of dashboard operations against one copy of the user's
+# rooms document and commits it once (see POST /api/batch). Only operations
+# confined to the rooms document can be batched; anything that also touches a
+# board (adding, deleting or rewiring appliances, deleting rooms) keeps its own
+# endpoint. Each operation checks everything before changing anything, so a
+# failed one leaves the document as it was.
+MAX_BATCH_OPERATIONS = 50
+
+class _Batch:
+    """What a batch changed, for the caller to act on once it is committed."""
+    def __init__(self, owned_boards):
+        self.owned_boards = owned_boards
+        self.room_ids = set()
+        self.appliances = {}  # appliance_id -> (room_id, appliance) as left by the batch
+        self.relay_ids = set()  # appliances whose relay needs the new state
+        self.timers = {}  # appliance_id -> fire time, or None to cancel
+        self.next_room_id = int(time.time() * 1000)  # Room ids are creation times in ms, as in /api/add-room
+
+    def touched(self, room_id, appliance):
+        self.room_ids.add(room_id)
+        self.appliances[appliance['id']] = (room_id, appliance)
+
+def _appliance(rooms, args):
+    room = _find_room(rooms, args['room_id'])
+    return room, _find_appliance(room, args['appliance_id'])
+
+def _set_appliance_state(rooms, args, batch):
+    room, appliance = _appliance(rooms, args)
+    if appliance.get('board_id') not in batch.owned_boards:
+        raise MutationError("Authorization error: You do not own this board.", 403)
+    appliance['state'] = bool(args['state'])
+    if not appliance['state']:
+        appliance['timer'] = None
+        batch.timers[appliance['id']] = None
+    batch.relay_ids.add(appliance['id'])
+    batch.touched(room['id'], appliance)
+
+def _set_appliance_name(rooms, args, batch):
+    room, appliance = _appliance(rooms, args)
+    appliance['name'] = args['name']
+    batch.touched(room['id'], appliance)
+
+def _set_lock(rooms, args, batch):
+    room, appliance = _appliance(rooms, args)
+    appliance['locked'] = bool(args['locked'])
+    batch.touched(room['id'], appliance)
+
+def _set_timer(rooms, args, batch):
+    room, appliance = _appliance(rooms, args)
+    timer = args.get('timer')
+    if timer is not None:
+        if isinstance(timer, bool) or not isinstance(timer, (int, float)):
+            raise MutationError("The timer must be a unix timestamp.", 400)
+        timer = float(timer)
+    appliance['timer'] = timer
+    if timer:
+        appliance['state'] = True
+        batch.relay_ids.add(appliance['id'])
+    batch.timers[appliance['id']] = timer or None
+    batch.touched(room['id'], appliance)
+
+def _update_appliance_settings(rooms, args, batch):
+    room, appliance = _appliance(rooms, args)
+    if (args['board_id'], args['relay_id']) != (appliance.get('board_id'), appliance.get('relay_id')):
+        raise MutationError("Rewiring an appliance to another relay cannot be batched.", 400)
+    target = _find_room(rooms, args['new_room_id'])
+    appliance['name'] = args['name']
+    if target is not room:
+        room['appliances'] = [a for a in room['appliances'] if a['id'] != appliance['id']]
+        target.setdefault('appliances', []).append(appliance)
+    batch.room_ids.add(room['id'])
+    batch.touched(target['id'], appliance)
+
+def _add_room(rooms, args, batch):
+    name, existing = args['name'], {room['id'] for room in rooms}
+    while str(batch.next_room_id) in existing:
+        batch.next_room_id += 1
+    new_room_id = str(batch.next_room_id)
+    batch.next_room_id += 1
+    rooms.append({"id": new_room_id, "name": name, "ai_control": False, "appliances": []})
+    batch.room_ids.add(new_room_id)
+    return {"room_id": new_room_id}
+
+def _update_room_settings(rooms, args, batch):
+    room = _find_room(rooms, args['room_id'])
+    if 'name' in args:
+        room['name'] = args['name']
+    if 'ai_control' in args:
+        room['ai_control'] = args['ai_control']
+    batch.room_ids.add(room['id'])
+
+def _save_room_order(rooms, args, batch):
+    rooms[:] = _reordered(rooms, list(args['order']))
+
+def _save_appliance_order(rooms, args, batch):
+    room = _find_room(rooms, args['room_id'])
+    room['appliances'] = _reordered(room.get('appliances', []), list(args['order']))
+    batch.room_ids.add(room['id'])
+
+# Keyed by the endpoint each operation mirrors; arguments are that endpoint's JSON body.
+OPERATIONS = {
+    'set-appliance-state': _set_appliance_state,
+    'set-appliance-name': _set_appliance_name,
+    'set-lock': _set_lock,
+    'set-timer': _set_timer,
+    'update-appliance-settings': _update_appliance_settings,
+    'add-room': _add_room,
+    'update-room-settings': _update_room_settings,
+    'save-room-order': _save_room_order,
+    'save-appliance-order': _save_appliance_order,
+}
+
+def run_batch(user_id, operations, atomic=False):
+    """
+    Applies `operations` ([{"op", "args"}]) in order in one transaction.
+    Returns (results, batch): one {"status", ...} result per operation, and
+    the _Batch describing what was committed. Failed operations are skipped,
+    unless `atomic`, in which case the first failure raises its MutationError
+    (with the per-operation `results` attached) and nothing is written.
+    """
+    rooms_key, order_key = user_key(user_id, 'rooms'), pending_order_key(user_id)
+    owned = get_owned_board_ids(user_id)
+
+    def _apply(docs):
+        if docs[rooms_key] is None:
+            raise MutationError("User data not found.", 404)
+        batch, results = _Batch(owned), []
+        # The rooms document is rewritten anyway, so any buffered drag & drop order goes with it.
+        rooms = docs[rooms_key] = apply_pending_order(docs[rooms_key], docs[order_key])
+        changed = [rooms_key] + ([order_key] if docs[order_key] else [])
+        docs[order_key] = {}
+
+        for index, operation in enumerate(operations):
+            try:
+                name, args = operation.get('op'), operation.get('args') or {}
+                if name not in OPERATIONS:
+                    raise MutationError(f"Unknown or unbatchable operation '{name}'.", 400)
+                result = OPERATIONS[name](rooms, args, batch)
+                results.append(dict(result or {}, status="success"))
+            except (MutationError, KeyError, TypeError, AttributeError) as e:
+                error = e if isinstance(e, MutationError) else MutationError("Invalid request data.", 400)
+                results.append({"status": "error", "message": error.message, "code": error.status})
+                if atomic:
+                    error.results = ([dict(r, status="rolled_back") if r['status'] == "success" else r for r in results]
+                                     + [{"status": "skipped"}] * (len(operations) - index - 1))
+                    raise error
+        return (results, batch), changed
+
+    return run_transaction([rooms_key, order_key], _apply)
@@ -0,0 +1,182 @@
+import hmac
+import json
+import hashlib
+import secrets
+from database.redis_db import redis_client, read_doc, read_docs, remember_docs, encode_doc
+from database.connection import startup_lock
+from database.presence import register_boards, forget_boards, KNOWN_DEVICES_SEEDED_KEY
+from database.telemetry import forget_relays
+from database.events import publish_change
+
+# --- Board Registry Key Layout ---
+# Every board is stored under its own key, with Redis sets acting as secondary
+# indexes so lookups cost O(boards matched) instead of O(boards in existence):
+#   board:{board_id}                          -> the board dict
+#   boards:all                                -> set of every generated board_id
+#   boards:suspended                          -> set of suspended board_ids
+#   user:{owner_id}:boards                    -> set of board_ids owned by a user
+#   user:{owner_id}:room:{room_id}:boards     -> set of board_ids registered to one room
+ALL_BOARDS_KEY = 'boards:all'
+SUSPENDED_BOARDS_KEY = 'boards:suspended'
+MGET_CHUNK_SIZE = 500
+
+def board_key(board_id):
+    return f"board:{board_id}"
+
+def owner_boards_key(owner_id):
+    return f"user:{owner_id}:boards"
+
+def room_boards_key(owner_id, room_id):
+    return f"user:{owner_id}:room:{room_id}:boards"
+
+def hash_board_token(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+def new_board_token():
+    """
+    Generates the secret a board presents to authenticate itself. Returns
+    (token, token_hash): the token is shown once to be flashed into the
+    board's firmware, and only its hash is stored on the board as `token_hash`.
+    """
+    token = secrets.token_urlsafe(32)
+    return token, hash_board_token(token)
+
+def verify_board_token(board, token):
+    token_hash = (board or {}).get('token_hash')
+    return bool(token_hash and token) and hmac.compare_digest(token_hash, hash_board_token(token))
+
+def without_secrets(boards):
+    """Drops the stored token hash from boards about to be sent to a client. Returns the boards."""
+    for board in boards:
+        board.pop('token_hash', None)
+    return boards
+
+# --- Reads ---
+
+def get_board_from_db(board_id):
+    """Fetches a single board by its ID. Returns None if it does not exist."""
+    if not board_id:
+        return None
+    return read_doc(board_key(board_id))
+
+def get_boards_from_db(board_ids):
+    """Fetches many boards in chunked MGETs, skipping IDs that no longer exist."""
+    board_ids = list(board_ids)
+    boards = []
+    for i in range(0, len(board_ids), MGET_CHUNK_SIZE):
+        chunk = board_ids[i:i + MGET_CHUNK_SIZE]
+        boards.extend(b for b in read_docs([board_key(bid) for bid in chunk]) if b)
+    return boards
+
+def get_boards_for_owner(owner_id):
+    """Fetches every board owned by a user through the owner index."""
+    return get_boards_from_db(sorted(redis_client.smembers(owner_boards_key(owner_id))))
+
+def get_boards_for_room(owner_id, room_id):
+    """Fetches every board a user has registered to one of their rooms."""
+    return get_boards_from_db(sorted(redis_client.smembers(room_boards_key(owner_id, room_id))))
+
+def get_all_boards_from_db():
+    """Fetches every generated board. Only meant for admin listings."""
+    return get_boards_from_db(sorted(redis_client.smembers(ALL_BOARDS_KEY)))
+
+def count_all_boards():
+    return redis_client.scard(ALL_BOARDS_KEY)
+
+def get_owned_board_ids(owner_id):
+    """The IDs of all boards a user owns, from the owner index (one SMEMBERS)."""
+    return redis_client.smembers(owner_boards_key(owner_id))
+
+def is_board_owned_by(owner_id, board_id):
+    """Checks ownership through the owner index without loading the board."""
+    return bool(board_id) and bool(redis_client.sismember(owner_boards_key(owner_id), board_id))
+
+# --- Writes ---
+
+def unindex_owner(pipe, board):
+    """Queues removal of a board from its current owner/room indexes."""
+    owner_id, room_id = board.get('owner_id'), board.get('room_id')
+    if owner_id:
+        pipe.srem(owner_boards_key(owner_id), board['board_id'])
+        if room_id:
+            pipe.srem(room_boards_key(owner_id, room_id), board['board_id'])
+
+def index_owner(pipe, board):
+    """Queues addition of a board to its current owner/room indexes."""
+    owner_id, room_id = board.get('owner_id'), board.get('room_id')
+    if owner_id:
+        pipe.sadd(owner_boards_key(owner_id), board['board_id'])
+        if room_id:
+            pipe.sadd(room_boards_key(owner_id, room_id), board['board_id'])
+
+def _index_board(pipe, board):
+    """Queues the board document and all of its index entries."""
+    board_id = board['board_id']
+    pipe.set(board_key(board_id), encode_doc(board))
+    pipe.sadd(ALL_BOARDS_KEY, board_id)
+    if board.get('is_suspended'):
+        pipe.sadd(SUSPENDED_BOARDS_KEY, board_id)
+    else:
+        pipe.srem(SUSPENDED_BOARDS_KEY, board_id)
+    index_owner(pipe, board)
+    register_boards([board], pipe)
+
+def create_board_in_db(board):
+    """Stores a newly generated board and adds it to the registry indexes."""
+    pipe = redis_client.pipeline()
+    _index_board(pipe, board)
+    pipe.execute()
+    remember_docs({board_key(board['board_id']): board})
+
+def delete_boards_from_db(board_ids):
+    """Deletes boards and all of their index entries. Returns the number deleted."""
+    boards = get_boards_from_db(board_ids)
+    if not boards:
+        return 0
+    pipe = redis_client.pipeline()
+    for board in boards:
+        unindex_owner(pipe, board)
+        pipe.delete(board_key(board['board_id']))
+        pipe.srem(ALL_BOARDS_KEY, board['board_id'])
+        pipe.srem(SUSPENDED_BOARDS_KEY, board['board_id'])
+    forget_boards(boards, pipe)
+    forget_relays([r['id'] for b in boards for r in b.get('relays', [])], pipe)
+    pipe.execute()
+    remember_docs({board_key(b['board_id']): None for b in boards})
+    for owner_id in {b['owner_id'] for b in boards if b.get('owner_id')}:
+        publish_change(owner_id, ['boards'], board_ids=[b['board_id'] for b in boards if b.get('owner_id') == owner_id])
+    return len(boards)
+
+def delete_all_boards_from_db():
+    """Deletes every board in the registry."""
+    return delete_boards_from_db(redis_client.smembers(ALL_BOARDS_KEY))
+
+# --- Migration ---
+
+def seed_known_devices():
+    """Registers the boards stored before presence tracking checked device IDs. A no-op once done."""
+    if redis_client.exists(KNOWN_DEVICES_SEEDED_KEY):
+        return
+    boards = get_all_boards_from_db()
+    pipe = redis_client.pipeline()
+    if boards:
+        register_boards(boards, pipe)
+    pipe.set(KNOWN_DEVICES_SEEDED_KEY, 1)
+    pipe.execute()
+    print(f"Registered {len(boards)} boards for presence tracking.")
+
+def migrate_boards_to_board_keys():
+    """One-time split of the legacy 'boards' blob into per-board keys and indexes."""
+    # Run by every worker at startup; the lock makes the others wait and then find nothing left to split.
+    with startup_lock(redis_client, 'migrate-boards'):
+        boards_json = redis_client.get('boards')
+        if not boards_json:
+            return
+        all_boards = json.loads(boards_json)
+        pipe = redis_client.pipeline()
+        for board_id, board in all_boards.items():
+            board.setdefault('board_id', board_id)
+            _index_board(pipe, board)
+        pipe.rename('boards', 'boards:legacy')
+        pipe.execute()
+        print(f"Split {len(all_boards)} boards from the 'boards' key into per-board keys.")
@@ -0,0 +1,85 @@
+import json
+import zlib
+from config import Config
+
+# Faster serializers and zstd are optional; the matching codec is only
+# available when its package is installed.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# --- Stored Document Envelope ---
+# New values are written as MAGIC + envelope version + codec id + compression
+# id + payload. MAGIC starts with 0xFF, which can never start a UTF-8 JSON
+# text, so values written before the envelope existed are still read as plain
+# JSON and are upgraded to the configured codec the next time they are saved.
+MAGIC = b'\xffLD'
+ENVELOPE_VERSION = 1
+HEADER_SIZE = len(MAGIC) + 3
+
+def _json_dumps(value):
+    return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+def _json_loads(payload):
+    return orjson.loads(payload) if orjson else json.loads(payload)
+
+# name -> (id, dumps, loads)
+CODECS = {'json': (1, _json_dumps, _json_loads)}
+if orjson:
+    CODECS['orjson'] = (2, lambda v: orjson.dumps(v, option=orjson.OPT_NON_STR_KEYS), orjson.loads)
+if msgpack:
+    CODECS['msgpack'] = (3, lambda v: msgpack.packb(v, use_bin_type=True),
+                         lambda b: msgpack.unpackb(b, raw=False, strict_map_key=False))
+
+# name -> (id, compress, decompress)
+COMPRESSIONS = {'none': (0, None, None), 'zlib': (1, lambda b: zlib.compress(b, 1), zlib.decompress)}
+if zstandard:
+    COMPRESSIONS['zstd'] = (2, zstandard.ZstdCompressor(level=3).compress,
+                            lambda b: zstandard.ZstdDecompressor().decompress(b))
+
+_CODECS_BY_ID = {codec_id: loads for codec_id, _, loads in CODECS.values()}
+_COMPRESSIONS_BY_ID = {comp_id: decompress for comp_id, _, decompress in COMPRESSIONS.values()}
+
+def _lookup(table, name, setting):
+    if name not in table:
+        raise RuntimeError(f"FATAL: {setting}='{name}' is not available. Choose one of: {', '.join(table)} "
+                           f"(msgpack and zstd need their Python packages installed).")
+    return table[name]
+
+DEFAULT_CODEC = Config.DOC_CODEC
+DEFAULT_COMPRESSION = Config.DOC_COMPRESSION
+_lookup(CODECS, DEFAULT_CODEC, 'DOC_CODEC')
+_lookup(COMPRESSIONS, DEFAULT_COMPRESSION, 'DOC_COMPRESSION')
+
+def encode(value, codec=None, compression=None, compress_min_bytes=None):
+    """Serializes a document into a version-tagged envelope (bytes)."""
+    codec_id, dumps, _ = _lookup(CODECS, codec or DEFAULT_CODEC, 'DOC_CODEC')
+    comp_id, compress, _ = _lookup(COMPRESSIONS, compression or DEFAULT_COMPRESSION, 'DOC_COMPRESSION')
+    min_bytes = Config.DOC_COMPRESS_MIN_BYTES if compress_min_bytes is None else compress_min_bytes
+    payload = dumps(value)
+    if compress and len(payload) >= min_bytes:
+        payload = compress(payload)
+    else:
+        comp_id = 0
+    return MAGIC + bytes((ENVELOPE_VERSION, codec_id, comp_id)) + payload
+
+def decode(raw):
+    """Deserializes a stored value, whether enveloped or legacy plain JSON."""
+    if isinstance(raw, str) or not raw.startswith(MAGIC):
+        return _json_loads(raw)
+    version, codec_id, comp_id = raw[len(MAGIC):HEADER_SIZE]
+    if version != ENVELOPE_VERSION or codec_id not in _CODECS_BY_ID or comp_id not in _COMPRESSIONS_BY_ID:
+        raise ValueError(f"Unsupported document envelope (version {version}, codec {codec_id}, compression {comp_id}).")
+    payload = raw[HEADER_SIZE:]
+    if comp_id:
+        payload = _COMPRESSIONS_BY_ID[comp_id](payload)
+    return _CODECS_BY_ID[codec_id](payload)
@@ -0,0 +1,243 @@
+import json
+import time
+import threading
+from config import Config
+from database.redis_db import redis_client
+from database.connection import ProcessThread, run_subscriber, cooperative_workers
+from database.metrics import LatencyHistogram
+
+# --- Relay Command Queue ---
+# Commands for ESP relays live in Redis so every worker sees them and they
+# survive restarts. Each relay has its own keys:
+#   relay:{relay_id}:seq      -> counter handing out the relay's command sequence numbers
+#   relay:{relay_id}:commands -> list of queued "seq|queued_at|json" entries, oldest first
+#   relay:{relay_id}:inflight -> hash {entry, delivered_at, attempts} of the command awaiting an ack
+# Delivery is stop-and-wait: a relay gets its next command only once the
+# previous one is acked (POST /api/esp/ack), and an unacked command is sent
+# again after COMMAND_ACK_TIMEOUT seconds. A relay only has an on/off state,
+# so a new state command replaces anything the relay has not fetched or acked
+# yet (last writer wins). Enqueue, delivery and ack are Lua scripts, so the
+# sequence number, queue and in-flight slot always change together.
+#
+# Long-polling check-ins do not hold a Redis connection while they wait:
+# enqueue() publishes the relay_id on RELAY_WAKE_CHANNEL, and one listener per
+# worker wakes the check-ins waiting for that relay in the same process.
+RELAY_WAKE_CHANNEL = 'relays:wake'
+
+def relay_queue_key(relay_id):
+    return f"relay:{relay_id}:commands"
+
+def relay_seq_key(relay_id):
+    return f"relay:{relay_id}:seq"
+
+def relay_inflight_key(relay_id):
+    return f"relay:{relay_id}:inflight"
+
+# KEYS: seq, commands, inflight   ARGV: command json, replace (1/0), ttl, now, relay_id, wake channel
+_ENQUEUE_SCRIPT = """
+local seq = redis.call('INCR', KEYS[1])
+if ARGV[2] == '1' then
+    redis.call('DEL', KEYS[2], KEYS[3])
+end
+redis.call('RPUSH', KEYS[2], seq .. '|' .. ARGV[4] .. '|' .. ARGV[1])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+redis.call('PUBLISH', ARGV[6], ARGV[5])
+return seq
+"""
+
+# KEYS: commands, inflight   ARGV: now, ack timeout, ttl   Returns {entry, attempts} or nil
+_DELIVER_SCRIPT = """
+local inflight = redis.call('HMGET', KEYS[2], 'entry', 'delivered_at')
+if inflight[1] then
+    if tonumber(ARGV[1]) - tonumber(inflight[2]) < tonumber(ARGV[2]) then
+        return false
+    end
+    redis.call('HSET', KEYS[2], 'delivered_at', ARGV[1])
+    return {inflight[1], redis.call('HINCRBY', KEYS[2], 'attempts', 1)}
+end
+local entry = redis.call('LPOP', KEYS[1])
+if not entry then
+    return false
+end
+redis.call('HSET', KEYS[2], 'entry', entry, 'delivered_at', ARGV[1], 'attempts', 0)
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+return {entry, 0}
+"""
+
+# KEYS: inflight, commands   ARGV: seq
+# Returns the acked command's delivered_at, '' if it was still queued (delivered
+# over MQTT, see mqtt/client.py), or nil if there is no such command.
+_ACK_SCRIPT = """
+local inflight = redis.call('HMGET', KEYS[1], 'entry', 'delivered_at')
+if inflight[1] and string.match(inflight[1], '^(%d+)|') == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+    return inflight[2]
+end
+local acked = false
+local head = redis.call('LINDEX', KEYS[2], 0)
+while head and tonumber(string.match(head, '^(%d+)|')) <= tonumber(ARGV[1]) do
+    acked = acked or string.match(head, '^(%d+)|') == ARGV[1]
+    redis.call('LPOP', KEYS[2])
+    head = redis.call('LINDEX', KEYS[2], 0)
+end
+if acked then
+    return ''
+end
+return false
+"""
+
+def _parse_entry(entry):
+    """Splits a queue entry into (seq, queued_at, command dict including its seq)."""
+    seq, queued_at, body = entry.split('|', 2)
+    command = json.loads(body)
+    command['seq'] = int(seq)
+    return int(seq), float(queued_at), command
+
+def long_polling_available():
+    """Long polls are only served by cooperative (gevent) workers, where a waiting check-in costs a greenlet."""
+    return Config.CHECKIN_LONG_POLL_MAX > 0 and cooperative_workers()
+
+class CommandQueue:
+    """Per-relay command queues on a Redis client (any client with the redis-py scripting and pub/sub API)."""
+    def __init__(self, client, ttl=None):
+        self.client = client
+        self.ttl = ttl or Config.COMMAND_TTL
+        self.ack_timeout = Config.COMMAND_ACK_TIMEOUT
+        self.queue_to_delivery = LatencyHistogram('commands:queue_to_delivery', client)
+        self.delivery_to_ack = LatencyHistogram('commands:delivery_to_ack', client)
+        self._enqueue = client.register_script(_ENQUEUE_SCRIPT)
+        self._deliver = client.register_script(_DELIVER_SCRIPT)
+        self._ack = client.register_script(_ACK_SCRIPT)
+        self._waiters = {}
+        self._waiters_lock = threading.Lock()
+        self._listening = False
+        self._listener = ProcessThread(self._listen, on_start=self._stop_listening)
+
+    def enqueue(self, relay_id, command, replace=True):
+        """
+        Queues a command for a relay and returns its sequence number. With
+        `replace`, commands the relay has not fetched or acked yet are dropped.
+        """
+        return self._enqueue(
+            keys=[relay_seq_key(relay_id), relay_queue_key(relay_id), relay_inflight_key(relay_id)],
+            args=[json.dumps(command), int(replace), self.ttl, time.time(), relay_id, RELAY_WAKE_CHANNEL]
+        )
+
+    def enqueue_many(self, commands, replace=True):
+        """Queues {relay_id: command} for several relays in one round trip. Returns {relay_id: seq}."""
+        if not commands:
+            return {}
+        now = time.time()
+        pipe = self.client.pipeline(transaction=False)
+        for relay_id, command in commands.items():
+            self._enqueue(
+                keys=[relay_seq_key(relay_id), relay_queue_key(relay_id), relay_inflight_key(relay_id)],
+                args=[json.dumps(command), int(replace), self.ttl, now, relay_id, RELAY_WAKE_CHANNEL],
+                client=pipe
+            )
+        return dict(zip(commands, pipe.execute()))
+
+    def pop(self, relay_id):
+        """Delivers the relay's next command (or re-delivers an unacked one). Returns None if there is nothing to send."""
+        return self.pop_many([relay_id]).get(relay_id)
+
+    def pop_many(self, relay_ids):
+        """Delivers the next command of several relays in one round trip. Returns {relay_id: command} for those that had one."""
+        if not relay_ids:
+            return {}
+        relay_ids = list(dict.fromkeys(relay_ids))
+        now = time.time()
+        pipe = self.client.pipeline(transaction=False)
+        for relay_id in relay_ids:
+            self._deliver(keys=[relay_queue_key(relay_id), relay_inflight_key(relay_id)],
+                          args=[now, self.ack_timeout, self.ttl], client=pipe)
+        commands = {}
+        metrics = self.client.pipeline(transaction=False)
+        for relay_id, delivered in zip(relay_ids, pipe.execute()):
+            if not delivered:
+                continue
+            entry, attempts = delivered
+            _, queued_at, command = _parse_entry(entry)
+            if int(attempts) == 0:
+                self.queue_to_delivery.observe(now - queued_at, pipe=metrics)
+            else:
+                command['redelivery'] = True
+            commands[relay_id] = command
+        if commands:
+            metrics.execute()
+        return commands
+
+    def ack(self, relay_id, seq):
+        """
+        Marks a relay's command as applied: the one in flight, or a queued one
+        the relay got over MQTT (dropping any older ones still queued).
+        Returns False if there is no command `seq` to ack.
+        """
+        return self.ack_many({relay_id: seq})[relay_id]
+
+    def ack_many(self, acks):
+        """Acks {relay_id: seq} in one round trip. Returns {relay_id: acked}."""
+        now = time.time()
+        pipe = self.client.pipeline(transaction=False)
+        for relay_id, seq in acks.items():
+            self._ack(keys=[relay_inflight_key(relay_id), relay_queue_key(relay_id)], args=[int(seq)], client=pipe)
+        results = {}
+        metrics = self.client.pipeline(transaction=False)
+        for relay_id, delivered_at in zip(acks, pipe.execute()):
+            results[relay_id] = delivered_at is not None
+            if delivered_at:
+                self.delivery_to_ack.observe(now - float(delivered_at), pipe=metrics)
+        if any(results.values()):
+            metrics.execute()
+        return results
+
+    def wait(self, relay_id, timeout):
+        """Takes the relay's next command, waiting up to `timeout` seconds for one to be queued."""
+        return self.wait_many([relay_id], timeout).get(relay_id)
+
+    def wait_many(self, relay_ids, timeout):
+        """Like pop_many(), but waits up to `timeout` seconds until at least one of the relays has something to send."""
+        if timeout <= 0 or not relay_ids:
+            return self.pop_many(relay_ids)
+        relay_ids = list(dict.fromkeys(relay_ids))  # One waiter entry per relay, removed exactly once below
+        self._listener.start()
+        deadline = time.monotonic() + timeout
+        event = threading.Event()
+        with self._waiters_lock:
+            for relay_id in relay_ids:
+                self._waiters.setdefault(relay_id, set()).add(event)
+        try:
+            while True:
+                # Popping after registering the waiter means a wake-up can't slip in unnoticed.
+                commands = self.pop_many(relay_ids)
+                remaining = deadline - time.monotonic()
+                if commands or remaining <= 0:
+                    return commands
+                # Until the listener is subscribed, wake-ups may be lost, so re-check every second.
+                event.wait(remaining if self._listening else min(remaining, 1.0))
+                event.clear()
+        finally:
+            with self._waiters_lock:
+                for relay_id in relay_ids:
+                    waiters = self._waiters.get(relay_id)
+                    waiters.discard(event)
+                    if not waiters:
+                        del self._waiters[relay_id]
+
+    def _wake(self, relay_id):
+        with self._waiters_lock:
+            for event in self._waiters.get(relay_id, ()):
+                event.set()
+
+    def _listen(self):
+        run_subscriber(self.client, "Relay wake-up listener", RELAY_WAKE_CHANNEL,
+                       lambda channel, relay_id: self._wake(relay_id),
+                       on_subscribed=self._start_listening, on_lost=self._stop_listening)
+
+    def _start_listening(self):
+        self._listening = True
+
+    def _stop_listening(self):
+        self._listening = False
+
+command_queue = CommandQueue(redis_client)
@@ -0,0 +1,164 @@
+import os
+import time
+import uuid
+import threading
+from contextlib import contextmanager
+import redis
+from redis.backoff import ExponentialBackoff
+from redis.retry import Retry
+from config import Config
+
+# --- Redis Connection Management ---
+# Clients are created lazily, once per process: with gunicorn --preload the app
+# is imported in the master, and a socket opened there would otherwise be
+# shared by every forked worker. Each process gets its own bounded, blocking
+# pool with socket timeouts, periodic health-check PINGs on idle connections,
+# and retries with exponential backoff on connection errors and timeouts.
+
+def _connection_options(decode_responses):
+    return {
+        'decode_responses': decode_responses,
+        'max_connections': Config.REDIS_MAX_CONNECTIONS,
+        'timeout': Config.REDIS_POOL_TIMEOUT,  # Seconds to wait for a free connection in the pool
+        'socket_timeout': Config.REDIS_SOCKET_TIMEOUT,
+        'socket_connect_timeout': Config.REDIS_CONNECT_TIMEOUT,
+        'socket_keepalive': True,
+        'health_check_interval': Config.REDIS_HEALTH_CHECK_INTERVAL,
+        'retry': Retry(ExponentialBackoff(cap=1.0, base=0.05), Config.REDIS_RETRIES),
+        'retry_on_error': [redis.ConnectionError, redis.TimeoutError],
+    }
+
+class LazyRedis:
+    """A redis.Redis stand-in that builds its client and pool on first use in each process."""
+    def __init__(self, decode_responses=False, **overrides):
+        self._options = dict(_connection_options(decode_responses), **overrides)
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get_client(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    pool = redis.BlockingConnectionPool.from_url(Config.REDIS_URL, **self._options)
+                    self._client = redis.Redis(connection_pool=pool)
+                    self._pid = os.getpid()
+        return self._client
+
+    def register_script(self, script):
+        """Like redis.Redis.register_script, but registered against each process's own client on first call."""
+        return LazyScript(self, script)
+
+    def __getattr__(self, name):
+        return getattr(self.get_client(), name)
+
+class LazyScript:
+    """A Lua script declared at import time and bound to the calling process's client when first run."""
+    def __init__(self, lazy_client, script):
+        self.lazy_client = lazy_client
+        self.script = script
+        self._script = None
+        self._pid = None
+
+    def __call__(self, keys=None, args=None, client=None):
+        if self._pid != os.getpid():
+            self._script = self.lazy_client.get_client().register_script(self.script)
+            self._pid = os.getpid()
+        return self._script(keys=keys, args=args, client=client)
+
+# --- Background Threads ---
+# Listeners and flushers run as one daemon thread per process. Like the
+# clients above, they have to be started again in each forked worker.
+
+class ProcessThread:
+    """
+    A daemon thread started at most once per process. start() is a cheap pid
+    check once the thread runs. `on_start` runs just before the thread is
+    started, to reset state a forked worker inherited from its parent.
+    """
+    def __init__(self, target, on_start=None):
+        self.target = target
+        self.on_start = on_start
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Starts the thread unless it already runs in this process. Returns True if this call started it."""
+        if self._pid == os.getpid():
+            return False
+        with self._lock:
+            if self._pid == os.getpid():
+                return False
+            if self.on_start:
+                self.on_start()
+            threading.Thread(target=self.target, daemon=True).start()
+            self._pid = os.getpid()
+            return True
+
+def run_subscriber(client, name, channel, on_message, pattern=False, on_subscribed=None, on_lost=None):
+    """
+    Keeps a pub/sub subscription to `channel` (a glob pattern if `pattern`)
+    open for good, calling on_message(channel, data) for every message. When
+    the connection drops it waits a second and subscribes again.
+    on_subscribed() runs whenever the subscription is (re)established and
+    on_lost() whenever it drops, since messages sent in between are missed.
+    """
+    while True:
+        pubsub = client.pubsub()
+        try:
+            if pattern:
+                pubsub.psubscribe(channel)
+            else:
+                pubsub.subscribe(channel)
+            while True:
+                # get_message() waits with select() rather than a blocking read, so the
+                # pool's socket_timeout does not drop an idle subscription.
+                message = pubsub.get_message(timeout=1.0)
+                if message is None:
+                    continue
+                if message['type'] in ('subscribe', 'psubscribe'):
+                    if on_subscribed:
+                        on_subscribed()
+                elif message['type'] in ('message', 'pmessage'):
+                    on_message(message['channel'], message['data'])
+        except Exception as e:
+            print(f"{name} lost its Redis connection: {e}")
+        finally:
+            if on_lost:
+                on_lost()
+            pubsub.close()
+        time.sleep(1)
+
+def cooperative_workers():
+    """True under gevent-patched workers, where holding a request open (long poll, stream) costs a greenlet, not a worker."""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('socket') and monkey.is_module_patched('threading')
+
+@contextmanager
+def pipelined(client, transaction=True):
+    """Queues every command issued in the block and sends them in one round trip on exit."""
+    pipe = client.pipeline(transaction=transaction)
+    try:
+        yield pipe
+        pipe.execute()
+    finally:
+        pipe.reset()
+
+@contextmanager
+def startup_lock(client, name, ttl=300):
+    """
+    Runs the block in one process at a time. Every worker runs the startup
+    migrations, so the others wait here and then find the work already done.
+    The lock expires after `ttl` seconds in case its holder dies mid-way.
+    """
+    key, token = f"startup:{name}:lock", uuid.uuid4().hex
+    while not client.set(key, token, nx=True, ex=ttl):
+        time.sleep(0.1)
+    try:
+        yield
+    finally:
+        if client.get(key) == token:
+            client.delete(key)
@@ -0,0 +1,75 @@
+import threading
+from collections import OrderedDict
+
+class DocumentCache:
+    """
+    Process-local LRU cache of stored document values, bounded by their total size.
+
+    Entries are the encoded values exactly as read from Redis, so every hit is
+    decoded into a fresh object that callers are free to modify. Every write
+    to Redis bumps `epoch`; a value fetched before a concurrent invalidation
+    is not admitted, since it might already be stale.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.enabled = False
+        self.epoch = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        """Returns {key: value} for the keys that are cached, counting hits and misses."""
+        found = {}
+        with self._lock:
+            if not self.enabled:
+                return found
+            for key in keys:
+                value = self._entries.get(key)
+                if value is None:
+                    self.stats["misses"] += 1
+                    continue
+                self._entries.move_to_end(key)
+                found[key] = value
+                self.stats["hits"] += 1
+        return found
+
+    def put_many(self, values, epoch):
+        """Admits freshly fetched values unless something was invalidated since `epoch`."""
+        with self._lock:
+            if not self.enabled or epoch != self.epoch:
+                return
+            for key, value in values.items():
+                size = len(value)
+                if size > self.max_bytes:
+                    continue
+                old = self._entries.pop(key, None)
+                if old is not None:
+                    self._size -= len(old)
+                self._entries[key] = value
+                self._size += size
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+                self.stats["evictions"] += 1
+
+    def invalidate(self, keys):
+        with self._lock:
+            self.epoch += 1
+            for key in keys:
+                old = self._entries.pop(key, None)
+                if old is not None:
+                    self._size -= len(old)
+                    self.stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self.epoch += 1
+            self._entries.clear()
+            self._size = 0
+
+    def info(self):
+        with self._lock:
+            return dict(self.stats, enabled=self.enabled, entries=len(self._entries),
+                        bytes=self._size, max_bytes=self.max_bytes)
@@ -0,0 +1,138 @@
+import json
+import queue
+import threading
+from config import Config
+from database.redis_db import redis_client, user_key
+from database.connection import ProcessThread, run_subscriber, cooperative_workers
+
+# --- Live Dashboard Events ---
+# Every change to what a user's dashboard shows bumps the user's version, is
+# appended to the user's change log (read by GET /api/changes) and is
+# published on the user's channel, so any worker can push it to the user's
+# open tabs (GET /api/events):
+#   user:{user_id}:version -> counter, bumped by every change (the ETag of the dashboard reads)
+#   user:{user_id}:changes -> list of the last CHANGE_LOG_MAX change events, oldest first
+#   events:user:{user_id}  -> {"version": n, "parts": ["rooms", "boards", "settings"],
+#                              "room_ids": [...], "board_ids": [...], "room_id": ..., "appliance": {...}}
+# "parts" names what changed. "room_ids"/"board_ids" narrow it down to those
+# rooms or boards ([] for "rooms" means only the room order changed); without
+# them, any of that part may have changed. A change to a single appliance also
+# carries the appliance (and its room_id), so tabs can update it in place.
+# Each worker has one pattern subscription for all users and hands events to
+# the streams open in that process through small per-stream queues.
+USER_EVENTS_PATTERN = 'events:user:*'
+STREAM_QUEUE_SIZE = 100
+
+# KEYS: version, changes   ARGV: channel, event json without its opening brace, log size   Returns the new version
+_PUBLISH_CHANGE_SCRIPT = """
+local version = redis.call('INCR', KEYS[1])
+local event = '{"version": ' .. version .. ', ' .. ARGV[2]
+redis.call('RPUSH', KEYS[2], event)
+redis.call('LTRIM', KEYS[2], -tonumber(ARGV[3]), -1)
+redis.call('PUBLISH', ARGV[1], event)
+return version
+"""
+_publish_change = redis_client.register_script(_PUBLISH_CHANGE_SCRIPT)
+
+def user_events_channel(user_id):
+    return f"events:user:{user_id}"
+
+def user_version_key(user_id):
+    return user_key(user_id, 'version')
+
+def user_changes_key(user_id):
+    return user_key(user_id, 'changes')
+
+def get_user_version(user_id):
+    """The user's current data version (0 before their first change). One GET, no documents loaded."""
+    return int(redis_client.get(user_version_key(user_id)) or 0)
+
+def publish_change(user_id, parts, room_id=None, appliance=None, room_ids=None, board_ids=None):
+    """
+    Bumps the user's version, logs the change and tells their open dashboards
+    that `parts` of their data changed (only `room_ids`/`board_ids`, if given).
+    """
+    event = {"parts": list(parts)}
+    if appliance is not None:
+        event.update(room_id=room_id, appliance=appliance)
+        room_ids = [room_id]
+    if room_ids is not None:
+        event['room_ids'] = list(room_ids)
+    if board_ids is not None:
+        event['board_ids'] = [b for b in board_ids if b]
+    try:
+        return _publish_change(keys=[user_version_key(user_id), user_changes_key(user_id)],
+                               args=[user_events_channel(user_id), json.dumps(event)[1:], Config.CHANGE_LOG_MAX])
+    except Exception as e:
+        # The change itself is stored; dashboards catch up on their next refetch.
+        print(f"Error publishing dashboard event for user {user_id}: {e}")
+        return None
+
+def get_changes_since(user_id, since):
+    """
+    Returns (current version, [change events after `since`]) from the change
+    log, or (current version, None) if the log no longer reaches back to `since`.
+    """
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.get(user_version_key(user_id))
+    pipe.lrange(user_changes_key(user_id), 0, -1)
+    version, entries = pipe.execute()
+    version = int(version or 0)
+    if since == version:
+        return version, []
+    changes = [json.loads(entry) for entry in entries]
+    if since > version or not changes or changes[0]['version'] > since + 1:
+        return version, None
+    return version, [c for c in changes if c['version'] > since]
+
+def streaming_available():
+    """Event streams are only served by cooperative (gevent) workers, where an open stream costs a greenlet."""
+    return Config.EVENT_STREAM_MAX_DURATION > 0 and cooperative_workers()
+
+class EventHub:
+    """Fans the user event channels out to the event streams open in this process."""
+    def __init__(self, client):
+        self.client = client
+        self._streams = {}
+        self._lock = threading.Lock()
+        self._listener = ProcessThread(self._listen, on_start=self._reset_streams)
+
+    def subscribe(self, user_id):
+        """Registers a new stream for the user and returns the queue its events arrive on."""
+        self._listener.start()
+        events = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+        with self._lock:
+            self._streams.setdefault(str(user_id), set()).add(events)
+        return events
+
+    def unsubscribe(self, user_id, events):
+        with self._lock:
+            streams = self._streams.get(str(user_id))
+            if streams is not None:
+                streams.discard(events)
+                if not streams:
+                    del self._streams[str(user_id)]
+
+    def _dispatch(self, user_id, event):
+        with self._lock:
+            streams = list(self._streams.get(user_id, ()))
+        for events in streams:
+            try:
+                events.put_nowait(event)
+            except queue.Full:
+                # The tab is not keeping up; tell it to reload everything instead of queueing more.
+                with events.mutex:
+                    events.queue.clear()
+                events.put_nowait(json.dumps({"parts": ["rooms", "boards", "settings"]}))
+
+    def _listen(self):
+        prefix = USER_EVENTS_PATTERN[:-1]
+        run_subscriber(self.client, "Dashboard event listener", USER_EVENTS_PATTERN,
+                       lambda channel, data: self._dispatch(channel[len(prefix):], data), pattern=True)
+
+    def _reset_streams(self):
+        # Streams a forked worker inherited belong to its parent.
+        with self._lock:
+            self._streams = {}
+
+event_hub = EventHub(redis_client)
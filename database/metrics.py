@@ -0,0 +1,41 @@
+from database.redis_db import redis_client
+
+# --- Fleet-Wide Latency Histograms ---
+# Histograms are stored in Redis so observations from every worker add up:
+#   metrics:{name} -> hash of per-bucket counts ("le_0.05", ..., "le_inf") plus "count" and "sum"
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+def metrics_key(name):
+    return f"metrics:{name}"
+
+def _bucket_field(seconds):
+    bucket = next((b for b in LATENCY_BUCKETS if seconds <= b), None)
+    return f"le_{bucket}" if bucket is not None else "le_inf"
+
+class LatencyHistogram:
+    """A latency histogram with fixed buckets, shared by every worker through Redis."""
+    def __init__(self, name, client=None):
+        self.key = metrics_key(name)
+        self.client = client or redis_client
+
+    def observe(self, seconds, pipe=None):
+        """Records one observation (queued on `pipe` if given)."""
+        seconds = max(seconds, 0.0)
+        target = pipe if pipe is not None else self.client.pipeline(transaction=False)
+        target.hincrby(self.key, _bucket_field(seconds), 1)
+        target.hincrby(self.key, 'count', 1)
+        target.hincrbyfloat(self.key, 'sum', seconds)
+        if pipe is None:
+            target.execute()
+
+    def snapshot(self):
+        """Returns the bucket counts in order, with the total count and mean in seconds."""
+        raw = self.client.hgetall(self.key)
+        count = int(raw.get('count', 0))
+        buckets = {f"<={b}s": int(raw.get(f"le_{b}", 0)) for b in LATENCY_BUCKETS}
+        buckets[f">{LATENCY_BUCKETS[-1]}s"] = int(raw.get('le_inf', 0))
+        mean = float(raw.get('sum', 0)) / count if count else None
+        return {"count": count, "mean_seconds": mean, "buckets": buckets}
+
+    def reset(self):
+        self.client.delete(self.key)
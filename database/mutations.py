@@ -0,0 +1,344 @@
+import time
+import random
+import uuid
+import redis
+from database.redis_db import doc_client, user_key, read_doc, flush_docs, remember_docs, encode_doc, decode_doc
+from database.boards_db import (
+    board_key, is_board_owned_by, get_owned_board_ids, index_owner, unindex_owner, SUSPENDED_BOARDS_KEY
+)
+
+# --- Atomic Document Mutations ---
+# Each primitive WATCHes only the keys it touches (one user's rooms key and at
+# most two board keys), applies the change in Python and commits it with
+# MULTI/EXEC. If another worker wrote one of those keys in between, EXEC
+# aborts and the mutation is re-run against fresh data instead of silently
+# overwriting the other writer's update.
+MAX_RETRIES = 20
+
+transaction_stats = {"commits": 0, "conflicts": 0}
+
+class MutationError(Exception):
+    """A mutation was rejected. Carries the message and HTTP status for the API response."""
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+class _KeysChanged(Exception):
+    """Raised inside a mutation when the set of keys it needs to watch has changed."""
+
+def run_transaction(keys, mutate, queue_writes=None):
+    """
+    Runs `mutate(docs)` under WATCH on `keys` and commits the changed documents.
+
+    `docs` maps each key to its decoded value (None if missing). `mutate` edits
+    the documents in place and returns (result, changed_keys). Retries with a
+    small jittered backoff when a concurrent writer touches a watched key.
+    Writes to `keys` still buffered by this request are flushed first.
+    `queue_writes(pipe, result)`, if given, queues further commands (such as
+    index updates) into the same MULTI.
+    """
+    keys = list(dict.fromkeys(keys))
+    flush_docs(keys)
+    with doc_client.pipeline() as pipe:
+        for attempt in range(MAX_RETRIES):
+            try:
+                pipe.watch(*keys)
+                values = pipe.mget(keys)
+                docs = {k: decode_doc(v) for k, v in zip(keys, values)}
+                result, changed_keys = mutate(docs)
+                pipe.multi()
+                for key in changed_keys:
+                    pipe.set(key, encode_doc(docs[key]))
+                if queue_writes:
+                    queue_writes(pipe, result)
+                pipe.execute()
+                remember_docs({key: docs[key] for key in changed_keys})
+                transaction_stats["commits"] += 1
+                return result
+            except redis.WatchError:
+                transaction_stats["conflicts"] += 1
+                time.sleep(random.uniform(0, 0.001 * (attempt + 1)))
+    raise MutationError("The data is being changed by another request. Please try again.", 409)
+
+# --- Lookup Helpers ---
+
+def _find_room(rooms, room_id):
+    room = next((r for r in rooms or [] if r['id'] == room_id), None)
+    if not room:
+        raise MutationError("Room not found.", 404)
+    return room
+
+def _find_appliance(room, appliance_id):
+    appliance = next((a for a in room.get('appliances', []) if a['id'] == appliance_id), None)
+    if not appliance:
+        raise MutationError("Appliance not found.", 404)
+    return appliance
+
+def _find_relay(board, relay_id):
+    return next((r for r in (board or {}).get('relays', []) if r['id'] == relay_id), None)
+
+# --- Board Primitives ---
+# The board document and its owner/room/suspended index entries change in the
+# same MULTI, so two users can never both end up indexed as a board's owner.
+
+def register_board(owner_id, room_id, board_id):
+    """Registers an unowned board to a user's room. Returns the updated board."""
+    b_key = board_key(board_id)
+
+    def _apply(docs):
+        board = docs[b_key]
+        if not board:
+            raise MutationError("Board ID is not valid or has not been generated.", 404)
+        if board.get('owner_id'):
+            raise MutationError("This board is already registered.", 409)
+        board['owner_id'] = owner_id
+        board['room_id'] = room_id
+        return board, [b_key]
+
+    return run_transaction([b_key], _apply, index_owner)
+
+def release_boards(board_ids, owner_id=None):
+    """
+    Unregisters boards from their owners and frees their relays. With
+    `owner_id`, boards that user does not own are left alone. Returns the
+    released boards as they were before the release.
+    """
+    keys = [board_key(board_id) for board_id in board_ids]
+    if not keys:
+        return []
+
+    def _apply(docs):
+        released = []
+        for key in dict.fromkeys(keys):
+            board = docs[key]
+            if not board or not board.get('owner_id') or (owner_id and board['owner_id'] != owner_id):
+                continue
+            released.append(dict(board))
+            board['owner_id'] = None
+            board['room_id'] = None
+            for relay in board.get('relays', []):
+                relay['is_occupied'] = False
+        return released, [board_key(b['board_id']) for b in released]
+
+    def _unindex(pipe, released):
+        for board in released:
+            unindex_owner(pipe, board)
+
+    return run_transaction(keys, _apply, _unindex)
+
+def set_board_suspended(board_id, status):
+    """Suspends or un-suspends a board and updates the suspended index. Returns the updated board."""
+    b_key = board_key(board_id)
+
+    def _apply(docs):
+        board = docs[b_key]
+        if not board:
+            raise MutationError("Board not found.", 404)
+        board['is_suspended'] = status
+        return board, [b_key]
+
+    def _index(pipe, board):
+        if status:
+            pipe.sadd(SUSPENDED_BOARDS_KEY, board_id)
+        else:
+            pipe.srem(SUSPENDED_BOARDS_KEY, board_id)
+
+    return run_transaction([b_key], _apply, _index)
+
+def set_board_token_hash(board_id, token_hash):
+    """Replaces the hash of the token a board authenticates with, revoking the old token. Returns the updated board."""
+    b_key = board_key(board_id)
+
+    def _apply(docs):
+        board = docs[b_key]
+        if not board:
+            raise MutationError("Board not found.", 404)
+        board['token_hash'] = token_hash
+        return board, [b_key]
+
+    return run_transaction([b_key], _apply)
+
+# --- Appliance Primitives ---
+
+def mutate_user_rooms(user_id, mutate):
+    """Atomically applies `mutate(rooms)` to a user's rooms list and returns its result."""
+    rooms_key = user_key(user_id, 'rooms')
+
+    def _apply(docs):
+        if docs[rooms_key] is None:
+            raise MutationError("User data not found.", 404)
+        return mutate(docs[rooms_key]), [rooms_key]
+
+    return run_transaction([rooms_key], _apply)
+
+def set_appliance_state(user_id, room_id, appliance_id, state):
+    """Switches an appliance on or off (clearing its timer when off). Returns the updated appliance."""
+    def _apply(rooms):
+        appliance = _find_appliance(_find_room(rooms, room_id), appliance_id)
+        if not is_board_owned_by(user_id, appliance.get('board_id')):
+            raise MutationError("Authorization error: You do not own this board.", 403)
+        appliance['state'] = state
+        if not state:
+            appliance['timer'] = None  # Clear timer when turning off
+        return dict(appliance)
+
+    return mutate_user_rooms(user_id, _apply)
+
+def set_appliance_states(user_id, states):
+    """
+    Switches several appliances ({appliance_id: state}) in one transaction,
+    checking board ownership once for all of them. Appliances that no longer
+    exist are skipped. Returns [(room_id, appliance)] for those whose state changed.
+    """
+    owned = get_owned_board_ids(user_id)
+
+    def _apply(rooms):
+        changed = []
+        for room in rooms:
+            for appliance in room.get('appliances', []):
+                if appliance['id'] not in states:
+                    continue
+                if appliance.get('board_id') not in owned:
+                    raise MutationError("Authorization error: You do not own this board.", 403)
+                state = bool(states[appliance['id']])
+                if appliance.get('state') == state:
+                    continue
+                appliance['state'] = state
+                if not state:
+                    appliance['timer'] = None
+                changed.append((room['id'], dict(appliance)))
+        return changed
+
+    return mutate_user_rooms(user_id, _apply)
+
+def set_unlocked_appliance_states(user_id, state, room_id=None):
+    """
+    Switches every unlocked appliance (in one room, or all rooms) on or off in
+    one transaction, as AI detection does. Returns [(room_id, appliance)] for
+    the appliances whose state actually changed.
+    """
+    state = bool(state)
+
+    def _apply(rooms):
+        target_rooms = [_find_room(rooms, room_id)] if room_id else rooms
+        changed = []
+        for room in target_rooms:
+            for appliance in room.get('appliances', []):
+                if appliance.get('locked') or bool(appliance.get('state')) == state:
+                    continue
+                appliance['state'] = state
+                if not state:
+                    appliance['timer'] = None
+                changed.append((room['id'], dict(appliance)))
+        return changed
+
+    return mutate_user_rooms(user_id, _apply)
+
+def update_appliance(user_id, room_id, appliance_id, updates):
+    """Sets plain fields (name, locked, timer, state) on one appliance. Returns the updated appliance."""
+    def _apply(rooms):
+        appliance = _find_appliance(_find_room(rooms, room_id), appliance_id)
+        appliance.update(updates)
+        return dict(appliance)
+
+    return mutate_user_rooms(user_id, _apply)
+
+def add_appliance(user_id, room_id, name, board_id, relay_id):
+    """Occupies a free relay and adds a new appliance for it to a room in one transaction."""
+    rooms_key, b_key = user_key(user_id, 'rooms'), board_key(board_id)
+
+    def _apply(docs):
+        room = _find_room(docs[rooms_key], room_id)
+        board = docs[b_key]
+        if not board or board.get('owner_id') != user_id:
+            raise MutationError("Room or board not found, or you are not the owner.", 404)
+        relay = _find_relay(board, relay_id)
+        if not relay or relay.get('is_occupied'):
+            raise MutationError("Relay is not available or is already occupied.", 409)
+
+        relay['is_occupied'] = True
+        new_appliance = {"id": uuid.uuid4().hex, "name": name, "state": False, "locked": False, "timer": None, "board_id": board_id, "relay_id": relay_id}
+        room.setdefault('appliances', []).append(new_appliance)
+        return new_appliance, [rooms_key, b_key]
+
+    return run_transaction([rooms_key, b_key], _apply)
+
+def _peek_appliance_board(user_id, room_id, appliance_id):
+    """Reads (without watching) the board an appliance is currently wired to."""
+    rooms = read_doc(user_key(user_id, 'rooms')) or []
+    return _find_appliance(_find_room(rooms, room_id), appliance_id).get('board_id')
+
+def remove_appliance(user_id, room_id, appliance_id):
+    """Deletes an appliance and frees its relay in one transaction. Returns the removed appliance."""
+    rooms_key = user_key(user_id, 'rooms')
+    while True:
+        board_id = _peek_appliance_board(user_id, room_id, appliance_id)
+        keys = [rooms_key] + ([board_key(board_id)] if board_id else [])
+
+        def _apply(docs):
+            room = _find_room(docs[rooms_key], room_id)
+            appliance = _find_appliance(room, appliance_id)
+            if appliance.get('board_id') != board_id:
+                raise _KeysChanged()
+            changed = [rooms_key]
+            relay = _find_relay(docs.get(board_key(board_id)), appliance.get('relay_id')) if board_id else None
+            if relay:
+                relay['is_occupied'] = False
+                changed.append(board_key(board_id))
+            room['appliances'] = [a for a in room['appliances'] if a['id'] != appliance_id]
+            return appliance, changed
+
+        try:
+            return run_transaction(keys, _apply)
+        except _KeysChanged:
+            continue
+
+def move_appliance(user_id, room_id, appliance_id, new_room_id, name, new_board_id, new_relay_id):
+    """
+    Renames an appliance, rewires it to another relay and/or moves it to another
+    room in one transaction, freeing the old relay and occupying the new one.
+    """
+    rooms_key = user_key(user_id, 'rooms')
+    while True:
+        old_board_id = _peek_appliance_board(user_id, room_id, appliance_id)
+        board_ids = [b for b in dict.fromkeys([old_board_id, new_board_id]) if b]
+        keys = [rooms_key] + [board_key(b) for b in board_ids]
+
+        def _apply(docs):
+            rooms = docs[rooms_key]
+            original_room = _find_room(rooms, room_id)
+            appliance = _find_appliance(original_room, appliance_id)
+            if appliance.get('board_id') != old_board_id:
+                raise _KeysChanged()
+
+            changed = [rooms_key]
+            old_relay_id = appliance.get('relay_id')
+            if old_board_id != new_board_id or old_relay_id != new_relay_id:
+                old_relay = _find_relay(docs.get(board_key(old_board_id)), old_relay_id) if old_board_id else None
+                if old_relay:
+                    old_relay['is_occupied'] = False
+                    changed.append(board_key(old_board_id))
+
+                new_board = docs.get(board_key(new_board_id)) if new_board_id else None
+                if new_board:
+                    new_relay = _find_relay(new_board, new_relay_id)
+                    if not new_relay or new_relay.get('is_occupied'):
+                        raise MutationError("The new relay is unavailable or already occupied.", 409)
+                    new_relay['is_occupied'] = True
+                    changed.append(board_key(new_board_id))
+
+            appliance.update({'name': name, 'board_id': new_board_id, 'relay_id': new_relay_id})
+
+            if new_room_id != room_id:
+                target_room = next((r for r in rooms if r['id'] == new_room_id), None)
+                if not target_room:
+                    raise MutationError("Target room not found.", 404)
+                target_room.setdefault('appliances', []).append(appliance)
+                original_room['appliances'] = [a for a in original_room['appliances'] if a['id'] != appliance_id]
+            return appliance, list(dict.fromkeys(changed))
+
+        try:
+            return run_transaction(keys, _apply)
+        except _KeysChanged:
+            continue
@@ -0,0 +1,111 @@
+import time
+from config import Config
+from database.redis_db import redis_client, user_key, read_docs
+from database.connection import ProcessThread
+from database.mutations import run_transaction, MutationError
+
+# --- Write-Behind Ordering ---
+# Drag & drop fires a burst of order updates. Instead of rewriting the user's
+# rooms document for each one, the latest order is recorded in a small
+# per-user document and the user is scheduled in ORDER_DUE_KEY. A background
+# flusher in each worker picks up users whose window has passed and applies
+# the last recorded order to the rooms document in one transaction. Reads
+# overlay the pending order, so the UI never sees the old one.
+#   user:{id}:pending_order -> {"rooms": [room ids], "appliances": {room_id: [appliance ids]}}
+#   orders:due              -> zset of user_ids scored by when their pending order is written
+ORDER_DUE_KEY = 'orders:due'
+FLUSH_BATCH_SIZE = 100
+
+def pending_order_key(user_id):
+    return user_key(user_id, 'pending_order')
+
+def _reordered(items, order_ids, id_key='id'):
+    """Orders items by order_ids; items missing from the order keep their relative order at the end."""
+    position = {item_id: i for i, item_id in enumerate(order_ids)}
+    return sorted(items, key=lambda item: position.get(item[id_key], len(position)))
+
+def apply_pending_order(rooms, pending):
+    """Returns the rooms list with a pending order applied (the stored rooms are left untouched)."""
+    if not pending:
+        return rooms
+    if pending.get('rooms'):
+        rooms = _reordered(rooms, pending['rooms'])
+    appliance_orders = pending.get('appliances') or {}
+    if appliance_orders:
+        rooms = [dict(room, appliances=_reordered(room.get('appliances', []), appliance_orders[room['id']]))
+                 if room['id'] in appliance_orders else room for room in rooms]
+    return rooms
+
+def get_rooms_with_pending_order(user_id):
+    """Fetches a user's rooms as the UI should show them. Returns None if the user has no stored rooms."""
+    _flusher.start()
+    rooms, pending = read_docs([user_key(user_id, 'rooms'), pending_order_key(user_id)])
+    if rooms is None:
+        return None
+    return apply_pending_order(rooms, pending)
+
+def _record_order(user_id, update):
+    """Merges an order change into the user's pending order and schedules it to be written."""
+    _flusher.start()
+    key = pending_order_key(user_id)
+
+    def _apply(docs):
+        docs[key] = docs[key] or {}
+        update(docs[key])
+        return None, [key]
+
+    run_transaction([key], _apply)
+    # NX keeps the first deadline, so a long burst is still written every ORDER_WRITE_WINDOW seconds.
+    redis_client.zadd(ORDER_DUE_KEY, {user_id: time.time() + Config.ORDER_WRITE_WINDOW}, nx=True)
+
+def save_room_order(user_id, order_ids):
+    """Buffers a new room order for the user."""
+    _record_order(user_id, lambda pending: pending.update(rooms=list(order_ids)))
+
+def save_appliance_order(user_id, room_id, order_ids):
+    """Buffers a new appliance order for one of the user's rooms."""
+    rooms = get_rooms_with_pending_order(user_id) or []
+    if not any(room['id'] == room_id for room in rooms):
+        raise MutationError("Room not found.", 404)
+    _record_order(user_id, lambda pending: pending.setdefault('appliances', {}).update({room_id: list(order_ids)}))
+
+def flush_pending_order(user_id):
+    """Writes a user's pending order into their rooms document and clears it, in one transaction."""
+    rooms_key, key = user_key(user_id, 'rooms'), pending_order_key(user_id)
+
+    def _apply(docs):
+        if not docs[key]:
+            return False, []
+        if docs[rooms_key] is not None:
+            docs[rooms_key] = apply_pending_order(docs[rooms_key], docs[key])
+        # Kept as an empty document rather than deleted, so the process cache can serve "nothing pending".
+        docs[key] = {}
+        return True, [rooms_key, key] if docs[rooms_key] is not None else [key]
+
+    return run_transaction([rooms_key, key], _apply)
+
+def flush_due_orders(now=None):
+    """Writes every pending order whose window has passed. Returns how many users were flushed."""
+    due = redis_client.zrangebyscore(ORDER_DUE_KEY, 0, now or time.time(), start=0, num=FLUSH_BATCH_SIZE)
+    flushed = 0
+    for user_id in due:
+        # ZREM doubles as a claim: only the worker that removes the entry writes it.
+        if not redis_client.zrem(ORDER_DUE_KEY, user_id):
+            continue
+        try:
+            flush_pending_order(user_id)
+            flushed += 1
+        except Exception as e:
+            print(f"Error flushing pending order for user {user_id}: {e}")
+            redis_client.zadd(ORDER_DUE_KEY, {user_id: time.time() + Config.ORDER_WRITE_WINDOW}, nx=True)
+    return flushed
+
+def _run_flusher():
+    while True:
+        time.sleep(Config.ORDER_WRITE_WINDOW / 2)
+        try:
+            flush_due_orders()
+        except Exception as e:
+            print(f"Pending order flusher error: {e}")
+
+_flusher = ProcessThread(_run_flusher)
@@ -0,0 +1,142 @@
+import time
+import threading
+from config import Config
+from database.redis_db import redis_client
+
+# --- Device Presence ---
+# When each board and relay was last heard from (check-ins, acks, MQTT status):
+#   presence:boards -> zset of board_ids scored by last-seen unix time
+#   presence:relays -> zset of relay_ids scored by last-seen unix time
+# A device counts as online if it was seen within PRESENCE_ONLINE_WINDOW
+# seconds. Devices check in far more often than that, so each process writes
+# a device's timestamp at most once every PRESENCE_WRITE_INTERVAL seconds.
+# Counting online devices and paging through stale ones are score-range
+# queries on the zsets, O(log n) plus the size of the page.
+# Device IDs arrive on unauthenticated check-ins and on MQTT topics, so only
+# devices in the board registry are tracked: boards_db registers every board
+# and its relays here when it stores them, and forget_boards() drops them.
+# A relay being seen also counts as its board being seen, since most boards
+# run firmware that checks in relay by relay.
+#   presence:known_boards -> set of registered board_ids
+#   presence:relay_boards -> hash of relay_id -> board_id for the relays on registered boards
+BOARD_PRESENCE_KEY = 'presence:boards'
+RELAY_PRESENCE_KEY = 'presence:relays'
+KNOWN_BOARDS_KEY = 'presence:known_boards'
+RELAY_BOARDS_KEY = 'presence:relay_boards'
+KNOWN_DEVICES_SEEDED_KEY = 'presence:known_seeded'
+MAX_THROTTLED_DEVICES = 50000  # Devices whose last write each process remembers
+
+# KEYS: board presence, relay presence, known boards, relay -> board hash
+# ARGV: now, number of board ids, board ids..., relay ids...
+_RECORD_SEEN_SCRIPT = """
+local boards = tonumber(ARGV[2])
+for i = 3, 2 + boards do
+    if redis.call('SISMEMBER', KEYS[3], ARGV[i]) == 1 then
+        redis.call('ZADD', KEYS[1], 'GT', ARGV[1], ARGV[i])
+    end
+end
+for i = 3 + boards, #ARGV do
+    local board = redis.call('HGET', KEYS[4], ARGV[i])
+    if board then
+        redis.call('ZADD', KEYS[2], 'GT', ARGV[1], ARGV[i])
+        redis.call('ZADD', KEYS[1], 'GT', ARGV[1], board)
+    end
+end
+return 0
+"""
+_record_seen = redis_client.register_script(_RECORD_SEEN_SCRIPT)
+
+_last_written = {}
+_last_written_lock = threading.Lock()
+
+def _due(member, now):
+    """Claims this process's next write for a device. False if it was written less than PRESENCE_WRITE_INTERVAL ago."""
+    with _last_written_lock:
+        if now - _last_written.get(member, 0) < Config.PRESENCE_WRITE_INTERVAL:
+            return False
+        if len(_last_written) >= MAX_THROTTLED_DEVICES:
+            # Entries past the write interval no longer throttle anything.
+            for stale in [m for m, t in _last_written.items() if now - t >= Config.PRESENCE_WRITE_INTERVAL]:
+                del _last_written[stale]
+            if len(_last_written) >= MAX_THROTTLED_DEVICES:
+                _last_written.clear()
+        _last_written[member] = now
+        return True
+
+def record_seen(board_ids=(), relay_ids=(), pipe=None, now=None):
+    """
+    Records that devices were just heard from (queued on `pipe` if given).
+    Throttled per device; IDs of unregistered devices are ignored.
+    """
+    now = now or time.time()
+    boards = [board_id for board_id in board_ids if board_id and _due(('board', board_id), now)]
+    relays = [relay_id for relay_id in relay_ids if relay_id and _due(('relay', relay_id), now)]
+    if not boards and not relays:
+        return
+    _record_seen(keys=[BOARD_PRESENCE_KEY, RELAY_PRESENCE_KEY, KNOWN_BOARDS_KEY, RELAY_BOARDS_KEY],
+                 args=[now, len(boards)] + boards + relays, client=pipe)
+
+def register_boards(boards, pipe):
+    """Queues adding boards and their relays to the devices presence tracks."""
+    pipe.sadd(KNOWN_BOARDS_KEY, *[b['board_id'] for b in boards])
+    relay_boards = {r['id']: b['board_id'] for b in boards for r in b.get('relays', [])}
+    if relay_boards:
+        pipe.hset(RELAY_BOARDS_KEY, mapping=relay_boards)
+
+def forget_boards(boards, pipe):
+    """Queues the removal of deleted boards and their relays from presence tracking."""
+    board_ids = [b['board_id'] for b in boards]
+    pipe.zrem(BOARD_PRESENCE_KEY, *board_ids)
+    pipe.srem(KNOWN_BOARDS_KEY, *board_ids)
+    relay_ids = [r['id'] for b in boards for r in b.get('relays', [])]
+    if relay_ids:
+        pipe.zrem(RELAY_PRESENCE_KEY, *relay_ids)
+        pipe.hdel(RELAY_BOARDS_KEY, *relay_ids)
+
+def board_last_seen(boards):
+    """Returns {board_id: last seen unix time or None} for the given boards, in one round trip."""
+    if not boards:
+        return {}
+    board_ids = [b['board_id'] for b in boards]
+    return dict(zip(board_ids, redis_client.zmscore(BOARD_PRESENCE_KEY, board_ids)))
+
+def is_online(last_seen, now=None):
+    return last_seen is not None and (now or time.time()) - last_seen <= Config.PRESENCE_ONLINE_WINDOW
+
+def annotate_presence(boards):
+    """Adds `last_seen` and `online` to each board dict, as shown on the dashboard. Returns the boards."""
+    last_seen = board_last_seen(boards)
+    for board in boards:
+        board['last_seen'] = last_seen[board['board_id']]
+        board['online'] = is_online(board['last_seen'])
+    return boards
+
+def fleet_counts(total_boards, now=None):
+    """Counts boards and relays seen within the online window, against every board in the registry."""
+    cutoff = (now or time.time()) - Config.PRESENCE_ONLINE_WINDOW
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.zcount(BOARD_PRESENCE_KEY, cutoff, '+inf')
+    pipe.zcard(BOARD_PRESENCE_KEY)
+    pipe.zcount(RELAY_PRESENCE_KEY, cutoff, '+inf')
+    pipe.zcard(RELAY_PRESENCE_KEY)
+    boards_online, boards_seen, relays_online, relays_seen = pipe.execute()
+    return {
+        "boards": {"online": boards_online, "offline": boards_seen - boards_online,
+                   "never_seen": max(total_boards - boards_seen, 0)},
+        "relays": {"online": relays_online, "offline": relays_seen - relays_online},
+        "online_window_seconds": Config.PRESENCE_ONLINE_WINDOW,
+    }
+
+def stale_boards(limit=50, before=None, now=None):
+    """
+    Pages through boards that are offline, most recently seen first. Pass the
+    returned `next_before` as `before` to get the next page. Returns
+    ([{"board_id", "last_seen"}], next_before or None).
+    """
+    upper = (now or time.time()) - Config.PRESENCE_ONLINE_WINDOW
+    if before is not None:
+        upper = min(upper, before)
+    page = redis_client.zrevrangebyscore(BOARD_PRESENCE_KEY, f"({upper}", '-inf', start=0, num=limit, withscores=True)
+    boards = [{"board_id": board_id, "last_seen": seen} for board_id, seen in page]
+    next_before = page[-1][1] if len(page) == limit else None
+    return boards, next_before
@@ -1,53 +1,331 @@
 import os
 import json
-import redis
+from contextlib import contextmanager
+from functools import partial
+from flask import g, has_request_context
 from config import Config
+from database.connection import LazyRedis, ProcessThread, run_subscriber, pipelined, startup_lock
+from database.doc_cache import DocumentCache
+from database import codec
 
 # --- Redis Database Connection ---
-try:
-    redis_client = redis.from_url(Config.REDIS_URL, decode_responses=True) # decode_responses=True is important
-    redis_client.ping()
-    print("Successfully connected to Redis database.")
-except Exception as e:
-    print(f"FATAL: Could not connect to Redis. Error: {e}")
+# Both clients connect lazily in each process (see connection.py).
+redis_client = LazyRedis(decode_responses=True) # decode_responses=True is important
+# Stored documents are binary envelopes (see codec.py), so they are read through a client returning bytes.
+doc_client = LazyRedis()
+
+def check_redis_connection():
+    """Pings Redis once at startup so a bad REDIS_URL fails loudly instead of on the first request."""
+    try:
+        redis_client.ping()
+        print("Successfully connected to Redis database.")
+    except Exception as e:
+        raise RuntimeError(f"FATAL: Could not connect to Redis. Error: {e}") from e
+
+# --- Leases ---
+# Work that one process in the fleet should do at a time (firing timers,
+# ingesting unshared status) goes to whoever holds a lease key, renewed by its
+# holder and taken over by another process once it expires.
+
+# KEYS: lease   ARGV: token, ttl ms   Returns 1 if this token holds (or just took) the lease
+_HOLD_LEASE_SCRIPT = """
+local holder = redis.call('GET', KEYS[1])
+if holder == ARGV[1] then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+if not holder then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 1
+end
+return 0
+"""
+_hold_lease = redis_client.register_script(_HOLD_LEASE_SCRIPT)
+
+def hold_lease(key, token, ttl):
+    """Takes or renews the lease on `key` for `token` for `ttl` seconds. Returns False while another token holds it."""
+    return bool(_hold_lease(keys=[key], args=[token, int(ttl * 1000)]))
+
+# --- Per-User Key Layout ---
+# Each user's application data is split across its own keys so that a request
+# only reads and writes the slice belonging to the current user:
+#   user:{id}:settings -> the 'user_settings' dict
+#   user:{id}:rooms    -> the 'rooms' list (appliances live inside their room)
+#   user:{id}:meta     -> any remaining top-level fields (e.g. 'last_command')
+USER_DATA_PARTS = ('settings', 'rooms', 'meta')
+# Per-user keys owned by other modules, removed along with the user's data.
+USER_AUX_PARTS = ('pending_order', 'version', 'changes', 'scenes')
+
+# The email address lives in a user's settings, so the email -> user_id index is
+# maintained here, in the same transaction as every settings write.
+EMAIL_INDEX_KEY = 'users:by_email'
+
+def user_key(user_id, part):
+    """Builds the Redis key holding one part of a user's data."""
+    return f"user:{user_id}:{part}"
+
+def normalize_email(email):
+    """Normalizes an email address for use as an index field."""
+    return (email or '').strip().lower()
+
+def encode_doc(value):
+    """Serializes a document for storage with the configured codec."""
+    return codec.encode(value)
+
+def decode_doc(raw):
+    """Deserializes a stored document (any codec, or legacy plain JSON). Returns None for a missing key."""
+    return codec.decode(raw) if raw else None
+
+# --- Process-Local Document Cache ---
+# Stored documents are also kept in a per-process LRU (see doc_cache.py), so the
+# dashboard's 3-second poll does not touch Redis while nothing has changed.
+# Every write publishes the changed keys on DOC_INVALIDATION_CHANNEL and a
+# listener thread in each worker drops them from its own cache. The cache only
+# serves reads while that listener is subscribed, and is cleared whenever it
+# (re)subscribes, so a dropped connection cannot leave stale entries behind.
+DOC_INVALIDATION_CHANNEL = 'docs:invalidate'
+doc_cache = DocumentCache(Config.DOC_CACHE_MAX_BYTES)
+
+def _cache_subscribed():
+    doc_cache.clear()
+    doc_cache.enabled = True
+
+def _cache_unsubscribed():
+    doc_cache.enabled = False
+    doc_cache.clear()
+
+_invalidation_listener = ProcessThread(
+    partial(run_subscriber, redis_client, "Document cache listener", DOC_INVALIDATION_CHANNEL,
+            lambda channel, data: doc_cache.invalidate(json.loads(data)),
+            on_subscribed=_cache_subscribed, on_lost=_cache_unsubscribed),
+    on_start=_cache_unsubscribed)
+
+def _ensure_invalidation_listener():
+    if doc_cache.max_bytes:
+        _invalidation_listener.start()
+
+def _invalidate_docs(keys):
+    """Drops written keys from this worker's cache and tells every other worker to do the same."""
+    keys = list(keys)
+    if not keys or not doc_cache.max_bytes:
+        return
+    doc_cache.invalidate(keys)
+    redis_client.publish(DOC_INVALIDATION_CHANNEL, json.dumps(keys))
+
+def _fetch_raw_docs(keys, use_cache=True):
+    """MGETs encoded documents, serving whatever it can from the process-local cache unless `use_cache` is False."""
+    _ensure_invalidation_listener()
+    found = doc_cache.get_many(keys) if use_cache else {}
+    missing = [key for key in keys if key not in found]
+    if missing:
+        epoch = doc_cache.epoch
+        fetched = dict(zip(missing, doc_client.mget(missing)))
+        doc_cache.put_many({k: v for k, v in fetched.items() if v is not None}, epoch)
+        found.update(fetched)
+    return [found[key] for key in keys]
+
+# --- Request-Scoped Unit of Work ---
+# Inside a request every document read is memoized on flask.g, so a key is
+# fetched and decoded at most once per request (load_user and admin_required
+# asking for the same user record cost one GET). Plain document writes only
+# mark the key dirty; all dirty keys are flushed with a single MSET when the
+# request finishes. Writes that also maintain indexes, and the WATCH/MULTI
+# mutations, still go straight to Redis and just refresh the memoized copy.
+# Outside a request (startup migrations, scripts) everything hits Redis directly.
+
+class _UnitOfWork:
+    """The documents read or written during one request, and which of them are still unsaved."""
+    def __init__(self):
+        self.docs = {}
+        self.dirty = set()
+        self.bypass_cache = False
+
+def _unit_of_work():
+    if not has_request_context():
+        return None
+    uow = g.get('_redis_uow')
+    if uow is None:
+        uow = g._redis_uow = _UnitOfWork()
+    return uow
+
+def read_docs(keys):
+    """Fetches and decodes many documents in one MGET (None for missing keys), once per request."""
+    keys = list(keys)
+    if not keys:
+        return []
+    uow = _unit_of_work()
+    if uow is None:
+        return [decode_doc(raw) for raw in _fetch_raw_docs(keys)]
+    missing = [key for key in dict.fromkeys(keys) if key not in uow.docs]
+    if missing:
+        for key, raw in zip(missing, _fetch_raw_docs(missing, not uow.bypass_cache)):
+            uow.docs[key] = decode_doc(raw)
+    return [uow.docs[key] for key in keys]
+
+@contextmanager
+def fresh_reads():
+    """
+    Reads inside this block come straight from Redis rather than the process
+    cache, which other workers' writes only reach asynchronously. Use it when
+    the result is tagged with a version read from Redis (ETags, deltas), so
+    stale data is never served under a newer version. Documents memoized
+    earlier in the request are dropped unless they hold unsaved writes.
+    """
+    uow = _unit_of_work()
+    if uow is None:
+        yield
+        return
+    for key in [key for key in uow.docs if key not in uow.dirty]:
+        del uow.docs[key]
+    uow.bypass_cache = True
+    try:
+        yield
+    finally:
+        uow.bypass_cache = False
+
+def read_doc(key):
+    """Fetches and decodes one document. Returns None if the key does not exist."""
+    return read_docs([key])[0]
+
+def write_docs(docs):
+    """Stores {key: document}. Inside a request the keys are only marked dirty until the flush."""
+    if not docs:
+        return
+    uow = _unit_of_work()
+    if uow is None:
+        redis_client.mset({key: encode_doc(value) for key, value in docs.items()})
+        _invalidate_docs(docs)
+        return
+    uow.docs.update(docs)
+    uow.dirty.update(docs)
+
+def remember_docs(docs):
+    """Records documents that were just written (or deleted, as None) directly to Redis."""
+    uow = _unit_of_work()
+    if uow is not None:
+        uow.docs.update(docs)
+        uow.dirty.difference_update(docs)
+    _invalidate_docs(docs)
+
+def flush_docs(keys=None):
+    """Writes this request's dirty documents (or only those among `keys`) in one MSET."""
+    uow = _unit_of_work()
+    if uow is None or not uow.dirty:
+        return
+    pending = set(uow.dirty) if keys is None else uow.dirty.intersection(keys)
+    if not pending:
+        return
+    redis_client.mset({key: encode_doc(uow.docs[key]) for key in pending})
+    uow.dirty.difference_update(pending)
+    _invalidate_docs(pending)
+
+def init_request_cache(app):
+    """Registers the per-request flush of buffered writes on the app."""
+    @app.after_request
+    def flush_request_writes(response):
+        flush_docs()
+        return response
+
+    @app.teardown_request
+    def discard_request_cache(exc):
+        g.pop('_redis_uow', None)
 
 # --- DATABASE HELPER FUNCTIONS (Low-Level) ---
 
-def get_all_users_from_db():
-    """Fetches and decodes the 'users' list from Redis."""
-    users_json = redis_client.get('users')
-    return json.loads(users_json) if users_json else []
+def _queue_settings_write(pipe, user_id, settings, old_settings):
+    """Queues a settings write plus the matching email index update."""
+    old_email = normalize_email(old_settings.get('email'))
+    new_email = normalize_email(settings.get('email'))
+    pipe.set(user_key(user_id, 'settings'), encode_doc(settings))
+    if old_email and old_email != new_email:
+        pipe.hdel(EMAIL_INDEX_KEY, old_email)
+    if new_email:
+        pipe.hset(EMAIL_INDEX_KEY, new_email, user_id)
+
+def _write_user_settings(user_id, settings):
+    """Writes a user's settings under WATCH so the email index always matches the stored email."""
+    settings_key = user_key(user_id, 'settings')
+
+    def _write(pipe):
+        old_settings = decode_doc(pipe.get(settings_key)) or {}
+        pipe.multi()
+        _queue_settings_write(pipe, user_id, settings, old_settings)
+
+    doc_client.transaction(_write, settings_key)
+    remember_docs({settings_key: settings})
 
-def save_all_users_to_db(users_list):
-    """Encodes and saves the 'users' list to Redis."""
-    redis_client.set('users', json.dumps(users_list))
+def _write_user_keys(user_id, settings=None, rooms=None, meta=None):
+    """Writes the given parts of a user's data. Settings are written immediately, the rest with write_docs."""
+    if settings is not None:
+        _write_user_settings(user_id, settings)
+    docs = {}
+    if rooms is not None:
+        docs[user_key(user_id, 'rooms')] = rooms
+    if meta:
+        docs[user_key(user_id, 'meta')] = meta
+    write_docs(docs)
 
-def get_all_data_from_db():
-    """Fetches and decodes the 'data' dictionary from Redis."""
-    data_json = redis_client.get('data')
-    return json.loads(data_json) if data_json else {}
+def save_user_data_to_db(user_id, user_data):
+    """Splits a user's data dict into its per-user keys and writes them."""
+    meta = {k: v for k, v in user_data.items() if k not in ('user_settings', 'rooms')}
+    _write_user_keys(user_id, settings=user_data.get('user_settings'), rooms=user_data.get('rooms'), meta=meta)
 
-def save_all_data_to_db(data_dict):
-    """Encodes and saves the 'data' dictionary to Redis."""
-    redis_client.set('data', json.dumps(data_dict))
+def delete_user_data_from_db(user_id):
+    """Removes every per-user key for the given user, along with their email index entry."""
+    settings = get_user_settings_from_db(user_id)
+    keys = [user_key(user_id, part) for part in USER_DATA_PARTS + USER_AUX_PARTS]
+    with pipelined(redis_client) as pipe:
+        if normalize_email(settings.get('email')):
+            pipe.hdel(EMAIL_INDEX_KEY, normalize_email(settings.get('email')))
+        pipe.delete(*keys)
+    remember_docs(dict.fromkeys(keys))
 
-def save_users(users):
-    """MODIFIED: Saves the list of users to the Redis database."""
-    redis_client.set('users', json.dumps(users))
+def get_user_settings_from_db(user_id):
+    """Fetches only the 'user_settings' dict for a user."""
+    return read_doc(user_key(user_id, 'settings')) or {}
+
+def save_user_settings_to_db(user_id, settings):
+    """Saves only the 'user_settings' dict for a user."""
+    _write_user_settings(user_id, settings)
+
+def get_settings_for_users(user_ids):
+    """Fetches the 'user_settings' of many users in a single MGET. Returns {user_id: settings}."""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return {}
+    settings = read_docs([user_key(user_id, 'settings') for user_id in user_ids])
+    return {user_id: value or {} for user_id, value in zip(user_ids, settings)}
+
+def _write_legacy_data(app_data):
+    """Writes a legacy {user_id: user_data} dict into the per-user key layout."""
+    for user_id, user_data in app_data.items():
+        save_user_data_to_db(user_id, user_data)
 
 # MODIFICATION: Add a one-time data migration function
 def migrate_json_to_redis():
     """One-time script to migrate existing JSON data to Redis."""
-    print("Checking for data to migrate...")
-    # Check if Redis is empty but JSON files exist
-    if not redis_client.exists('users') and os.path.exists('users.json'):
-        with open('users.json', 'r') as f:
-            users_data = json.load(f)
-        save_all_users_to_db(users_data)
-        print(f"Migrated {len(users_data)} users from users.json to Redis.")
-
-    if not redis_client.exists('data') and os.path.exists('data.json'):
-        with open('data.json', 'r') as f:
-            app_data = json.load(f)
-        save_all_data_to_db(app_data)
-        print(f"Migrated data for {len(app_data)} users from data.json to Redis.")
+    # Every worker runs this at startup; only one at a time, so the split happens once.
+    with startup_lock(redis_client, 'migrate-data'):
+        print("Checking for data to migrate...")
+        # Check if Redis is empty but JSON files exist. The 'users' list written here
+        # is split into per-user records by users_db.migrate_users_to_user_keys().
+        if not redis_client.exists('users', 'users:legacy') and os.path.exists('users.json'):
+            with open('users.json', 'r') as f:
+                users_data = json.load(f)
+            redis_client.set('users', json.dumps(users_data))
+            print(f"Migrated {len(users_data)} users from users.json to Redis.")
+
+        # Split the old monolithic 'data' key into per-user keys. The blob is kept
+        # under 'data:legacy' so the migration can be inspected or rolled back.
+        legacy_json = redis_client.get('data')
+        if legacy_json:
+            app_data = json.loads(legacy_json)
+            _write_legacy_data(app_data)
+            redis_client.rename('data', 'data:legacy')
+            print(f"Split data for {len(app_data)} users from the 'data' key into per-user keys.")
+        elif not redis_client.exists('data:legacy') and os.path.exists('data.json'):
+            with open('data.json', 'r') as f:
+                app_data = json.load(f)
+            _write_legacy_data(app_data)
+            redis_client.set('data:legacy', json.dumps(app_data))
+            print(f"Migrated data for {len(app_data)} users from data.json to Redis.")
@@ -0,0 +1,55 @@
+import uuid
+from database.redis_db import user_key, read_doc
+from database.mutations import run_transaction, MutationError
+
+# --- Scenes ---
+# Named sets of appliance states a user can apply in one go:
+#   user:{id}:scenes -> [{"id", "name", "targets": [{"appliance_id", "state"}]}]
+# Kept apart from the rooms list, so managing scenes never rewrites it.
+# Targets refer to appliances by id only; applying a scene skips appliances
+# that have since been deleted.
+MAX_SCENES = 50
+
+def scenes_key(user_id):
+    return user_key(user_id, 'scenes')
+
+def get_scenes(user_id):
+    return read_doc(scenes_key(user_id)) or []
+
+def get_scene(user_id, scene_id):
+    scene = next((s for s in get_scenes(user_id) if s['id'] == scene_id), None)
+    if not scene:
+        raise MutationError("Scene not found.", 404)
+    return scene
+
+def save_scene(user_id, name, targets, scene_id=None):
+    """Creates a scene, or replaces the name and targets of `scene_id`. Returns the scene."""
+    key = scenes_key(user_id)
+
+    def _apply(docs):
+        scenes = docs[key] = docs[key] or []
+        if scene_id:
+            scene = next((s for s in scenes if s['id'] == scene_id), None)
+            if not scene:
+                raise MutationError("Scene not found.", 404)
+        else:
+            if len(scenes) >= MAX_SCENES:
+                raise MutationError(f"You can have at most {MAX_SCENES} scenes.", 400)
+            scene = {"id": uuid.uuid4().hex}
+            scenes.append(scene)
+        scene.update(name=name, targets=targets)
+        return dict(scene), [key]
+
+    return run_transaction([key], _apply)
+
+def delete_scene(user_id, scene_id):
+    key = scenes_key(user_id)
+
+    def _apply(docs):
+        scenes = docs[key] or []
+        if not any(s['id'] == scene_id for s in scenes):
+            raise MutationError("Scene not found.", 404)
+        docs[key] = [s for s in scenes if s['id'] != scene_id]
+        return None, [key]
+
+    return run_transaction([key], _apply)
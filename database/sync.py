@@ -0,0 +1,69 @@
+from database.boards_db import get_boards_for_owner, get_boards_from_db, is_board_owned_by, without_secrets
+from database.events import get_changes_since
+from database.ordering import get_rooms_with_pending_order
+from database.presence import annotate_presence
+
+# --- Delta Sync ---
+# Lets a dashboard that already holds version N of the user's data fetch only
+# what changed since, using the change log kept by publish_change() (see
+# database/events.py). Changed rooms are sent whole (with their appliances),
+# deleted ones by id, and the room order whenever rooms changed, so the reply
+# grows with the number of changes rather than with the size of the account.
+# If the log no longer reaches back to N, the reply is a full snapshot.
+
+def _collect(changes, part, ids_field):
+    """The ids of `part` touched by the changes, or None if any of them may have changed."""
+    touched = set()
+    for change in changes:
+        if part not in change['parts']:
+            continue
+        if ids_field not in change:
+            return None
+        touched.update(change[ids_field])
+    return touched
+
+def build_delta(user_id, since):
+    """
+    Returns the user's changes since version `since`:
+      {"version", "full": False, "rooms": {"changed", "removed", "order", "complete"} or None,
+       "boards": {"changed", "removed", "complete"} or None, "settings_changed"}
+    ("complete" means "changed" is the whole list, to be taken as is), or a
+    snapshot {"version", "full": True, "rooms", "boards"} when the change log
+    does not go back far enough.
+    """
+    version, changes = get_changes_since(user_id, since)
+    if changes is None:
+        return {
+            "version": version,
+            "full": True,
+            "rooms": get_rooms_with_pending_order(user_id) or [],
+            "boards": annotate_presence(without_secrets(get_boards_for_owner(user_id))),
+        }
+
+    delta = {"version": version, "full": False, "rooms": None, "boards": None,
+             "settings_changed": any('settings' in c['parts'] for c in changes)}
+
+    if any('rooms' in c['parts'] for c in changes):
+        rooms = get_rooms_with_pending_order(user_id) or []
+        touched = _collect(changes, 'rooms', 'room_ids')
+        current = {room['id'] for room in rooms}
+        delta['rooms'] = {
+            "changed": [room for room in rooms if touched is None or room['id'] in touched],
+            "removed": sorted((touched or set()) - current),
+            "order": [room['id'] for room in rooms],
+            "complete": touched is None,
+        }
+
+    if any('boards' in c['parts'] for c in changes):
+        touched = _collect(changes, 'boards', 'board_ids')
+        if touched is None:
+            boards = get_boards_for_owner(user_id)
+            removed = []
+        else:
+            owned = [board_id for board_id in sorted(touched) if is_board_owned_by(user_id, board_id)]
+            boards = get_boards_from_db(owned)
+            removed = sorted(touched - set(owned))
+        delta['boards'] = {"changed": annotate_presence(without_secrets(boards)), "removed": removed,
+                           "complete": touched is None}
+
+    return delta
@@ -0,0 +1,65 @@
+from config import Config
+from database.redis_db import redis_client
+from database.connection import pipelined
+from database.presence import record_seen, RELAY_BOARDS_KEY
+
+# --- Relay Telemetry ---
+# What boards report about their relays over MQTT (see mqtt/status.py):
+#   relay:{relay_id}:status -> hash {board_id, state, power, reported_at} with the latest report
+#   relay:{relay_id}:power  -> list of "reported_at|watts" samples, newest first, capped at POWER_SAMPLES_MAX
+
+def relay_status_key(relay_id):
+    return f"relay:{relay_id}:status"
+
+def relay_power_key(relay_id):
+    return f"relay:{relay_id}:power"
+
+def write_status_reports(reports):
+    """
+    Stores a batch of reports ({board_id, relay_id, reported_at, state?, power?})
+    in two round trips. Reports are applied in order, so the last one for a
+    relay is what its status hash ends up with. Anyone on the broker can
+    publish to the status topics, so reports are only stored for relays that
+    are registered to the board named in the topic.
+    """
+    relay_ids = list(dict.fromkeys(report['relay_id'] for report in reports))
+    if not relay_ids:
+        return
+    relay_boards = dict(zip(relay_ids, redis_client.hmget(RELAY_BOARDS_KEY, relay_ids)))
+    with pipelined(redis_client, transaction=False) as pipe:
+        for report in reports:
+            relay_id = report['relay_id']
+            if relay_boards[relay_id] != report['board_id']:
+                continue
+            status = {'board_id': report['board_id'], 'reported_at': report['reported_at']}
+            if 'state' in report:
+                status['state'] = int(report['state'])
+            if 'power' in report:
+                status['power'] = report['power']
+                pipe.lpush(relay_power_key(relay_id), f"{report['reported_at']}|{report['power']}")
+                pipe.ltrim(relay_power_key(relay_id), 0, Config.POWER_SAMPLES_MAX - 1)
+            pipe.hset(relay_status_key(relay_id), mapping=status)
+            record_seen([report['board_id']], [relay_id], pipe=pipe, now=report['reported_at'])
+
+def forget_relays(relay_ids, pipe):
+    """Queues the removal of the stored telemetry of deleted relays."""
+    keys = [key for relay_id in relay_ids for key in (relay_status_key(relay_id), relay_power_key(relay_id))]
+    if keys:
+        pipe.delete(*keys)
+
+def get_relay_statuses(relay_ids):
+    """Returns {relay_id: latest status} for the relays that have reported, in one round trip."""
+    pipe = redis_client.pipeline(transaction=False)
+    for relay_id in relay_ids:
+        pipe.hgetall(relay_status_key(relay_id))
+    statuses = {}
+    for relay_id, status in zip(relay_ids, pipe.execute()):
+        if not status:
+            continue
+        status['reported_at'] = float(status['reported_at'])
+        if 'state' in status:
+            status['state'] = bool(int(status['state']))
+        if 'power' in status:
+            status['power'] = float(status['power'])
+        statuses[relay_id] = status
+    return statuses
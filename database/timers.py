@@ -0,0 +1,114 @@
+import time
+from config import Config
+from database.redis_db import redis_client, user_key, read_docs, hold_lease
+from database.mutations import mutate_user_rooms, MutationError
+
+# --- Appliance Timers ---
+# Pending auto-off timers are indexed in one sorted set, scored by when they
+# fire, so scheduling or cancelling one is a single O(log n) ZADD/ZREM and the
+# due ones are a range query from the front:
+#   timers:due    -> zset of "{user_id}|{appliance_id}" scored by the appliance's `timer` (unix seconds)
+#   timers:leader -> token of the process currently firing timers (expires after TIMER_LEADER_TTL)
+# The appliance's `timer` field stays the source of truth: firing re-checks it,
+# so an index entry left behind by a cancelled or moved timer does nothing.
+TIMERS_DUE_KEY = 'timers:due'
+TIMERS_LEADER_KEY = 'timers:leader'
+TIMERS_SEEDED_KEY = 'timers:seeded'
+
+def _member(user_id, appliance_id):
+    return f"{user_id}|{appliance_id}"
+
+def _fire_time(timer):
+    """An appliance's timer as unix seconds, or None if it is not a valid timestamp (e.g. a stored string)."""
+    try:
+        return None if isinstance(timer, bool) else float(timer)
+    except (TypeError, ValueError):
+        return None
+
+def schedule_timer(user_id, appliance_id, fire_at):
+    """Indexes (or moves) an appliance's timer."""
+    redis_client.zadd(TIMERS_DUE_KEY, {_member(user_id, appliance_id): float(fire_at)})
+
+def cancel_timer(user_id, appliance_id):
+    redis_client.zrem(TIMERS_DUE_KEY, _member(user_id, appliance_id))
+
+def cancel_timers(user_id, appliance_ids):
+    if appliance_ids:
+        redis_client.zrem(TIMERS_DUE_KEY, *[_member(user_id, a) for a in appliance_ids])
+
+def hold_timer_lead(token):
+    """Takes or renews the timer-firing lead for `token`. Returns False while another process holds it."""
+    return hold_lease(TIMERS_LEADER_KEY, token, Config.TIMER_LEADER_TTL)
+
+def fire_due_timers(now=None):
+    """
+    Switches off every appliance whose timer is due (up to TIMER_BATCH_SIZE),
+    one transaction per user. Returns [(user_id, room_id, appliance)] for the
+    appliances switched off. Only the timer lead holder should call this.
+    """
+    now = now or time.time()
+    due = redis_client.zrangebyscore(TIMERS_DUE_KEY, '-inf', now, start=0, num=Config.TIMER_BATCH_SIZE)
+    if not due:
+        return []
+    # Claimed up front; entries that turn out not to be due, or whose user
+    # could not be updated, are put back below.
+    redis_client.zrem(TIMERS_DUE_KEY, *due)
+
+    by_user = {}
+    for member in due:
+        user_id, appliance_id = member.split('|', 1)
+        by_user.setdefault(user_id, set()).add(appliance_id)
+
+    fired, later = [], {}
+    for user_id, appliance_ids in by_user.items():
+        def _switch_off(rooms):
+            switched = []
+            for room in rooms:
+                for appliance in room.get('appliances', []):
+                    if appliance['id'] not in appliance_ids or not appliance.get('timer'):
+                        continue
+                    fire_at = _fire_time(appliance['timer'])
+                    if fire_at is not None and fire_at > now:
+                        later[_member(user_id, appliance['id'])] = fire_at  # Re-set meanwhile
+                    elif fire_at is not None and appliance.get('state'):
+                        appliance['state'] = False
+                        appliance['timer'] = None
+                        switched.append((user_id, room['id'], dict(appliance)))
+                    else:
+                        appliance['timer'] = None  # Already off, or not a timestamp
+            return switched
+
+        retry_at = {_member(user_id, a): now + Config.TIMER_POLL_INTERVAL for a in appliance_ids}
+        try:
+            fired.extend(mutate_user_rooms(user_id, _switch_off))
+        except MutationError as e:
+            if e.status != 404:  # 404: the user is gone, and their timers with them
+                print(f"Error firing timers for user {user_id}: {e.message}")
+                later.update(retry_at)
+        except Exception as e:
+            # One user's bad data must not lose the rest of the batch
+            print(f"Error firing timers for user {user_id}: {e}")
+            later.update(retry_at)
+    if later:
+        redis_client.zadd(TIMERS_DUE_KEY, later)
+    return fired
+
+# --- Migration ---
+
+def seed_timer_index(user_ids):
+    """Indexes the timers of appliances saved before the scheduler existed. A no-op once done."""
+    if redis_client.exists(TIMERS_SEEDED_KEY):
+        return
+    timers = {}
+    for i in range(0, len(user_ids), 500):
+        chunk = user_ids[i:i + 500]
+        for user_id, rooms in zip(chunk, read_docs([user_key(uid, 'rooms') for uid in chunk])):
+            for room in rooms or []:
+                for appliance in room.get('appliances', []):
+                    fire_at = _fire_time(appliance.get('timer'))
+                    if fire_at and appliance.get('state'):
+                        timers[_member(user_id, appliance['id'])] = fire_at
+    if timers:
+        redis_client.zadd(TIMERS_DUE_KEY, timers)
+    if redis_client.set(TIMERS_SEEDED_KEY, 1, nx=True):
+        print(f"Indexed {len(timers)} pending appliance timers.")
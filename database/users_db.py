@@ -0,0 +1,155 @@
+import json
+from database.redis_db import (
+    redis_client, doc_client, user_key, normalize_email, EMAIL_INDEX_KEY,
+    read_doc, read_docs, remember_docs, encode_doc, decode_doc
+)
+from database.connection import startup_lock
+
+# --- User Record Key Layout ---
+# Auth records are stored per user, with indexes maintained in the same
+# transaction as every record write so identity lookups are O(1):
+#   user:{id}:record               -> the auth record (username, password_hash, provider ids, flags)
+#   users:ids                      -> set of every user_id
+#   users:by_username:{lower name} -> set of user_ids with that name (display names are not unique)
+#   users:by_google_id             -> hash google_id -> user_id
+#   users:by_github_id             -> hash github_id -> user_id
+#   users:by_email                 -> hash email -> user_id (maintained with settings writes in redis_db)
+#   users:next_id                  -> counter holding the last allocated numeric user_id
+USER_IDS_KEY = 'users:ids'
+NEXT_USER_ID_KEY = 'users:next_id'
+OAUTH_PROVIDERS = ('google', 'github')
+
+def user_record_key(user_id):
+    return user_key(user_id, 'record')
+
+def username_index_key(username):
+    return f"users:by_username:{(username or '').strip().lower()}"
+
+def provider_index_key(provider):
+    return f"users:by_{provider}_id"
+
+def _user_id_sort_key(user_id):
+    """Sorts numeric IDs numerically (creation order) and any other IDs after them."""
+    return (0, int(user_id), '') if str(user_id).isdigit() else (1, 0, str(user_id))
+
+# --- Reads ---
+
+def get_user_record(user_id):
+    """Fetches a single auth record by user ID. Returns None if it does not exist."""
+    if not user_id:
+        return None
+    return read_doc(user_record_key(user_id))
+
+def get_user_records(user_ids):
+    """Fetches many auth records in one MGET, skipping IDs that no longer exist."""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return []
+    return [r for r in read_docs([user_record_key(uid) for uid in user_ids]) if r]
+
+def get_all_user_ids():
+    """Returns every user ID in creation order."""
+    return sorted(redis_client.smembers(USER_IDS_KEY), key=_user_id_sort_key)
+
+def get_all_user_records():
+    """Fetches every auth record in creation order. Only meant for admin listings."""
+    return get_user_records(get_all_user_ids())
+
+def get_user_by_username(username):
+    """Finds the auth record with exactly this username (the oldest one if names collide)."""
+    user_ids = sorted(redis_client.smembers(username_index_key(username)), key=_user_id_sort_key)
+    return next((u for u in get_user_records(user_ids) if u.get('username') == username), None)
+
+def username_exists(username):
+    """Case-insensitive check for an existing username."""
+    return redis_client.scard(username_index_key(username)) > 0
+
+def get_user_by_email(email):
+    """Finds a user's auth record by the email address in their settings."""
+    email = normalize_email(email)
+    if not email:
+        return None
+    return get_user_record(redis_client.hget(EMAIL_INDEX_KEY, email))
+
+def get_user_by_provider_id(provider, provider_id):
+    """Finds a user's auth record by their linked OAuth provider ID."""
+    if provider not in OAUTH_PROVIDERS or not provider_id:
+        return None
+    return get_user_record(redis_client.hget(provider_index_key(provider), str(provider_id)))
+
+def next_user_id():
+    """Allocates a new numeric user ID with a single INCR, so concurrent signups never share one."""
+    return str(redis_client.incr(NEXT_USER_ID_KEY))
+
+# --- Writes ---
+
+def _queue_index_changes(pipe, old_record, new_record):
+    """Queues the username and provider index updates for a record change."""
+    user_id = new_record['id']
+    old_name, new_name = old_record.get('username'), new_record.get('username')
+    if old_name and username_index_key(old_name) != username_index_key(new_name):
+        pipe.srem(username_index_key(old_name), user_id)
+    if new_name:
+        pipe.sadd(username_index_key(new_name), user_id)
+
+    for provider in OAUTH_PROVIDERS:
+        field = f"{provider}_id"
+        old_value, new_value = old_record.get(field), new_record.get(field)
+        if old_value and old_value != new_value:
+            pipe.hdel(provider_index_key(provider), old_value)
+        if new_value:
+            pipe.hset(provider_index_key(provider), new_value, user_id)
+
+def save_user_record(record):
+    """Saves an auth record and updates its identity indexes atomically."""
+    key = user_record_key(record['id'])
+
+    def _write(pipe):
+        old_record = decode_doc(pipe.get(key)) or {}
+        pipe.multi()
+        _queue_index_changes(pipe, old_record, record)
+        pipe.set(key, encode_doc(record))
+        pipe.sadd(USER_IDS_KEY, record['id'])
+
+    doc_client.transaction(_write, key)
+    remember_docs({key: record})
+
+def delete_user_record(user_id):
+    """Deletes an auth record and removes it from every identity index."""
+    record = get_user_record(user_id)
+    if not record:
+        return False
+    pipe = redis_client.pipeline()
+    _queue_index_changes(pipe, record, {'id': user_id})
+    pipe.delete(user_record_key(user_id))
+    pipe.srem(USER_IDS_KEY, user_id)
+    pipe.execute()
+    remember_docs({user_record_key(user_id): None})
+    return True
+
+# --- Migration ---
+
+def seed_user_id_counter():
+    """Starts the user ID counter at the highest existing numeric ID. A no-op once the counter exists."""
+    if redis_client.exists(NEXT_USER_ID_KEY):
+        return
+    numeric_ids = [int(uid) for uid in redis_client.smembers(USER_IDS_KEY) if str(uid).isdigit()]
+    if redis_client.set(NEXT_USER_ID_KEY, max(numeric_ids, default=0), nx=True):
+        print(f"Seeded the user ID counter at {max(numeric_ids, default=0)}.")
+
+def migrate_users_to_user_keys():
+    """One-time split of the legacy 'users' list into per-user records and indexes."""
+    # Run by every worker at startup; the lock makes the others wait and then find nothing left to split.
+    with startup_lock(redis_client, 'migrate-users'):
+        users_json = redis_client.get('users')
+        if not users_json:
+            return
+        all_users = json.loads(users_json)
+        pipe = redis_client.pipeline()
+        for record in all_users:
+            _queue_index_changes(pipe, {}, record)
+            pipe.set(user_record_key(record['id']), encode_doc(record))
+            pipe.sadd(USER_IDS_KEY, record['id'])
+        pipe.rename('users', 'users:legacy')
+        pipe.execute()
+        print(f"Split {len(all_users)} users from the 'users' key into per-user records.")
@@ -1,6 +1,6 @@
 from flask import Blueprint, render_template, request
 from flask_login import login_required, current_user
-from utils.helpers import get_current_user_theme, get_user_data
+from utils.helpers import get_current_user_theme
 
 frontend_bp = Blueprint('frontend', __name__)
 
@@ -36,8 +36,7 @@ def contact():
 @frontend_bp.route('/analytics.html')
 @login_required
 def analytics():
-    user_data = get_user_data()
-    theme = user_data['user_settings']['theme']
+    theme = get_current_user_theme()
     return render_template('analytics.html', theme=theme)
 
 @frontend_bp.route('/error_page')
@@ -0,0 +1,21 @@
+# Gunicorn settings, picked up automatically by `gunicorn app:app`.
+# ESP boards may long-poll /api/esp/checkin (see CHECKIN_LONG_POLL_MAX), so the
+# default worker is gevent: a held check-in costs a greenlet, not a worker process.
+# Set GUNICORN_WORKER_CLASS=sync to go back to plain workers (long polls are then answered immediately).
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+
+
+def post_worker_init(worker):
+    # Each worker opens its own MQTT connection once it is forked and set up
+    # (also subscribing to device status), instead of waiting for its first publish.
+    # Every worker also runs the timer scheduler; only the one holding the timer lead fires timers.
+    from mqtt.client import run_mqtt_thread
+    from utils.timer_scheduler import ensure_timer_scheduler
+    run_mqtt_thread()
+    ensure_timer_scheduler()
@@ -1,26 +1,15 @@
 # make_admin.py
-import json
-import redis
-from config import Config # Your app's config
+from database.users_db import get_user_record, save_user_record
 
 # --- IMPORTANT: CHANGE THIS ---
 ADMIN_USER_ID = "luminous@admin" # Change this to your actual user ID
 
 try:
-    redis_client = redis.from_url(Config.REDIS_URL, decode_responses=True)
-    
-    users_json = redis_client.get('users')
-    users = json.loads(users_json) if users_json else []
-    
-    admin_found = False
-    for user in users:
-        if user.get('id') == ADMIN_USER_ID:
-            user['is_admin'] = True
-            admin_found = True
-            break
-            
-    if admin_found:
-        redis_client.set('users', json.dumps(users))
+    user = get_user_record(ADMIN_USER_ID)
+
+    if user:
+        user['is_admin'] = True
+        save_user_record(user)
         print(f"Success! User with ID '{ADMIN_USER_ID}' is now an admin.")
     else:
         print(f"Error: User with ID '{ADMIN_USER_ID}' not found.")
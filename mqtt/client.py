@@ -1,27 +1,230 @@
+import json
+import time
+import uuid
 import threading
+from collections import deque
 import paho.mqtt.client as mqtt
 from config import Config
+from database.redis_db import hold_lease
+from database.connection import ProcessThread
+from mqtt.status import status_ingestor, status_topics, status_subscription
 
-mqtt_client = None
+# --- Relay Command Topics ---
+# Every relay has its own command topic under the board it is wired to:
+#   {MQTT_TOPIC_COMMAND}/{board_id}/{relay_id} -> {"state": 0|1, "seq": n, "ts": unix seconds}
+# A board subscribes to {MQTT_TOPIC_COMMAND}/{board_id}/+ and gets each command
+# as soon as it is published. Commands are sent with QoS 1 and retained, so the
+# broker keeps the last state of every relay and hands it to a board when it
+# (re)subscribes. An empty retained payload clears a relay's topic once it no
+# longer drives an appliance. "seq" is the relay's HTTP command queue sequence
+# number (see database/command_queue.py), which a board acks as usual so the
+# same command is not delivered to it again over HTTP.
+#
+# The topics carry the relay_id that authenticates /api/esp/checkin and
+# /api/esp/ack and the board_id that /api/register-board asks for, and the
+# status topics can ack commands. Anyone who can read or write them could
+# take over a device, so they are only used on a broker that requires
+# credentials and is not one of the well-known public ones, and only when
+# MQTT_DEVICE_TOPICS is on. Otherwise commands go over HTTP alone.
+PUBLIC_BROKERS = {'mqtt.eclipseprojects.io', 'test.mosquitto.org', 'broker.hivemq.com', 'broker.emqx.io'}
 
-def connect_mqtt():
-    """Connects to the MQTT broker."""
-    global mqtt_client
-    try:
-        mqtt_client = mqtt.Client()
-        def on_connect(client, userdata, flags, rc):
-            if rc == 0:
-                print("Connected to MQTT Broker successfully!")
+def device_topics_enabled():
+    return (Config.MQTT_DEVICE_TOPICS and bool(Config.MQTT_USERNAME)
+            and Config.MQTT_BROKER.lower() not in PUBLIC_BROKERS)
+
+def relay_command_topic(board_id, relay_id):
+    return f"{Config.MQTT_TOPIC_COMMAND}/{board_id}/{relay_id}"
+
+def board_command_filter(board_id):
+    """The subscription filter a board uses to receive the commands of all its relays."""
+    return f"{Config.MQTT_TOPIC_COMMAND}/{board_id}/+"
+
+def publish_relay_state(board_id, relay_id, state, seq=None, client=None):
+    """
+    Publishes a relay's new state as its retained last state. `client` is
+    anything with paho's publish(topic, payload, qos, retain) signature, so a
+    local broker stand-in can be passed in instead of the process's publisher.
+    """
+    client = client or mqtt_publisher
+    if not board_id or not device_topics_enabled():
+        return False
+    payload = {"state": int(state), "seq": seq, "ts": int(time.time())}
+    client.publish(relay_command_topic(board_id, relay_id), json.dumps(payload),
+                   qos=Config.MQTT_COMMAND_QOS, retain=True)
+    return True
+
+def clear_relay_state(board_id, relay_id, client=None):
+    """Removes a relay's retained state from the broker (e.g. after its appliance is deleted)."""
+    client = client or mqtt_publisher
+    if not board_id or not relay_id or not device_topics_enabled():
+        return False
+    client.publish(relay_command_topic(board_id, relay_id), b'', qos=Config.MQTT_COMMAND_QOS, retain=True)
+    return True
+
+def clear_board_state(board, client=None):
+    """Clears the retained state of every relay on a board (e.g. when it is unregistered)."""
+    for relay in board.get('relays', []):
+        clear_relay_state(board['board_id'], relay['id'], client)
+
+# --- MQTT Publisher ---
+# Each process (so each gunicorn worker, after the fork) gets its own broker
+# connection, started on first use or from gunicorn's post_worker_init hook.
+# Request handlers never talk to the broker: publish() appends to a bounded
+# outbound queue and returns, and a sender thread hands queued messages to
+# paho once connected. While the broker is unreachable paho reconnects with
+# exponential backoff (MQTT_RECONNECT_MIN_DELAY doubling up to
+# MQTT_RECONNECT_MAX_DELAY) and messages wait in the queue; when it is full
+# the oldest are dropped, as newer commands supersede them anyway.
+#
+# Status reports are normally shared between the workers' subscriptions (see
+# mqtt/status.py). With MQTT_STATUS_SHARE_GROUP set to '' the broker would send
+# every report to every worker, so then only the process holding the
+# mqtt:status:leader lease subscribes, and another takes over if it dies.
+RATE_WINDOW = 60  # Seconds over which the publish rate is reported
+STATUS_LEADER_KEY = 'mqtt:status:leader'
+STATUS_LEAD_TTL = 15  # Seconds before another process takes over unshared status ingestion
+
+class MqttPublisher:
+    """A per-process MQTT connection with a bounded, non-blocking outbound queue."""
+    def __init__(self, max_queued=None):
+        self.max_queued = max_queued or Config.MQTT_OUTBOUND_QUEUE_SIZE
+        self.client = None
+        self.connected = False
+        self.stats = {"queued": 0, "published": 0, "dropped": 0, "connects": 0, "disconnects": 0}
+        self._queue = deque()
+        self._recent = deque()  # [second, messages published in that second]
+        self._cond = threading.Condition()
+        self._status_lead = False  # Whether this process ingests status (only used without a share group)
+        self._sender = ProcessThread(self._run_sender, on_start=self._connect)
+        self._status_leader = ProcessThread(self._run_status_lead)
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        """Queues a message for the broker without blocking. Returns False if an older message had to be dropped."""
+        self.start()
+        with self._cond:
+            self.stats['queued'] += 1
+            dropped = len(self._queue) >= self.max_queued
+            if dropped:
+                self._queue.popleft()
+                self.stats['dropped'] += 1
+            self._queue.append((topic, payload, qos, retain))
+            self._cond.notify()
+        return not dropped
+
+    def info(self):
+        with self._cond:
+            since = int(time.time()) - RATE_WINDOW
+            published = sum(count for second, count in self._recent if second > since)
+            return dict(self.stats, connected=self.connected, queue_depth=len(self._queue),
+                        max_queued=self.max_queued, publish_rate=published / RATE_WINDOW)
+
+    def start(self):
+        """Connects this process to the broker, unless it already is."""
+        self._sender.start()
+        if device_topics_enabled() and not Config.MQTT_STATUS_SHARE_GROUP:
+            self._status_leader.start()
+
+    def _connect(self):
+        with self._cond:
+            # Anything queued before a fork was the parent's to send.
+            self._queue.clear()
+            self.connected = False
+            self._status_lead = False
+            self.client = self._create_client()
+            try:
+                # Connects from paho's network thread, which retries until the broker is reachable.
+                self.client.connect_async(Config.MQTT_BROKER, Config.MQTT_PORT, 60)
+                self.client.loop_start()
+            except Exception as e:
+                print(f"Error connecting to MQTT: {e}")
+
+    def _create_client(self):
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        if Config.MQTT_USERNAME:
+            client.username_pw_set(Config.MQTT_USERNAME, Config.MQTT_PASSWORD)
+        if Config.MQTT_USE_TLS:
+            client.tls_set()
+        client.reconnect_delay_set(Config.MQTT_RECONNECT_MIN_DELAY, Config.MQTT_RECONNECT_MAX_DELAY)
+        # Bounds paho's own buffer of QoS 1 messages awaiting their PUBACK.
+        client.max_queued_messages_set(self.max_queued)
+        client.on_connect = self._on_connect
+        client.on_disconnect = self._on_disconnect
+        client.message_callback_add(status_topics(), status_ingestor.on_message)
+        return client
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        if reason_code.is_failure:
+            print(f"Failed to connect to MQTT Broker: {reason_code}")
+            return
+        print("Connected to MQTT Broker successfully!")
+        with self._cond:
+            self.connected = True
+            self.stats['connects'] += 1
+            self._cond.notify()
+        # Subscribing here renews the subscription after every reconnect.
+        if device_topics_enabled() and (Config.MQTT_STATUS_SHARE_GROUP or self._status_lead):
+            client.subscribe(status_subscription(), qos=1)
+
+    def _on_disconnect(self, client, userdata, flags, reason_code, properties):
+        print(f"Disconnected from MQTT Broker ({reason_code}), reconnecting.")
+        with self._cond:
+            self.connected = False
+            self.stats['disconnects'] += 1
+
+    def _run_status_lead(self):
+        """Keeps (or waits for) the status ingestion lease, subscribing while this process holds it."""
+        token = uuid.uuid4().hex
+        while True:
+            try:
+                held = hold_lease(STATUS_LEADER_KEY, token, STATUS_LEAD_TTL)
+            except Exception as e:
+                print(f"Error renewing the MQTT status lease: {e}")
+                held = False
+            if held != self._status_lead:
+                self._status_lead = held
+                if self.connected:
+                    if held:
+                        self.client.subscribe(status_subscription(), qos=1)
+                    else:
+                        self.client.unsubscribe(status_subscription())
+            time.sleep(STATUS_LEAD_TTL / 3)
+
+    def _run_sender(self):
+        while True:
+            with self._cond:
+                while not (self.connected and self._queue):
+                    self._cond.wait()
+                message = self._queue.popleft()
+            topic, payload, qos, retain = message
+            try:
+                rc = self.client.publish(topic, payload, qos=qos, retain=retain).rc
+            except Exception as e:
+                print(f"Error publishing to MQTT topic {topic}: {e}")
+                rc = mqtt.MQTT_ERR_UNKNOWN
+            # A QoS 1 message that hits a dropped connection stays with paho and goes out after the reconnect.
+            if rc == mqtt.MQTT_ERR_SUCCESS or (rc == mqtt.MQTT_ERR_NO_CONN and qos > 0):
+                self._count_published()
+                continue
+            with self._cond:
+                if len(self._queue) < self.max_queued:
+                    self._queue.appendleft(message)
+                else:
+                    self.stats['dropped'] += 1
+            time.sleep(0.1)  # paho's buffer is full or the connection just dropped
+
+    def _count_published(self):
+        second = int(time.time())
+        with self._cond:
+            self.stats['published'] += 1
+            if self._recent and self._recent[-1][0] == second:
+                self._recent[-1][1] += 1
             else:
-                print(f"Failed to connect to MQTT Broker, return code {rc}")
-        mqtt_client.on_connect = on_connect
-        mqtt_client.connect(Config.MQTT_BROKER, Config.MQTT_PORT, 60)
-        mqtt_client.loop_start()
-    except Exception as e:
-        print(f"Error connecting to MQTT: {e}")
+                self._recent.append([second, 1])
+            while self._recent[0][0] <= second - RATE_WINDOW:
+                self._recent.popleft()
+
+mqtt_publisher = MqttPublisher()
 
 def run_mqtt_thread():
-    # Use a separate thread for the MQTT loop to prevent blocking
-    mqtt_thread = threading.Thread(target=connect_mqtt)
-    mqtt_thread.daemon = True
-    mqtt_thread.start()
+    """Connects this process to the broker in the background (the publisher also starts on first use)."""
+    mqtt_publisher.start()
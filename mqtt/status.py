@@ -0,0 +1,131 @@
+import json
+import time
+import threading
+from config import Config
+from database.telemetry import write_status_reports
+from database.command_queue import command_queue
+from database.connection import ProcessThread
+
+# --- Device Status Ingestion ---
+# Boards report on their relays on per-relay status topics:
+#   {MQTT_TOPIC_STATUS}/{board_id}/{relay_id} -> {"state": 0|1, "power": watts, "seq": n}  (all fields optional)
+# A report with "seq" confirms that the relay applied that command, and acks it
+# in the command queue like POST /api/esp/ack would. Like the command topics,
+# they are only subscribed to when device topics are enabled (see mqtt/client.py).
+#
+# The MQTT network thread only appends reports to a bounded in-memory buffer;
+# a flusher thread writes them to Redis in one pipeline once MQTT_STATUS_BATCH_SIZE
+# reports are waiting or MQTT_STATUS_FLUSH_INTERVAL seconds have passed. When
+# Redis falls behind and the buffer is full, new reports are dropped (and
+# counted) rather than stalling the network loop, which also carries commands.
+
+def status_topics():
+    """The filter matching every relay's status topic."""
+    return f"{Config.MQTT_TOPIC_STATUS}/+/+"
+
+def status_subscription():
+    """What to subscribe to: shared between workers through MQTT_STATUS_SHARE_GROUP, so each report is ingested once."""
+    if Config.MQTT_STATUS_SHARE_GROUP:
+        return f"$share/{Config.MQTT_STATUS_SHARE_GROUP}/{status_topics()}"
+    return status_topics()
+
+def parse_status_message(topic, payload):
+    """Turns a status message into a report dict. Returns None if it is malformed."""
+    prefix = Config.MQTT_TOPIC_STATUS + '/'
+    if not topic.startswith(prefix):
+        return None
+    parts = topic[len(prefix):].split('/')
+    if len(parts) != 2 or not all(parts):
+        return None
+    try:
+        data = json.loads(payload)
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+
+    report = {'board_id': parts[0], 'relay_id': parts[1], 'reported_at': time.time()}
+    if 'state' in data:
+        report['state'] = bool(data['state'])
+    if isinstance(data.get('power'), (int, float)) and not isinstance(data['power'], bool):
+        report['power'] = data['power']
+    if isinstance(data.get('seq'), int) and not isinstance(data['seq'], bool):
+        report['seq'] = data['seq']
+    return report
+
+class StatusIngestor:
+    """Buffers status reports and writes them to Redis in batches from a background thread."""
+    def __init__(self, max_buffered=None, batch_size=None, flush_interval=None):
+        self.max_buffered = max_buffered or Config.MQTT_STATUS_BUFFER_SIZE
+        self.batch_size = batch_size or Config.MQTT_STATUS_BATCH_SIZE
+        self.flush_interval = flush_interval or Config.MQTT_STATUS_FLUSH_INTERVAL
+        self.stats = {"received": 0, "malformed": 0, "dropped": 0, "written": 0, "flushes": 0, "flush_errors": 0}
+        self._buffer = []
+        self._cond = threading.Condition()
+        self._flusher = ProcessThread(self._run_flusher, on_start=self._reset_buffer)
+
+    def on_message(self, client, userdata, message):
+        """paho on_message callback for the status subscription."""
+        report = parse_status_message(message.topic, message.payload)
+        if report is None:
+            with self._cond:
+                self.stats['malformed'] += 1
+            return
+        self.offer(report)
+
+    def offer(self, report):
+        """Buffers a report without blocking. Returns False if the buffer is full and the report was dropped."""
+        self._flusher.start()
+        with self._cond:
+            self.stats['received'] += 1
+            if len(self._buffer) >= self.max_buffered:
+                self.stats['dropped'] += 1
+                return False
+            self._buffer.append(report)
+            if len(self._buffer) >= self.batch_size:
+                self._cond.notify()
+        return True
+
+    def flush(self):
+        """Writes everything buffered so far. Returns how many reports were written, or None if the write failed."""
+        with self._cond:
+            batch, self._buffer = self._buffer, []
+        if not batch:
+            return 0
+        try:
+            write_status_reports(batch)
+            acks = {r['relay_id']: r['seq'] for r in batch if 'seq' in r}
+            if acks:
+                command_queue.ack_many(acks)
+        except Exception as e:
+            print(f"Error writing {len(batch)} device status reports: {e}")
+            with self._cond:
+                self.stats['flush_errors'] += 1
+                # Put the batch back in front of newer reports, as far as the buffer has room.
+                room = max(self.max_buffered - len(self._buffer), 0)
+                self.stats['dropped'] += max(len(batch) - room, 0)
+                self._buffer[:0] = batch[-room:] if room else []
+            return None
+        with self._cond:
+            self.stats['written'] += len(batch)
+            self.stats['flushes'] += 1
+        return len(batch)
+
+    def info(self):
+        with self._cond:
+            return dict(self.stats, buffered=len(self._buffer), max_buffered=self.max_buffered)
+
+    def _run_flusher(self):
+        while True:
+            with self._cond:
+                if len(self._buffer) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+            if self.flush() is None:
+                time.sleep(self.flush_interval)  # Give Redis a moment before retrying the batch
+
+    def _reset_buffer(self):
+        # Reports a forked worker inherited were its parent's to write.
+        with self._cond:
+            self._buffer = []
+
+status_ingestor = StatusIngestor()
@@ -1,7 +1,9 @@
 from flask import redirect, url_for, current_app
 from flask_login import login_user
 from auth.models import User, create_default_user_data, get_user_by_email
-from database.redis_db import get_all_users_from_db, get_all_data_from_db, save_all_users_to_db, save_all_data_to_db
+from database.redis_db import get_user_settings_from_db, save_user_settings_to_db, save_user_data_to_db
+from database.users_db import get_user_by_provider_id, save_user_record, next_user_id
+from database.events import publish_change
 import re
 
 def validate_email(email):
@@ -64,16 +66,12 @@ def find_or_create_oauth_user(profile):
             current_app.logger.error(f"Invalid provider ID for {provider}: {provider_id}")
             return redirect(url_for('frontend.error_page', error_message='Invalid provider information.'))
         
-        all_data = get_all_data_from_db()
-        all_users = get_all_users_from_db()
-        
         # --- Robust User Finding Logic ---
         user_record = None
         
         # Priority 1: Find user by their unique OAuth provider ID.
         if provider and provider_id:
-            provider_id_str = str(provider_id)
-            user_record = next((u for u in all_users if u.get(f"{provider}_id") == provider_id_str), None)
+            user_record = get_user_by_provider_id(provider, provider_id)
         
         # Priority 2: If not found, find by email address.
         if not user_record and email:
@@ -81,43 +79,44 @@ def find_or_create_oauth_user(profile):
         
         # --- Case 1: User Exists ---
         if user_record:
-            # Get a direct reference to the user's dictionary in the list to update it
-            user_to_update = next((u for u in all_users if u['id'] == user_record['id']), None)
-            user_data_to_update = all_data.get(user_record['id'])
+            user_to_update = user_record
+            # Only the settings are loaded and saved back: rewriting the whole user data here
+            # would revert any change made to the user's rooms while they were logging in.
+            settings_to_update = get_user_settings_from_db(user_record['id'])
             
-            if not user_to_update or not user_data_to_update:
+            if not settings_to_update:
                 current_app.logger.error(f"Data inconsistency for user ID: {user_record['id']}")
                 return redirect(url_for('frontend.error_page', error_message='Data inconsistency detected.'))
             
             # Always update name on login (but validate first)
             user_to_update['username'] = name
-            user_data_to_update['user_settings']['name'] = name
+            settings_to_update['name'] = name
             
             # Update email if provided and valid
-            if email and not user_data_to_update['user_settings'].get('email'):
-                user_data_to_update['user_settings']['email'] = email
+            if email and not settings_to_update.get('email'):
+                settings_to_update['email'] = email
             
             # Only update the main picture if a new one is provided
             if picture:
-                user_data_to_update['user_settings']['picture'] = picture
+                settings_to_update['picture'] = picture
             
             # Link the new OAuth provider if it's an OAuth login
             if provider and provider_id:
                 # Check if this provider ID is already linked to another user
-                existing_user = next((u for u in all_users if u.get(f"{provider}_id") == str(provider_id) and u['id'] != user_record['id']), None)
-                if existing_user:
+                existing_user = get_user_by_provider_id(provider, provider_id)
+                if existing_user and existing_user['id'] != user_record['id']:
                     current_app.logger.warning(f"Attempted to link {provider} ID {provider_id} to user {user_record['id']}, but it's already linked to user {existing_user['id']}")
                     return redirect(url_for('frontend.error_page', error_message=f'This {provider.title()} account is already linked to another user.'))
                 
                 user_to_update[f"{provider}_id"] = str(provider_id)
                 
                 if provider == 'google' and picture:
-                    user_data_to_update['user_settings']['google_picture'] = picture
+                    settings_to_update['google_picture'] = picture
                 elif provider == 'github':
                     if picture:
-                        user_data_to_update['user_settings']['github_picture'] = picture
+                        settings_to_update['github_picture'] = picture
                     if profile_url:
-                        user_data_to_update['user_settings']['github_profile_url'] = profile_url
+                        settings_to_update['github_profile_url'] = profile_url
             
             final_user_record = user_to_update
             
@@ -125,7 +124,7 @@ def find_or_create_oauth_user(profile):
         else:
             # Check if provider ID already exists for new user creation
             if provider and provider_id:
-                existing_user = next((u for u in all_users if u.get(f"{provider}_id") == str(provider_id)), None)
+                existing_user = get_user_by_provider_id(provider, provider_id)
                 if existing_user:
                     current_app.logger.warning(f"Attempted to create new user with existing {provider} ID {provider_id}")
                     return redirect(url_for('frontend.error_page', error_message=f'This {provider.title()} account is already registered.'))
@@ -139,7 +138,7 @@ def find_or_create_oauth_user(profile):
             
             # Generate new user ID safely
             try:
-                new_user_id = str(max(int(u['id']) for u in all_users) + 1) if all_users else "1"
+                new_user_id = next_user_id()
             except (ValueError, TypeError):
                 current_app.logger.error("Error generating new user ID")
                 return redirect(url_for('frontend.error_page', error_message='System error. Please try again.'))
@@ -151,7 +150,6 @@ def find_or_create_oauth_user(profile):
                 'google_id': str(provider_id) if provider == 'google' else None,
                 'github_id': str(provider_id) if provider == 'github' else None,
             }
-            all_users.append(final_user_record)
             
             # Create and add the new user's application data
             user_data_to_update = create_default_user_data(name=name, email=email)
@@ -166,13 +164,15 @@ def find_or_create_oauth_user(profile):
                     user_data_to_update['user_settings']['github_picture'] = picture
                 if profile_url:
                     user_data_to_update['user_settings']['github_profile_url'] = profile_url
-                    
-            all_data[new_user_id] = user_data_to_update
         
         # Save all changes back to the database
         try:
-            save_all_users_to_db(all_users)
-            save_all_data_to_db(all_data)
+            save_user_record(final_user_record)
+            if user_record:
+                save_user_settings_to_db(final_user_record['id'], settings_to_update)
+                publish_change(final_user_record['id'], ['settings'])
+            else:
+                save_user_data_to_db(final_user_record['id'], user_data_to_update)
         except Exception as e:
             current_app.logger.error(f"Database save error: {e}")
             return redirect(url_for('frontend.error_page', error_message='Failed to save user data. Please try again.'))
@@ -1,7 +1,9 @@
 from flask import Blueprint, redirect, url_for, request, flash, render_template, session
 from flask_login import login_required, current_user, login_user
 from oauth.helpers import find_or_create_oauth_user
-from database.redis_db import get_all_users_from_db, get_all_data_from_db, save_all_users_to_db, save_all_data_to_db
+from database.redis_db import get_user_settings_from_db, save_user_settings_to_db
+from database.users_db import get_user_record, get_user_by_provider_id, save_user_record
+from database.events import publish_change
 import secrets
 import hashlib
 import hmac
@@ -185,8 +187,7 @@ def authorize_github():
 @login_required
 def link_google():
     try:
-        all_users = get_all_users_from_db()
-        user_record = next((u for u in all_users if u['id'] == current_user.id), None)
+        user_record = get_user_record(current_user.id)
         
         if user_record and user_record.get('google_id'):
             flash("Your account is already linked to Google.", "info")
@@ -210,8 +211,7 @@ def link_google():
 @login_required
 def link_github():
     try:
-        all_users = get_all_users_from_db()
-        user_record = next((u for u in all_users if u['id'] == current_user.id), None)
+        user_record = get_user_record(current_user.id)
 
         if user_record and user_record.get('github_id'):
             flash("Your account is already linked to GitHub.", "info")
@@ -260,30 +260,28 @@ def link_authorize_google():
             
         user_info = oauth_client.google.get('userinfo').json()
 
-        all_users = get_all_users_from_db()
-        all_data = get_all_data_from_db()
-
-        user_record = next((u for u in all_users if u['id'] == current_user.id), None)
-        user_profile_data = all_data.get(current_user.id)
+        user_record = get_user_record(current_user.id)
+        user_settings = get_user_settings_from_db(current_user.id)
         
-        if not user_record or not user_profile_data:
+        if not user_record or not user_settings:
             flash("A data inconsistency was detected. Please contact support.", "error")
             return redirect(url_for('frontend.settings'))
 
         # Check if this Google account is already linked to another user
         google_id = str(user_info.get('sub'))
-        existing_user = next((u for u in all_users if u.get('google_id') == google_id and u['id'] != current_user.id), None)
-        if existing_user:
+        existing_user = get_user_by_provider_id('google', google_id)
+        if existing_user and existing_user['id'] != current_user.id:
             flash("This Google account is already linked to another user.", "error")
             return redirect(url_for('frontend.settings'))
 
         user_record['google_id'] = google_id
-        user_profile_data['user_settings']['google_picture'] = user_info.get('picture')
-        if not user_profile_data['user_settings'].get('email'):
-            user_profile_data['user_settings']['email'] = user_info.get('email', '').lower().strip()
+        user_settings['google_picture'] = user_info.get('picture')
+        if not user_settings.get('email'):
+            user_settings['email'] = user_info.get('email', '').lower().strip()
 
-        save_all_users_to_db(all_users)
-        save_all_data_to_db(all_data)
+        save_user_record(user_record)
+        save_user_settings_to_db(current_user.id, user_settings)
+        publish_change(current_user.id, ['settings'])
 
         # Clear OAuth session data
         session.pop('oauth_state', None)
@@ -331,29 +329,27 @@ def link_authorize_github():
             
         user_info = oauth_client.github_link.get('user').json()
         
-        all_users = get_all_users_from_db()
-        all_data = get_all_data_from_db()
-
-        user_record = next((u for u in all_users if u['id'] == current_user.id), None)
-        user_profile_data = all_data.get(current_user.id)
+        user_record = get_user_record(current_user.id)
+        user_settings = get_user_settings_from_db(current_user.id)
 
-        if not user_record or not user_profile_data:
+        if not user_record or not user_settings:
             flash("A data inconsistency was detected. Please contact support.", "error")
             return redirect(url_for('frontend.settings'))
 
         # Check if this GitHub account is already linked to another user
         github_id = str(user_info.get('id'))
-        existing_user = next((u for u in all_users if u.get('github_id') == github_id and u['id'] != current_user.id), None)
-        if existing_user:
+        existing_user = get_user_by_provider_id('github', github_id)
+        if existing_user and existing_user['id'] != current_user.id:
             flash("This GitHub account is already linked to another user.", "error")
             return redirect(url_for('frontend.settings'))
 
         user_record['github_id'] = github_id
-        user_profile_data['user_settings']['github_picture'] = user_info.get('avatar_url')
-        user_profile_data['user_settings']['github_profile_url'] = user_info.get('html_url')
+        user_settings['github_picture'] = user_info.get('avatar_url')
+        user_settings['github_profile_url'] = user_info.get('html_url')
         
-        save_all_users_to_db(all_users)
-        save_all_data_to_db(all_data)
+        save_user_record(user_record)
+        save_user_settings_to_db(current_user.id, user_settings)
+        publish_change(current_user.id, ['settings'])
         
         # Clear OAuth session data
         session.pop('oauth_state', None)
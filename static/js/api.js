@@ -234,6 +234,16 @@ window.ApplianceAPI = {
         return response;
     },
 
+    // Several operations in one request, e.g. [{ op: 'set-lock', args: { room_id, appliance_id, locked } }]
+    async runBatch(operations, atomic = false) {
+        const response = await fetch('/api/batch', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ operations: operations, atomic: atomic })
+        });
+        return response;
+    },
+
     // AI detection and control
     async sendAIDetectionSignal(roomId, state) {
         await fetch('/api/ai-detection-signal', {
@@ -85,10 +85,10 @@ window.DOMHelpers = {
                     timerElement.classList.remove('hidden');
                     cancelButton.classList.remove('hidden');
                 } else {
+                    // The server switches the appliance off; its change event refreshes the card
                     timerElement.textContent = `Timer Off`;
                     clearInterval(window.RelayConfig.timerIntervals[appliance.id]);
                     cancelButton.classList.add('hidden');
-                    window.ApplianceAPI.sendApplianceState(window.RelayConfig.currentRoomId, appliance.id, false);
                     toggleInput.checked = false;
                 }
             };
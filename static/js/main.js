@@ -16,6 +16,15 @@ window.RelayApp = {
         // Initial data fetch
         window.ApplianceAPI.fetchRoomsAndAppliances();
 
+        await this.loadUserSettings();
+        
+        // Keep the dashboard up to date from the server's change stream
+        this.startLiveUpdates();
+        
+        console.log('Relay Control Panel initialized successfully');
+    },
+
+    async loadUserSettings() {
         try {
             const response = await fetch('/api/get-user-settings');
             if (response.ok) {
@@ -25,13 +34,84 @@ window.RelayApp = {
         } catch (e) {
             console.warn("Could not fetch user settings. Email notifications may not work.");
         }
-        
-        // Set up periodic data refresh
+    },
+
+    // Listens to /api/events, which sends a `change` event whenever this user's data changes
+    startLiveUpdates() {
+        if (!window.EventSource) {
+            this.startPolling();
+            return;
+        }
+        let connectedBefore = false;
+        const source = new EventSource('/api/events');
+        source.addEventListener('open', () => {
+            // After a reconnect, catch up on anything that changed while the stream was down
+            if (connectedBefore) {
+                this.scheduleRefresh(true);
+            }
+            connectedBefore = true;
+        });
+        source.addEventListener('change', (event) => this.applyChange(JSON.parse(event.data)));
+        source.addEventListener('error', () => {
+            // The browser retries dropped streams by itself; a closed one means the server cannot stream
+            if (source.readyState === EventSource.CLOSED) {
+                this.startPolling();
+            }
+        });
+    },
+
+    // Fallback for browsers or servers without event streams
+    startPolling() {
         setInterval(() => {
             window.ApplianceAPI.fetchRoomsAndAppliances();
         }, 3000);
-        
-        console.log('Relay Control Panel initialized successfully');
+    },
+
+    applyChange(change) {
+        const parts = change.parts || [];
+        if (parts.includes('settings')) {
+            this.loadUserSettings();
+        }
+        if (parts.includes('boards')) {
+            this.scheduleRefresh(true);
+        } else if (change.appliance && this.updateAppliance(change.room_id, change.appliance)) {
+            return;
+        } else if (parts.includes('rooms')) {
+            this.scheduleRefresh(false);
+        }
+    },
+
+    // Updates a single appliance in place; returns false if it is not in the loaded data
+    updateAppliance(roomId, appliance) {
+        const room = window.RelayConfig.allRoomsData.find(r => r.id === roomId);
+        const index = room ? room.appliances.findIndex(a => a.id === appliance.id) : -1;
+        if (index === -1) {
+            return false;
+        }
+        room.appliances[index] = appliance;
+        window.RoomRenderer.renderRooms(window.RelayConfig.allRoomsData);
+        if (window.RelayConfig.currentRoomId === roomId) {
+            window.ApplianceRenderer.renderAppliances(room.appliances, room.name);
+        }
+        return true;
+    },
+
+    // Coalesces a burst of changes into one refetch
+    scheduleRefresh(includeBoards) {
+        this.refreshBoards = this.refreshBoards || includeBoards;
+        if (this.refreshTimer) {
+            return;
+        }
+        this.refreshTimer = setTimeout(() => {
+            const includeBoards = this.refreshBoards;
+            this.refreshTimer = null;
+            this.refreshBoards = false;
+            if (includeBoards) {
+                window.ApplianceAPI.fetchDashboardData();
+            } else {
+                window.ApplianceAPI.fetchRoomsAndAppliances();
+            }
+        }, 100);
     }
 };
 
@@ -1,19 +1,32 @@
+from flask import Response, request, jsonify
 from flask_login import current_user
-from database.redis_db import get_all_data_from_db, save_all_data_to_db
+from database.redis_db import get_user_settings_from_db, fresh_reads
+from database.ordering import get_rooms_with_pending_order
+from database.events import get_user_version
 
-def get_user_data():
-    """Gets the current user's data from Redis."""
-    all_data = get_all_data_from_db()
-    return all_data.get(current_user.id, {})
+def get_user_rooms():
+    """Gets only the current user's rooms list from Redis, including any not-yet-written drag & drop order (None if the user has no data)."""
+    return get_rooms_with_pending_order(current_user.id)
 
-def save_user_data(user_data):
-    """Saves the current user's data to Redis."""
-    all_data = get_all_data_from_db()
-    all_data[current_user.id] = user_data
-    save_all_data_to_db(all_data)
+def versioned_json(build, etag_suffix=''):
+    """
+    Answers a dashboard read with the current user's data version as its ETag:
+    304 Not Modified if the client already has that version (without calling
+    `build`), otherwise build()'s result as JSON. Browsers revalidate with
+    If-None-Match on their own, so plain fetch() calls benefit too.
+    The body is read past the process cache, which may still hold data older
+    than the version.
+    """
+    etag = f"v{get_user_version(current_user.id)}{etag_suffix}"
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        with fresh_reads():
+            response = jsonify(build())
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 def get_current_user_theme():
     """Gets the theme for the currently logged-in user from Redis."""
-    all_data = get_all_data_from_db()
-    user_data = all_data.get(current_user.id, {})
-    return user_data.get("user_settings", {}).get("theme", "light")
+    return get_user_settings_from_db(current_user.id).get("theme", "light")
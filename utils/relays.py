@@ -0,0 +1,22 @@
+from database.command_queue import command_queue
+from database.events import publish_change
+from mqtt.client import publish_relay_state
+
+def send_relay_states(appliances):
+    """
+    Sends each appliance's current state to its relay: queued for HTTP
+    check-ins (one pipelined round trip for all of them) and pushed over MQTT.
+    Appliances without a relay are skipped. Returns {relay_id: seq}.
+    """
+    appliances = [a for a in appliances if a.get('relay_id')]
+    seqs = command_queue.enqueue_many({a['relay_id']: {"state": int(a['state'])} for a in appliances})
+    for appliance in appliances:
+        publish_relay_state(appliance.get('board_id'), appliance['relay_id'], appliance['state'], seqs.get(appliance['relay_id']))
+    return seqs
+
+def publish_appliance_changes(user_id, changed):
+    """Tells the user's dashboards about appliances changed together ([(room_id, appliance)]), as one change."""
+    if len(changed) == 1:
+        return publish_change(user_id, ['rooms'], *changed[0])
+    if changed:
+        return publish_change(user_id, ['rooms'], room_ids=sorted({room_id for room_id, _ in changed}))
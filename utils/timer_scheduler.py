@@ -0,0 +1,39 @@
+import time
+import uuid
+from config import Config
+from database.connection import ProcessThread
+from database.timers import hold_timer_lead, fire_due_timers
+from utils.relays import send_relay_states, publish_appliance_changes
+
+# --- Timer Scheduler ---
+# Every process runs this loop, but only the one holding the timer lead (see
+# database/timers.py) fires timers; the others just keep trying to take the
+# lead, so firing carries on within TIMER_LEADER_TTL seconds if the leader dies.
+
+def _fire_due():
+    fired = fire_due_timers()
+    if not fired:
+        return
+    send_relay_states([appliance for _, _, appliance in fired])
+    by_user = {}
+    for user_id, room_id, appliance in fired:
+        by_user.setdefault(user_id, []).append((room_id, appliance))
+    for user_id, switched in by_user.items():
+        publish_appliance_changes(user_id, switched)
+    print(f"Timers fired: switched off {len(fired)} appliance(s).")
+
+def _run_scheduler():
+    token = uuid.uuid4().hex
+    while True:
+        try:
+            if hold_timer_lead(token):
+                _fire_due()
+        except Exception as e:
+            print(f"Error in timer scheduler: {e}")
+        time.sleep(Config.TIMER_POLL_INTERVAL)
+
+_scheduler = ProcessThread(_run_scheduler)
+
+def ensure_timer_scheduler():
+    """Starts the scheduler loop in this process if it is not running yet."""
+    _scheduler.start()